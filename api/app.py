@@ -2,16 +2,54 @@ import os
 from flask import Flask
 from config import CONFIG
 
-from extensions import init_extensions
+from extensions import init_database, init_extensions
+from metrics import init_metrics
+from request_profiler import init_request_profiler
 
 
-def create_app():
+def init_schema(db):
+    """Creates any missing tables and search indexes"""
+    from census.search import install_search_indexes
+
+    db.create_all()
+    install_search_indexes(db.engine)
+
+
+def warm_up():
+    """
+    Imports the modules that requests otherwise load on first use, so that
+    workers forked from a preloaded app inherit them
+    """
+    import anthropic
+    import openpyxl
+    import census.file_handler
+
+
+def load_config(app: Flask):
     ENV = os.environ.get("ENV", "DEV")
-    config = CONFIG.get(ENV)
+    app.config.from_object(CONFIG.get(ENV))
+
+
+def create_worker_app():
+    """
+    App for background worker processes, like the portfolio pool, with the
+    config and database only. There are no routes, and the schema is left
+    to the app that started the workers.
+    """
     app = Flask(__name__)
-    app.config.from_object(config)
+    load_config(app)
+    init_database(app)
+    app.config.from_prefixed_env()
+    return app
+
+
+def create_app():
+    app = Flask(__name__)
+    load_config(app)
 
     app, db, _, api = init_extensions(app)
+    init_metrics(app)
+    init_request_profiler(app)
 
     app.config.from_prefixed_env()
 
@@ -22,8 +60,14 @@ def create_app():
 
         bind_namespaces(api, NAMESPACES, "/api")
 
-        db.metadata.reflect(bind=db.engine)
-        db.create_all()
+        if app.config["SCHEMA_SETUP_ON_START"]:
+            init_schema(db)
+
+    @app.cli.command("init-db")
+    def init_db():
+        """Creates any missing tables and search indexes."""
+        init_schema(db)
+        print("Database is up to date")
 
     print("Successfully started app...")
     return app
@@ -0,0 +1,5 @@
+"""
+Synthetic data and benchmarks for the upload, save age and stats paths.
+Run with `python -m benchmarks --help`; `benchmarks.loadtest` is the
+gunicorn load test and `benchmarks.startup` times a cold start.
+"""
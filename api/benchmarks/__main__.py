@@ -0,0 +1,136 @@
+"""
+Runs the benchmark suite against a throwaway SQLite database (or
+--database-uri) and writes the results as JSON.
+
+    python -m benchmarks --rows 5000 --output results.json
+    python -m benchmarks --baseline baseline.json --threshold 0.2 \\
+        --threshold-for census_stats=0.5
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import platform
+import datetime
+import tempfile
+import subprocess
+
+
+def parse_thresholds(values):
+    thresholds = {}
+    for value in values or []:
+        name, _, threshold = value.rpartition("=")
+        if not name:
+            raise argparse.ArgumentTypeError(f"Expected name=threshold, got {value}")
+        thresholds[name] = float(threshold)
+    return thresholds
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_results(results, comparison):
+    changes = {row["name"]: row for row in comparison}
+    print(f"{'benchmark':32} {'median':>10} {'p95':>10} {'rows/s':>12} {'change':>8}")
+    for name, result in results.items():
+        rows_per_second = result.get("rows_per_second")
+        row = changes.get(name)
+        change = f"{row['change']:+.0%}" if row else ""
+        flag = "  REGRESSED" if row and row["regressed"] else ""
+        print(
+            f"{name:32} {result['median'] * 1000:>8.1f}ms {result['p95'] * 1000:>8.1f}ms "
+            f"{rows_per_second or 0:>12,.0f} {change:>8}{flag}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--tabs", type=int, default=2)
+    parser.add_argument("--extra-columns", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--only", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--database-uri", help="Defaults to a temporary SQLite file")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this results file")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument(
+        "--threshold-for",
+        action="append",
+        metavar="NAME=THRESHOLD",
+        help="Per benchmark regression threshold, may be repeated",
+    )
+    args = parser.parse_args(argv)
+
+    tmpdir = None
+    if args.database_uri is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        args.database_uri = f"sqlite:///{tmpdir.name}/benchmarks.sqlite"
+    # the config reads these at import
+    os.environ["DATABASE_URI"] = args.database_uri
+    os.environ.setdefault("ENV", "TEST")
+
+    from app import create_app
+    from extensions import limiter
+    from .suite import compare, run_suite
+
+    app = create_app()
+    limiter.enabled = False
+    results = run_suite(
+        app,
+        rows=args.rows,
+        repeat=args.repeat,
+        warmup=args.warmup,
+        only=args.only,
+        tabs=args.tabs,
+        extra_columns=args.extra_columns,
+    )
+
+    comparison = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        comparison = compare(
+            results, baseline, args.threshold, parse_thresholds(args.threshold_for)
+        )
+    print_results(results, comparison)
+
+    if args.output:
+        output = {
+            "meta": {
+                "timestamp": datetime.datetime.now().isoformat(),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "sqlite": sqlite3.sqlite_version,
+                "database": args.database_uri.split(":", 1)[0],
+                "params": {
+                    k: getattr(args, k)
+                    for k in ("rows", "tabs", "extra_columns", "repeat", "warmup")
+                },
+            },
+            "results": results,
+            "comparison": comparison,
+        }
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+    return 1 if any(row["regressed"] for row in comparison) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
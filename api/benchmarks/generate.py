@@ -0,0 +1,213 @@
+import io
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+RELATIONSHIPS = ["EE", "SP", "CH"]
+TOBACCO_DISPOSITIONS = ["N", "T"]
+
+# header names as they might appear in a client's workbook
+CENSUS_COLUMNS = {
+    "Relationship": "relationship",
+    "Tobacco Status": "tobacco_disposition",
+    "Coverage Effective Date": "effective_date",
+    "Date of Birth": "birthdate",
+}
+
+
+@dataclass
+class SyntheticFile:
+    """
+    Generated upload. `llm_config` is the tab config the LLM should return
+    for the file, so that a stub client can answer with it.
+    """
+
+    data: bytes
+    filename: str
+    rows: int
+    llm_config: List[Dict] = field(default_factory=list)
+
+    def stream(self):
+        return io.BytesIO(self.data)
+
+
+def census_frame(rows: int, extra_columns: int = 0, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    effective = pd.Timestamp("2019-01-01") + pd.to_timedelta(
+        rng.integers(0, 60, rows) * 30, unit="D"
+    )
+    birthdate = effective - pd.to_timedelta(
+        rng.integers(18 * 365, 70 * 365, rows), unit="D"
+    )
+    df = pd.DataFrame(
+        {
+            "Relationship": rng.choice(RELATIONSHIPS, rows, p=[0.6, 0.25, 0.15]),
+            "Tobacco Status": rng.choice(TOBACCO_DISPOSITIONS, rows, p=[0.85, 0.15]),
+            "Coverage Effective Date": effective.normalize(),
+            "Date of Birth": birthdate.normalize(),
+        }
+    )
+    # columns the upload should ignore, alternating numbers and text
+    for i in range(extra_columns):
+        if i % 2:
+            df[f"Extra {i:02}"] = rng.choice(["A", "B", "C", "D"], rows)
+        else:
+            df[f"Extra {i:02}"] = rng.normal(50000, 15000, rows).round(2)
+    return df
+
+
+def _junk_rows(junk_rows: int, width: int):
+    rows = [["Synthetic census export"], ["Generated for benchmarking"]]
+    rows += [[f"Note {i}"] for i in range(max(junk_rows - 2, 0))]
+    return [row + [None] * (width - 1) for row in rows[:junk_rows]]
+
+
+def census_workbook(
+    rows: int = 1000,
+    tabs: int = 1,
+    junk_rows: int = 3,
+    extra_columns: int = 0,
+    start_col: int = 1,
+    fmt: str = "xlsx",
+    seed: int = 0,
+) -> SyntheticFile:
+    """
+    Census spread across `tabs` tabs, each with `junk_rows` title rows above
+    the header and `start_col` blank leading columns. Workbooks also get a
+    tab without census data. A csv always has a single tab.
+    """
+    if fmt not in ("xlsx", "csv"):
+        raise ValueError("fmt must be xlsx or csv")
+    if fmt == "csv":
+        tabs = 1
+
+    df = census_frame(rows, extra_columns, seed)
+    width = len(df.columns)
+    header_row = junk_rows + 1 if junk_rows else 0
+    config = {
+        "start_row_number": header_row + 1,
+        "start_column_number": start_col + 1,
+        "column_mapper": CENSUS_COLUMNS,
+    }
+    junk = _junk_rows(junk_rows, width)
+    if junk:
+        # a blank row between the titles and the header
+        junk.append([None] * width)
+
+    if fmt == "csv":
+        dates = df.select_dtypes("datetime").columns
+        values = df.astype({col: str for col in dates}).values.tolist()
+        lines = junk + [list(df.columns)] + values
+        table = pd.DataFrame([[None] * start_col + line for line in lines])
+        buf = io.BytesIO()
+        table.to_csv(buf, index=False, header=False)
+        return SyntheticFile(
+            buf.getvalue(), "census.csv", rows, [{"tab_name": "default", **config}]
+        )
+
+    buf = io.BytesIO()
+    llm_config = []
+    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+        for i, chunk in enumerate(np.array_split(np.arange(rows), tabs)):
+            tab = f"Census {i + 1}"
+            pd.DataFrame(junk).to_excel(
+                writer, sheet_name=tab, startcol=start_col, index=False, header=False
+            )
+            df.iloc[chunk].to_excel(
+                writer,
+                sheet_name=tab,
+                startrow=header_row,
+                startcol=start_col,
+                index=False,
+            )
+            llm_config.append({"tab_name": tab, **config})
+        pd.DataFrame({"Notes": ["Rates quoted monthly"]}).to_excel(
+            writer, sheet_name="Notes", index=False
+        )
+    return SyntheticFile(buf.getvalue(), "census.xlsx", rows, llm_config)
+
+
+def rate_table(
+    band_width: int = 5,
+    max_age: int = 100,
+    age_band_column: bool = True,
+    fmt: str = "xlsx",
+) -> SyntheticFile:
+    """
+    Long rate table with one row per age band, relationship and tobacco
+    disposition. Bands are either an `Age Band` column (e.g. `40-44`) or
+    `Lower Age`/`Upper Age` columns.
+    """
+    if fmt not in ("xlsx", "csv"):
+        raise ValueError("fmt must be xlsx or csv")
+    records = []
+    for lower in range(0, max_age, band_width):
+        upper = lower + band_width - 1
+        for relationship in RELATIONSHIPS:
+            for tobacco in TOBACCO_DISPOSITIONS:
+                rate = round(5 + lower**1.6 / 10 * (1.5 if tobacco == "T" else 1), 2)
+                band = (
+                    {"Age Band": f"{lower}-{upper}"}
+                    if age_band_column
+                    else {"Lower Age": lower, "Upper Age": upper}
+                )
+                records.append(
+                    {
+                        **band,
+                        "Relationship": relationship,
+                        "Tobacco": tobacco,
+                        "Rate": rate,
+                    }
+                )
+    df = pd.DataFrame(records)
+    buf = io.BytesIO()
+    if fmt == "csv":
+        df.to_csv(buf, index=False)
+    else:
+        df.to_excel(buf, index=False)
+    return SyntheticFile(buf.getvalue(), f"rates.{fmt}", len(df))
+
+
+def rate_matrix(
+    max_age: int = 100,
+    relationships: List[str] = None,
+    stacked_header: bool = False,
+    fmt: str = "xlsx",
+) -> SyntheticFile:
+    """
+    Rate matrix as carriers send it, with one row per age and a column per
+    relationship and tobacco disposition, labelled like `EE T`. With
+    `stacked_header`, the relationships are a header row above the tobacco
+    dispositions instead, shown once per relationship as if merged.
+    `rows` is the number of rate cells.
+    """
+    if fmt not in ("xlsx", "csv"):
+        raise ValueError("fmt must be xlsx or csv")
+    relationships = relationships or RELATIONSHIPS
+    ages = np.arange(max_age)
+    columns = {"Age": ages}
+    for relationship in relationships:
+        for tobacco in TOBACCO_DISPOSITIONS:
+            factor = 1.5 if tobacco == "T" else 1
+            columns[f"{relationship} {tobacco}"] = (
+                5 + ages**1.6 / 10 * factor
+            ).round(2)
+    df = pd.DataFrame(columns)
+    cells = len(df) * (len(df.columns) - 1)
+
+    if stacked_header:
+        top = ["Age"] + [
+            relationship if tobacco == TOBACCO_DISPOSITIONS[0] else ""
+            for relationship in relationships
+            for tobacco in TOBACCO_DISPOSITIONS
+        ]
+        bottom = [""] + TOBACCO_DISPOSITIONS * len(relationships)
+        df = pd.DataFrame([bottom, *df.astype(object).to_numpy().tolist()], columns=top)
+
+    buf = io.BytesIO()
+    if fmt == "csv":
+        df.to_csv(buf, index=False)
+    else:
+        df.to_excel(buf, index=False)
+    return SyntheticFile(buf.getvalue(), f"rate_matrix.{fmt}", cells)
@@ -0,0 +1,160 @@
+"""
+Local stand-in for the Anthropic messages API. Point the app at it with
+`ANTHROPIC_BASE_URL=http://127.0.0.1:<port>`.
+
+    python -m benchmarks.llm_server --port 8787 --latency 2 --jitter 0.5 \\
+        --response config.json
+"""
+
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubLLMRequestHandler(BaseHTTPRequestHandler):
+    server: "StubLLMServer"
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/messages":
+            return self.reply(404, {"type": "error", "error": {"type": "not_found"}})
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        request = json.loads(body or b"{}")
+        with self.server.in_flight():
+            failed = self.server.wait()
+        if failed:
+            return self.reply(
+                529, {"type": "error", "error": {"type": "overloaded_error"}}
+            )
+
+        text = json.dumps(self.server.response)
+        self.reply(
+            200,
+            {
+                "id": f"msg_{uuid.uuid4().hex}",
+                "type": "message",
+                "role": "assistant",
+                "model": request.get("model") or "stub",
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                # roughly 4 characters per token
+                "usage": {
+                    "input_tokens": len(body) // 4,
+                    "output_tokens": len(text) // 4,
+                },
+            },
+        )
+
+    def reply(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        try:
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up, e.g. a timed out or hedged request
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """
+    Answers every `POST /v1/messages` with `response` as the text content,
+    after `latency` seconds plus up to `jitter` seconds either way. A share
+    `error_rate` of requests fail with a 529 overloaded error instead.
+    `max_concurrent` is the most requests that were in progress at once.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        response=None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        error_rate: float = 0.0,
+    ):
+        super().__init__((host, port), StubLLMRequestHandler)
+        self.response = response
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = 0
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @contextmanager
+    def in_flight(self):
+        with self._lock:
+            self.calls += 1
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.concurrent -= 1
+
+    def wait(self):
+        """Sleeps for the latency, and returns True if the request should fail"""
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        return random.random() < self.error_rate
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.llm_server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--response", help="JSON file with the response to return")
+    args = parser.parse_args(argv)
+
+    response = None
+    if args.response:
+        with open(args.response) as f:
+            response = json.load(f)
+    server = StubLLMServer(
+        response, args.latency, args.jitter, args.host, args.port, args.error_rate
+    )
+    print(f"Stub LLM server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
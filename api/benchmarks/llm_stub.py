@@ -0,0 +1,42 @@
+import json
+import asyncio
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+
+class StubMessages:
+    def __init__(self, client):
+        self.client = client
+
+    async def create(self, **kwargs):
+        self.client.calls += 1
+        if self.client.latency:
+            await asyncio.sleep(self.client.latency)
+        text = json.dumps(self.client.response)
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text=text)])
+
+
+class StubLLMClient:
+    """
+    Stands in for `anthropic.AsyncAnthropic`, answering every `messages.create`
+    with `response` after `latency` seconds
+    """
+
+    def __init__(self, response=None, latency: float = 0.0):
+        self.response = response
+        self.latency = latency
+        self.calls = 0
+        self.messages = StubMessages(self)
+
+
+@contextmanager
+def stub_llm_client(client: StubLLMClient):
+    from census.mixins import CensusProcessorLLMMixin
+
+    # read from __dict__ so a lazy client isn't built just to be replaced
+    original = CensusProcessorLLMMixin.__dict__["LLM_CLIENT"]
+    CensusProcessorLLMMixin.LLM_CLIENT = client
+    try:
+        yield client
+    finally:
+        CensusProcessorLLMMixin.LLM_CLIENT = original
@@ -0,0 +1,366 @@
+"""
+Load test: runs the app under gunicorn against a throwaway SQLite database,
+with the LLM answered by a local stub server, and drives a mix of uploads,
+grid paging and stats at increasing concurrency.
+
+    python -m benchmarks.loadtest --concurrency 1,4,16 --duration 30 \\
+        --workers 2 --threads 4 --llm-latency 2 --mix save_age=5,census_upload=1
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from typing import Dict, List
+import httpx
+from . import generate as gen
+from .llm_server import StubLLMServer
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = {
+    "census_upload": 1,
+    "save_age": 4,
+    "census_details": 3,
+    "census_stats": 2,
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: List[float], q: float):
+    """Nearest rank percentile of sorted `values`"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(q * len(values)) - 1))]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(
+                f"Unknown scenario {name}, expected one of {', '.join(DEFAULT_MIX)}"
+            )
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class AppServer:
+    """
+    Runs `app:create_app()` under gunicorn with gunicorn.conf.py. The schema
+    is set up by `flask init-db` first, as in the container.
+    """
+
+    def __init__(
+        self,
+        env: dict,
+        workers: int = 2,
+        threads: int = 4,
+        log_path=None,
+        preload: bool = True,
+    ):
+        self.env = {
+            **os.environ,
+            "SCHEMA_SETUP_ON_START": "N",
+            "GUNICORN_PRELOAD": "Y" if preload else "N",
+            **env,
+        }
+        self.workers = workers
+        self.threads = threads
+        self.port = free_port()
+        self.log_path = log_path or os.devnull
+        self.process = None
+        self.ready_seconds = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def init_database(self):
+        subprocess.run(
+            [sys.executable, "-m", "flask", "--app", "app", "init-db"],
+            cwd=API_DIR,
+            env=self.env,
+            check=True,
+            capture_output=True,
+        )
+
+    def start(self, timeout: float = 60):
+        self.init_database()
+        self.log = open(self.log_path, "w")
+        start = time.monotonic()
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                "--bind",
+                f"127.0.0.1:{self.port}",
+                "--workers",
+                str(self.workers),
+                "--threads",
+                str(self.threads),
+                "--timeout",
+                "300",
+                "app:create_app()",
+            ],
+            cwd=API_DIR,
+            env=self.env,
+            stdout=self.log,
+            stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited, see {self.log_path}")
+            try:
+                if httpx.get(f"{self.url}/api/metrics").status_code == 200:
+                    self.ready_seconds = time.monotonic() - start
+                    return self
+            except httpx.TransportError:
+                pass
+            time.sleep(0.25)
+        self.stop()
+        raise RuntimeError(f"gunicorn did not start in {timeout}s")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+            self.log.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class Traffic:
+    """
+    The requests making up the mix. `seed` uploads the rate table and census
+    that the save age, details and stats requests run against.
+    """
+
+    def __init__(self, base_url: str, upload_rows: int = 2000):
+        self.base_url = base_url
+        self.census = gen.census_workbook(upload_rows, tabs=2, extra_columns=10)
+        self.rates = gen.rate_table()
+        self.rows = upload_rows
+        self.census_master_id = None
+        self.rate_master_id = None
+
+    def seed(self, client: httpx.Client):
+        response = self.rate_upload(client)
+        response.raise_for_status()
+        self.rate_master_id = response.json()["rate_master_id"]
+        response = self.census_upload(client)
+        response.raise_for_status()
+        self.census_master_id = response.json()["data"]["census_master_id"]
+
+    def rate_upload(self, client: httpx.Client):
+        files = {"file": (self.rates.filename, self.rates.data)}
+        return client.post(f"{self.base_url}/api/rates/upload", files=files)
+
+    def census_upload(self, client: httpx.Client):
+        files = {"file": (self.census.filename, self.census.data)}
+        return client.post(f"{self.base_url}/api/census/upload", files=files)
+
+    def random_offset(self, limit: int = 100):
+        return random.randrange(0, max(self.rows - limit, 1))
+
+    def save_age(self, client: httpx.Client):
+        return client.post(
+            f"{self.base_url}/api/save-age",
+            params={"offset": self.random_offset(), "limit": 100},
+            json={
+                "effective_date": "2025-01-01",
+                "rate_master_id": self.rate_master_id,
+                "census_master_id": self.census_master_id,
+            },
+        )
+
+    def census_details(self, client: httpx.Client):
+        return client.get(
+            f"{self.base_url}/api/census/{self.census_master_id}/details",
+            params={"offset": self.random_offset(), "limit": 100},
+        )
+
+    def census_stats(self, client: httpx.Client):
+        return client.get(f"{self.base_url}/api/census/{self.census_master_id}/stats")
+
+
+def run_stage(
+    traffic: Traffic, mix: Dict[str, float], concurrency: int, duration: float
+):
+    """
+    Runs `concurrency` clients in a closed loop for `duration` seconds, each
+    picking its next request from `mix`. Returns the (scenario, status,
+    seconds, error) samples and the elapsed time.
+    """
+    names, weights = list(mix), list(mix.values())
+    samples = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client_loop():
+        with httpx.Client(timeout=300) as client:
+            while time.monotonic() < deadline:
+                name = random.choices(names, weights)[0]
+                start = time.perf_counter()
+                error = None
+                try:
+                    response = getattr(traffic, name)(client)
+                    status = response.status_code
+                    if status >= 400:
+                        error = response.text[:200]
+                except httpx.HTTPError as e:
+                    status, error = None, repr(e)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    samples.append((name, status, elapsed, error))
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.monotonic() - start
+
+
+def summarize(samples, elapsed: float):
+    by_name = defaultdict(list)
+    for name, status, seconds, error in samples:
+        by_name[name].append((seconds, error))
+        by_name["all"].append((seconds, error))
+
+    summary = {}
+    for name, rows in by_name.items():
+        times = sorted(seconds for seconds, _ in rows)
+        errors = [error for _, error in rows if error is not None]
+        summary[name] = {
+            "requests": len(rows),
+            "errors": len(errors),
+            "first_error": errors[0] if errors else None,
+            "throughput": len(rows) / elapsed,
+            "p50": percentile(times, 0.50),
+            "p95": percentile(times, 0.95),
+            "p99": percentile(times, 0.99),
+            "max": times[-1],
+        }
+    return summary
+
+
+def print_summary(concurrency: int, summary: dict):
+    print(f"\nconcurrency={concurrency}")
+    print(
+        f"{'endpoint':16} {'requests':>9} {'errors':>7} {'req/s':>8} "
+        f"{'p50':>9} {'p95':>9} {'p99':>9}"
+    )
+    for name, row in sorted(summary.items(), key=lambda item: item[0] == "all"):
+        print(
+            f"{name:16} {row['requests']:>9} {row['errors']:>7} "
+            f"{row['throughput']:>8.1f} {row['p50'] * 1000:>7.0f}ms "
+            f"{row['p95'] * 1000:>7.0f}ms {row['p99'] * 1000:>7.0f}ms"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadtest")
+    parser.add_argument(
+        "--concurrency",
+        default="1,4,16",
+        help="Comma separated concurrency levels, each run for --duration",
+    )
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--upload-rows", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", action="store_true", help="Keep rate limits")
+    parser.add_argument("--no-preload", action="store_true")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        traffic = Traffic(None, args.upload_rows)
+        llm = StubLLMServer(
+            traffic.census.llm_config,
+            args.llm_latency,
+            args.llm_jitter,
+            error_rate=args.llm_error_rate,
+        ).start()
+        env = {
+            "ENV": "PROD",
+            "DATABASE_URI": f"sqlite:///{tmpdir}/loadtest.sqlite",
+            "ANTHROPIC_BASE_URL": llm.url,
+            "ANTHROPIC_API_KEY": "stub",
+            "ANTHROPIC_MODEL_ID": "stub",
+            "RATELIMIT_ENABLED": "Y" if args.rate_limit else "N",
+        }
+        log_path = os.path.join(tmpdir, "gunicorn.log")
+        try:
+            with AppServer(
+                env, args.workers, args.threads, log_path, not args.no_preload
+            ) as server:
+                traffic.base_url = server.url
+                with httpx.Client(timeout=300) as client:
+                    traffic.seed(client)
+                results = []
+                for concurrency in levels:
+                    samples, elapsed = run_stage(
+                        traffic, args.mix, concurrency, args.duration
+                    )
+                    summary = summarize(samples, elapsed)
+                    print_summary(concurrency, summary)
+                    results.append({"concurrency": concurrency, "endpoints": summary})
+        except Exception:
+            if os.path.exists(log_path):
+                with open(log_path) as f:
+                    print(f.read()[-5000:], file=sys.stderr)
+            raise
+        finally:
+            llm.stop()
+
+    if args.output:
+        params = {
+            k: getattr(args, k)
+            for k in (
+                "duration",
+                "mix",
+                "upload_rows",
+                "workers",
+                "threads",
+                "llm_latency",
+                "llm_jitter",
+                "llm_error_rate",
+            )
+        }
+        with open(args.output, "w") as f:
+            json.dump({"params": params, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
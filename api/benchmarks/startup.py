@@ -0,0 +1,133 @@
+"""
+Startup benchmark: times importing and creating the app in fresh
+interpreters, with and without schema setup, and how long gunicorn takes to
+serve its first request with and without preloading.
+
+    python -m benchmarks.startup --repeat 5 --output startup.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import tempfile
+import subprocess
+import httpx
+from . import generate as gen
+from .loadtest import AppServer
+
+LAZY_MODULES = ["pandas", "openpyxl", "anthropic"]
+
+# runs in a fresh interpreter, so nothing is imported or cached beforehand
+PROBE = """
+import sys, json, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+loaded = [m for m in {lazy!r} if m in sys.modules]
+app.test_client().get("/api/dd/census")
+first = time.perf_counter()
+print(json.dumps({{
+    "import": imported - start,
+    "create_app": created - imported,
+    "first_request": first - created,
+    "loaded_at_start": loaded,
+}}))
+"""
+
+
+def probe(env: dict):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(lazy=LAZY_MODULES)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env={**os.environ, **env},
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(f"Startup probe failed:\n{result.stderr}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process"] = time.perf_counter() - start
+    return timings
+
+
+def median_timings(runs):
+    return {
+        key: statistics.median(run[key] for run in runs)
+        for key in runs[0]
+        if isinstance(runs[0][key], float)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = {
+            "ENV": "PROD",
+            "DATABASE_URI": f"sqlite:///{tmpdir}/startup.sqlite",
+            "ANTHROPIC_API_KEY": "stub",
+        }
+        for name, setup in [("schema_setup", "Y"), ("no_schema_setup", "N")]:
+            runs = [
+                probe({**env, "SCHEMA_SETUP_ON_START": setup})
+                for _ in range(args.repeat)
+            ]
+            results[name] = {
+                **median_timings(runs),
+                "loaded_at_start": runs[-1]["loaded_at_start"],
+            }
+
+        # the first upload is the first request that needs pandas
+        rates = gen.rate_table()
+        files = {"file": (rates.filename, rates.data)}
+        for name, preload in [("gunicorn_preload", True), ("gunicorn", False)]:
+            runs = []
+            for _ in range(args.repeat):
+                with AppServer(env, workers=args.workers, preload=preload) as server:
+                    start = time.perf_counter()
+                    httpx.post(
+                        f"{server.url}/api/rates/upload", files=files, timeout=60
+                    ).raise_for_status()
+                    runs.append(
+                        {
+                            "ready": server.ready_seconds,
+                            "first_upload": time.perf_counter() - start,
+                        }
+                    )
+            results[name] = median_timings(runs)
+
+    print(f"{'':18} {'import':>9} {'create':>9} {'first req':>9} {'process':>9}")
+    for name in ("schema_setup", "no_schema_setup"):
+        row = results[name]
+        print(
+            f"{name:18} {row['import'] * 1000:>7.0f}ms {row['create_app'] * 1000:>7.0f}ms "
+            f"{row['first_request'] * 1000:>7.0f}ms {row['process'] * 1000:>7.0f}ms"
+        )
+    for name in ("gunicorn_preload", "gunicorn"):
+        row = results[name]
+        print(
+            f"{name:18} ready in {row['ready'] * 1000:.0f}ms, "
+            f"first upload {row['first_upload'] * 1000:.0f}ms"
+        )
+    loaded = results["no_schema_setup"]["loaded_at_start"]
+    print(f"imported at start: {', '.join(loaded) or 'none of ' + str(LAZY_MODULES)}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
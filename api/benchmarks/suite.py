@@ -0,0 +1,220 @@
+import time
+import statistics
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+from . import generate as gen
+from .llm_stub import StubLLMClient, stub_llm_client
+
+
+@dataclass
+class Benchmark:
+    """
+    `run` is timed; `setup`, if given, is called before each run and its
+    return value passed to `run`
+    """
+
+    name: str
+    run: Callable[[Any], Any]
+    setup: Callable[[], Any] = None
+    rows: int = None
+
+
+def measure(benchmark: Benchmark, repeat: int = 5, warmup: int = 1):
+    times = []
+    for i in range(warmup + repeat):
+        arg = benchmark.setup() if benchmark.setup is not None else None
+        start = time.perf_counter()
+        benchmark.run(arg)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+
+    times.sort()
+    median = statistics.median(times)
+    result = {
+        "runs": repeat,
+        "min": times[0],
+        "median": median,
+        "mean": statistics.fmean(times),
+        "p95": times[min(len(times) - 1, round(0.95 * (len(times) - 1)))],
+        "max": times[-1],
+    }
+    if benchmark.rows:
+        result["rows"] = benchmark.rows
+        result["rows_per_second"] = benchmark.rows / median if median else None
+    return result
+
+
+def upload(file: gen.SyntheticFile):
+    return FileStorage(stream=file.stream(), filename=file.filename)
+
+
+def build_suite(
+    app: Flask,
+    llm: StubLLMClient,
+    rows: int = 5000,
+    tabs: int = 2,
+    extra_columns: int = 10,
+) -> List[Benchmark]:
+    """
+    Seeds a rate table and a census of `rows` rows, and returns the
+    benchmarks. Must be called inside an app context, with `llm` patched in
+    as the LLM client.
+    """
+    from census.file_handler import CensusUploadHandler, RateUploadHandler
+    from census.mixins import CensusStatsMixin
+
+    workbooks = {
+        fmt: gen.census_workbook(
+            rows, tabs=tabs, extra_columns=extra_columns, fmt=fmt, seed=1
+        )
+        for fmt in ("xlsx", "csv")
+    }
+    rates = {fmt: gen.rate_table(fmt=fmt) for fmt in ("xlsx", "csv")}
+    # 100 ages by 50 relationships by 2 tobacco dispositions, 10,000 cells
+    matrix_relationships = [f"R{i:02}" for i in range(50)]
+    matrices = {
+        name: gen.rate_matrix(
+            relationships=matrix_relationships, stacked_header=stacked, fmt=fmt
+        )
+        for name, fmt, stacked in [
+            ("xlsx", "xlsx", False),
+            ("csv", "csv", False),
+            ("xlsx,stacked", "xlsx", True),
+        ]
+    }
+
+    def census_handler(fmt, **options):
+        # the stub answers with the layout of the file being uploaded
+        llm.response = workbooks[fmt].llm_config
+        return CensusUploadHandler(upload(workbooks[fmt]), **options)
+
+    def processed_handler():
+        handler = census_handler("xlsx")
+        handler.process()
+        return handler
+
+    rate_master = RateUploadHandler(upload(rates["xlsx"])).save()
+    census_master = processed_handler().save()
+    rate_master_id = rate_master.rate_master_id
+    census_master_id = census_master.census_master_id
+
+    client = app.test_client()
+
+    def save_age_page(offset: int, limit: int = 100):
+        def run(_):
+            response = client.post(
+                f"/api/save-age?offset={offset}&limit={limit}",
+                json={
+                    "effective_date": "2025-01-01",
+                    "rate_master_id": rate_master_id,
+                    "census_master_id": census_master_id,
+                },
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"save-age failed: {response.get_json()}")
+
+        return Benchmark(f"save_age_page[offset={offset}]", run, rows=limit)
+
+    suite = [
+        Benchmark(
+            f"census_process[{fmt}]",
+            lambda handler: handler.process(),
+            setup=lambda fmt=fmt: census_handler(fmt),
+            rows=rows,
+        )
+        for fmt in ("xlsx", "csv")
+    ]
+    # validates the ages against the bands of the rate table too
+    suite.append(
+        Benchmark(
+            "census_process[xlsx,rates]",
+            lambda handler: handler.process(),
+            setup=lambda: census_handler("xlsx", rate_master_id=rate_master_id),
+            rows=rows,
+        )
+    )
+    suite.append(
+        Benchmark(
+            "census_save", lambda handler: handler.save(), processed_handler, rows
+        )
+    )
+    suite += [
+        Benchmark(
+            f"rate_save[{fmt}]",
+            lambda handler: handler.save(),
+            setup=lambda fmt=fmt: RateUploadHandler(upload(rates[fmt])),
+            rows=rates[fmt].rows,
+        )
+        for fmt in ("xlsx", "csv")
+    ]
+    suite += [
+        Benchmark(
+            f"rate_matrix_save[{name}]",
+            lambda handler: handler.save(),
+            setup=lambda name=name: RateUploadHandler(upload(matrices[name])),
+            rows=matrices[name].rows,
+        )
+        for name in matrices
+    ]
+    suite += [save_age_page(offset) for offset in sorted({0, rows // 2, rows - 100})]
+    suite.append(
+        Benchmark(
+            "census_stats",
+            lambda _: CensusStatsMixin.get_stats(census_master_id),
+            rows=rows,
+        )
+    )
+    return suite
+
+
+def run_suite(
+    app: Flask,
+    rows: int = 5000,
+    repeat: int = 5,
+    warmup: int = 1,
+    only: str = None,
+    **kwargs,
+) -> Dict[str, dict]:
+    results = {}
+    with app.app_context(), stub_llm_client(StubLLMClient()) as llm:
+        for benchmark in build_suite(app, llm, rows, **kwargs):
+            if only and only not in benchmark.name:
+                continue
+            results[benchmark.name] = measure(benchmark, repeat, warmup)
+    return results
+
+
+def compare(
+    results: Dict[str, dict],
+    baseline: Dict[str, dict],
+    threshold: float = 0.2,
+    thresholds: Dict[str, float] = None,
+    metric: str = "median",
+):
+    """
+    Compares each benchmark against the baseline. A benchmark regresses if
+    its `metric` is more than `threshold` (a fraction) slower, where
+    `thresholds` overrides the threshold per benchmark name.
+    """
+    thresholds = thresholds or {}
+    comparison = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name][metric], result[metric]
+        change = (after - before) / before if before else 0.0
+        limit = thresholds.get(name, threshold)
+        comparison.append(
+            {
+                "name": name,
+                "baseline": before,
+                "current": after,
+                "change": change,
+                "threshold": limit,
+                "regressed": change > limit,
+            }
+        )
+    return comparison
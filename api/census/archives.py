@@ -0,0 +1,95 @@
+"""
+Compressed uploads. A `.csv.gz` is decompressed as it is read, and the files
+in a `.zip` are read straight out of the archive instead of being extracted.
+"""
+
+import os
+import gzip
+import shutil
+import zipfile
+import tempfile
+import posixpath
+from typing import List
+
+# workbooks larger than this are spooled to disk when read from an archive
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+
+def file_extension(filename: str):
+    """
+    The extension of an uploaded file, including the format of a gzipped
+    file, as in `.csv.gz`
+    """
+    root, ext = os.path.splitext(filename)
+    if ext == ".gz":
+        return os.path.splitext(root)[1] + ext
+    return ext
+
+
+def decompress(file, extension: str):
+    """Wraps `file` so that it is decompressed as it is read"""
+    if extension.endswith(".gz"):
+        return gzip.GzipFile(fileobj=file, mode="rb")
+    return file
+
+
+class ArchiveMember:
+    """
+    A file in a zip archive, which the file handlers take in place of an
+    uploaded file
+    """
+
+    def __init__(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo):
+        self.archive = archive
+        self.info = info
+        self.filename = info.filename
+        self.name = posixpath.basename(info.filename)
+
+    def open(self):
+        stream = self.archive.open(self.info)
+        if file_extension(self.filename) in (".csv", ".csv.gz"):
+            return stream
+        # workbooks are read with seeks, which a member only supports by
+        # decompressing again from the start
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        with stream:
+            shutil.copyfileobj(stream, spool)
+        spool.seek(0)
+        return spool
+
+
+def is_hidden(filename: str):
+    # folders and resource forks added by macOS and dotfiles
+    return filename.startswith("__MACOSX/") or any(
+        part.startswith(".") for part in filename.split("/")
+    )
+
+
+def archive_members(
+    file, extensions: List[str], max_files: int = None, max_bytes: int = None
+) -> List[ArchiveMember]:
+    """
+    The files in a zip archive with one of `extensions`. Raises a ValueError
+    if there are none, or more than `max_files` or `max_bytes` of them once
+    decompressed.
+    """
+    try:
+        archive = zipfile.ZipFile(file)
+    except zipfile.BadZipFile:
+        raise ValueError("Invalid zip file")
+
+    members = [
+        info
+        for info in archive.infolist()
+        if not info.is_dir()
+        and not is_hidden(info.filename)
+        and file_extension(info.filename) in extensions
+    ]
+    if not members:
+        raise ValueError("The archive has no workbooks or CSV files")
+    if max_files and len(members) > max_files:
+        raise ValueError(f"The archive has more than {max_files} files")
+    # zipfile stops reading a member at its declared size
+    if max_bytes and sum(info.file_size for info in members) > max_bytes:
+        raise ValueError("The archive is too large once decompressed")
+    return [ArchiveMember(archive, info) for info in members]
@@ -1,25 +1,55 @@
-import os
 import re
 import pandas as pd
 from io import BytesIO
 from extensions import db
+from sqlalchemy import delete, func, insert
+from metrics import ROWS_PROCESSED, stage_timer
+from flask import current_app
 from typing import Dict
 from collections import defaultdict
 from . import models as md
 from . import schemas as sch
 from . import mixins as mix
+from .archives import ArchiveMember, decompress, file_extension
+from .uploads import ChunkedUpload
+from .prompts import TabPromptBuilder
+
+
+class CensusValidationError(ValueError):
+    """
+    Census rows failed validation. `report` is the validation report, see
+    `CensusValidationMixin.validation_report`.
+    """
+
+    def __init__(self, report):
+        super().__init__(
+            f"{report['rejected']} of {report['rows']} census rows failed validation"
+        )
+        self.report = report
 
 
 class BaseFileHandler:
     def __init__(self, file, *args, **kwargs):
-        self.file = BytesIO(file.read())
+        # files in an archive are read straight out of it, and chunked
+        # uploads through a memory map of the assembled file
+        if isinstance(file, (ArchiveMember, ChunkedUpload)):
+            self.file = file.open()
+        else:
+            self.file = BytesIO(file.read())
         self.filename = kwargs.get("filename", file.filename)
         self.filepath = file.filename
-        self.file_extension = os.path.splitext(file.filename)[1]
+        self.file_extension = file_extension(file.filename)
 
         self.dfs = {}
         self.metadata = defaultdict(dict)
 
+    def stage(self, name: str):
+        """
+        Times a processing stage, see `metrics.stage_timer`. Timings are
+        returned with the upload under `metadata["timings"]`.
+        """
+        return stage_timer(type(self).__name__, name, self.metadata["timings"])
+
     @property
     def multiple_tabs(self):
         return len(self.dfs.keys()) != 1
@@ -50,8 +80,9 @@ class BaseFileHandler:
         if self.file_extension in [".xlsx", ".xls", ".xlsm"]:
             self.dfs = self._read_excel(self.file)
             return self.dfs
-        elif self.file_extension == ".csv":
-            self.dfs = {"default": pd.read_csv(self.file)}
+        elif self.file_extension in [".csv", ".csv.gz"]:
+            self.dfs = self._read_csv(decompress(self.file, self.file_extension))
+            return self.dfs
         else:
             raise ValueError("Invalid file format")
 
@@ -59,6 +90,11 @@ class BaseFileHandler:
     def _read_excel(cls, file):
         return pd.read_excel(file, header=None, sheet_name=None, index_col=None)
 
+    @classmethod
+    def _read_csv(cls, file):
+        # a csv is read like a workbook with a single tab
+        return {"default": pd.read_csv(file, header=None, index_col=None)}
+
     def raw_data(self, nrows=10):
         return {
             tab: df.iloc[:nrows]
@@ -69,7 +105,24 @@ class BaseFileHandler:
         }
 
 
-class CensusUploadHandler(mix.CensusProcessorLLMMixin, BaseFileHandler):
+class CensusUploadHandler(
+    mix.CensusVersionMixin,
+    mix.CensusDetailBulkMixin,
+    mix.CensusValidationMixin,
+    mix.CensusProcessorLLMMixin,
+    BaseFileHandler,
+):
+    def __init__(self, file, *args, rate_master_id=None, partial=False, **kwargs):
+        """
+        Rows are validated against the rate table `rate_master_id`, if given.
+        With `partial`, the rows that pass validation are loaded and the rest
+        quarantined, instead of the upload failing.
+        """
+        super().__init__(file, *args, **kwargs)
+        self.rate_master_id = rate_master_id
+        self.partial = partial
+        self.rejected_data = []
+
     def preprocess(self, dfs: Dict[str, pd.DataFrame]):
         data = {
             tab: {
@@ -120,38 +173,237 @@ class CensusUploadHandler(mix.CensusProcessorLLMMixin, BaseFileHandler):
         return dfs
 
     def stack(self, dfs: Dict[str, pd.DataFrame]):
-        schema = sch.SchemaCensusUpload(many=True)
         for tab, df in dfs.items():
             df["tab"] = tab
+            # 1-based, like the row numbers of the tab configs
+            df["row_number"] = df.index + 1
 
-        df_stack = pd.concat(dfs.values(), ignore_index=True)
-        data = df_stack.to_dict(orient="records")
-        return schema.dump(data)
+        return pd.concat(dfs.values(), ignore_index=True)
 
-    def process(self):
+    def validate(self, df_stack: pd.DataFrame):
+        """
+        Returns the stacked rows that pass validation, and keeps the rejected
+        rows with their values as read in `rejected_data`. Raises a
+        `CensusValidationError` if any row is rejected and the upload isn't
+        partial, or if no row is left.
+        """
+        config = current_app.config
+        columns = ["birthdate", "relationship", "tobacco_disposition", "effective_date"]
+        df, checks = self.validate_census(
+            df_stack,
+            self.rate_master_id,
+            config["CENSUS_RELATIONSHIP_CODES"],
+            config["CENSUS_TOBACCO_CODES"],
+        )
+        report = self.validation_report(
+            df, checks, config["CENSUS_VALIDATION_SAMPLE_ROWS"]
+        )
+        self.metadata["validation"] = report
+        if (report["rejected"] and not self.partial) or not report["accepted"]:
+            raise CensusValidationError(report)
+
+        rejected = checks.any(axis=1)
+        # rejected rows are kept as text, as they may not parse
+        cell = TabPromptBuilder(max_cell_chars=50).cell
+        raw = df_stack.loc[checks.index[rejected], ["tab", "row_number", *columns]]
+        self.rejected_data = [
+            {
+                "tab": row["tab"],
+                "row_number": int(row["row_number"]),
+                **{col: cell(row[col]) or None for col in columns},
+                "errors": ",".join(checks.columns[failed]),
+            }
+            for row, failed in zip(
+                raw.to_dict(orient="records"), checks[rejected].to_numpy()
+            )
+        ]
+        return df.loc[~rejected]
+
+    @staticmethod
+    def header_matches(df: pd.DataFrame, config):
+        """
+        Whether the columns of a stored tab config are still in its header row
+        """
+        row = config["start_row_number"] - 1
+        col = config["start_column_number"] - 1
+        if row >= len(df):
+            return False
+        header = {str(value).strip() for value in df.iloc[row, col:] if pd.notna(value)}
+        return set(config["column_mapper"]) <= header
+
+    def stored_census_config(self, dfs: Dict[str, pd.DataFrame], census_tabs):
+        """
+        Returns the stored config of the tabs whose header hasn't moved, and
+        the tabs that are new or have changed, which need the LLM
+        """
+        stored = {tab["tab_name"]: tab for tab in census_tabs}
+        census_config, unknown = [], {}
+        for tab, df in dfs.items():
+            config = stored.get(tab)
+            if config is None:
+                unknown[tab] = df
+            elif config["column_mapper"]:
+                if self.header_matches(df, config):
+                    census_config.append(config)
+                    self.metadata[tab]["config"] = "stored"
+                else:
+                    unknown[tab] = df
+        return census_config, unknown
+
+    def process(self, census_tabs=None):
+        """
+        With the `census_tabs` of an existing census, tabs that were read
+        before are read the same way and only other tabs go to the LLM
+        """
         # read the file
-        dfs = self.read()
+        with self.stage("read"):
+            dfs = self.read()
         # preprocessor
-        preprocessor = self.preprocess(dfs)
+        with self.stage("preprocess"):
+            preprocessor = self.preprocess(dfs)
 
+        census_config, unknown = [], dfs
+        if census_tabs is not None:
+            census_config, unknown = self.stored_census_config(dfs, census_tabs)
         # if multiple tabs, identify which tabs contain census data
-        census_config = self.llm_identify_tabs_containing_censuses(
-            dfs, preprocess=preprocessor
-        )
+        if unknown:
+            with self.stage("llm"):
+                prompt, self.metadata["prompt"] = self.tabs_prompt(
+                    unknown, preprocessor
+                )
+                census_config += self.llm_identify_tabs_containing_censuses(
+                    unknown, preprocess=preprocessor, prompt=prompt
+                )
+        self.census_config = census_config
         if not census_config:
             raise ValueError("Could not identify census data in the file")
 
         # select the data range of each tab
-        dfs = self.select_data_range(dfs, census_config)
+        with self.stage("select_data_range"):
+            dfs = self.select_data_range(dfs, census_config)
 
         # map the columns to the standard schema
-        dfs = self.map_columns(dfs, census_config)
+        with self.stage("map_columns"):
+            dfs = self.map_columns(dfs, census_config)
         # save the data to the database
 
-        self.processed_data = self.stack(dfs)
+        with self.stage("stack"):
+            df_stack = self.stack(dfs)
+        with self.stage("validate"):
+            df_valid = self.validate(df_stack)
+        with self.stage("serialize"):
+            self.processed_data = self.census_records(df_valid)
         return self.processed_data
 
+    @classmethod
+    def census_records(cls, df: pd.DataFrame):
+        """The census rows as dicts, with dates as `datetime.date`"""
+        df = df[cls.DETAIL_COLUMNS].copy()
+        for col in ("birthdate", "effective_date"):
+            df[col] = df[col].dt.date
+        return df.to_dict(orient="records")
+
+    def summary(self):
+        """
+        Row counts of the processed census, returned by the upload endpoint
+        in place of the full detail records
+        """
+        tabs = defaultdict(int)
+        for row in self.processed_data:
+            tabs[row["tab"]] += 1
+        return {"row_count": len(self.processed_data), "tabs": dict(tabs)}
+
     def save(self):
+        with self.stage("save"):
+            census_master = self._save()
+        ROWS_PROCESSED.labels(type(self).__name__).inc(len(self.processed_data))
+        return census_master
+
+    @staticmethod
+    def census_tabs(census_master_id: int):
+        tabs = md.ModelCensusTab.query.filter_by(census_master_id=census_master_id)
+        return sch.SchemaCensusConfigLLM(many=True).dump(tabs)
+
+    def save_census_tabs(self, census_master_id: int):
+        """
+        Stores how each tab of the file was read, replacing the config of
+        tabs that were stored before. Does not commit.
+        """
+        configs = {config["tab_name"]: config for config in self.census_config}
+        table = md.ModelCensusTab.__table__
+        db.session.execute(
+            delete(table).where(
+                table.c.census_master_id == census_master_id,
+                table.c.tab_name.in_(list(self.dfs)),
+            )
+        )
+        db.session.execute(
+            insert(table),
+            [
+                {
+                    "census_master_id": census_master_id,
+                    "tab_name": tab,
+                    "start_row_number": configs.get(tab, {}).get("start_row_number"),
+                    "start_column_number": configs.get(tab, {}).get(
+                        "start_column_number"
+                    ),
+                    "column_mapper": configs.get(tab, {}).get("column_mapper"),
+                }
+                for tab in self.dfs
+            ],
+        )
+
+    def save_quarantine(self, census_master_id: int):
+        """
+        Stores the rejected rows, replacing those stored before for the tabs
+        of the file. Does not commit.
+        """
+        table = md.ModelCensusQuarantine.__table__
+        db.session.execute(
+            delete(table).where(
+                table.c.census_master_id == census_master_id,
+                table.c.tab.in_(list(self.dfs)),
+            )
+        )
+        if self.rejected_data:
+            db.session.execute(
+                insert(table),
+                [
+                    {**row, "census_master_id": census_master_id}
+                    for row in self.rejected_data
+                ],
+            )
+
+    def append(self, census_master):
+        """
+        Adds the processed rows that aren't in the census yet, as a new
+        version of the census, and adds them to its portfolio results
+        """
+        from .portfolio import add_rows_to_results
+
+        census_master_id = census_master.census_master_id
+        with self.stage("save"):
+            rows = self.new_census_details(census_master_id, self.processed_data)
+            if rows:
+                version = self.new_census_version(census_master_id)
+                version.inserted = self.insert_census_details(
+                    census_master_id, rows, version
+                )
+            self.save_census_tabs(census_master_id)
+            self.save_quarantine(census_master_id)
+            results = add_rows_to_results(census_master_id, rows) if rows else 0
+            census_master.updated_dts = func.current_timestamp()
+            db.session.commit()
+        self.metadata["append"] = {
+            "inserted": len(rows),
+            "duplicates": len(self.processed_data) - len(rows),
+            "portfolio_results_updated": results,
+            "version": self.latest_census_version(census_master_id),
+        }
+        ROWS_PROCESSED.labels(type(self).__name__).inc(len(rows))
+        return census_master
+
+    def _save(self):
         # create the census master record w/o details
         census_master = {
             "census_name": self.filename,
@@ -162,22 +414,91 @@ class CensusUploadHandler(mix.CensusProcessorLLMMixin, BaseFileHandler):
         # flush to get the master id
         db.session.flush()
 
-        # create the census details
-        detail_data = [
-            {**row, "census_master_id": census_master.census_master_id}
-            for row in self.processed_data
-        ]
-        census_details = sch.SchemaCensusDetail(many=True).load(detail_data)
-        db.session.add_all(census_details)
-        census_master.census_details = census_details
+        # create the census details in bulk
+        inserted = self.insert_census_details(
+            census_master.census_master_id, self.processed_data
+        )
+        db.session.add(
+            md.ModelCensusVersion(
+                census_master_id=census_master.census_master_id,
+                version=1,
+                inserted=inserted,
+            )
+        )
+        self.save_census_tabs(census_master.census_master_id)
+        self.save_quarantine(census_master.census_master_id)
         db.session.commit()
 
         return census_master
 
 
 class RateUploadHandler(mix.RateDetailMixin, BaseFileHandler):
+    # 40-44, 40 to 44, 65+ or 40, where ages read as floats end in .0
+    AGE_BAND_PATTERN = (
+        r"^\s*(?P<lower>\d+)(?:\.0+)?\s*"
+        r"(?:(?:-|to)\s*(?P<upper>\d+)(?:\.0+)?|(?P<open>\+))?\s*$"
+    )
+    OPEN_UPPER_AGE = 999
+    # a matrix column label ends with the tobacco disposition, as in
+    # `Employee Non-Tobacco` or `EE - T`
+    MATRIX_LABEL_PATTERN = (
+        r"^\s*(?P<relationship>.+?)[\s_/|,:-]+"
+        r"(?P<tobacco_disposition>(?:non[\s_-]?)?(?:tobacco|smoker)|[nty]|yes|no)\s*$"
+    )
+    # codes for the tobacco dispositions and relationships in matrix
+    # headers, keyed by the lowercase letters of the label, so that they
+    # match the codes of the census rows. Relationship labels not listed here
+    # are taken as codes already, e.g. `EE`, `SP` or `CH`.
+    MATRIX_TOBACCO_CODES = {
+        "n": "N",
+        "no": "N",
+        "nontobacco": "N",
+        "nonsmoker": "N",
+        "t": "T",
+        "y": "T",
+        "yes": "T",
+        "tobacco": "T",
+        "smoker": "T",
+    }
+    MATRIX_RELATIONSHIP_CODES = {
+        "employee": "EE",
+        "subscriber": "EE",
+        "member": "EE",
+        "spouse": "SP",
+        "partner": "SP",
+        "domesticpartner": "SP",
+        "child": "CH",
+        "children": "CH",
+        "dependent": "CH",
+    }
+    # labels of the relationship, tobacco disposition and rate columns of a
+    # long rate table, which a matrix doesn't have
+    LONG_COLUMN_LABELS = {
+        "relationship": ["relationship", "rel", "relation"],
+        "tobacco_disposition": [
+            "tobacco",
+            "tobaccodisposition",
+            "tobaccostatus",
+            "smoker",
+            "smokerstatus",
+            "smokerdisposition",
+        ],
+        "rate": [
+            "rate",
+            "modal",
+            "modalrate",
+            "modalpremium",
+            "prem",
+            "premium",
+        ],
+    }
+
     @staticmethod
-    def get_column_mapper(df: pd.DataFrame):
+    def normalize_label(col):
+        return re.sub(r"[^A-Za-z0-9]", "", str(col)).lower()
+
+    @classmethod
+    def get_column_mapper(cls, df: pd.DataFrame, matrix=False):
         age_band_col_dict = {
             "age_band": None,
             "lower_age": None,
@@ -191,42 +512,23 @@ class RateUploadHandler(mix.RateDetailMixin, BaseFileHandler):
         AGE_BAND_LABELS = ["ageband", "age", "agegroup", "agebandgroup"]
         LOWER_AGE_LABELS = ["lowerage", "lower"]
         UPPER_AGE_LABELS = ["upperage", "upper"]
-        RELATIONSHIP_LABELS = ["relationship", "rel", "relation"]
-        TOBACCO_DISPOSITION_LABELS = [
-            "tobacco",
-            "tobaccodisposition",
-            "tobaccostatus",
-            "smoker",
-            "smokerstatus",
-            "smokerdisposition",
-        ]
-        RATE_LABELS = [
-            "rate",
-            "modal",
-            "modalrate",
-            "modalpremium",
-            "prem",
-            "premium",
-        ]
 
         for col in df.columns:
-            adjcol = re.sub(r"[^A-Za-z0-9]", "", col).lower()
+            adjcol = cls.normalize_label(col)
             if adjcol in AGE_BAND_LABELS:
                 age_band_col_dict["age_band"] = col
             elif adjcol in LOWER_AGE_LABELS:
                 age_band_col_dict["lower_age"] = col
             elif adjcol in UPPER_AGE_LABELS:
                 age_band_col_dict["upper_age"] = col
-
-            elif adjcol in RELATIONSHIP_LABELS:
-                col_dict["relationship"] = col
-            elif adjcol in TOBACCO_DISPOSITION_LABELS:
-                col_dict["tobacco_disposition"] = col
-            elif adjcol in RATE_LABELS:
-                col_dict["rate"] = col
-
-        if None in col_dict.values():
-            raise ValueError("Invalid column names")
+            else:
+                for key, labels in cls.LONG_COLUMN_LABELS.items():
+                    if adjcol in labels:
+                        col_dict[key] = col
+
+        missing = [key for key, col in col_dict.items() if col is None]
+        if missing and not matrix:
+            raise ValueError(f"Invalid column names, missing {', '.join(missing)}")
         if age_band_col_dict["age_band"] is not None:
             _ = age_band_col_dict.pop("lower_age")
             _ = age_band_col_dict.pop("upper_age")
@@ -236,7 +538,11 @@ class RateUploadHandler(mix.RateDetailMixin, BaseFileHandler):
         ):
             _ = age_band_col_dict.pop("age_band")
         else:
-            raise ValueError("Invalid column names")
+            raise ValueError(
+                "Invalid column names, missing age_band or lower_age and upper_age"
+            )
+        if matrix:
+            return {v: k for k, v in age_band_col_dict.items()}
 
         col_mapper = {
             **{v: k for k, v in col_dict.items()},
@@ -246,50 +552,134 @@ class RateUploadHandler(mix.RateDetailMixin, BaseFileHandler):
 
     @classmethod
     def _read_excel(cls, file):
-        df = pd.read_excel(file)
-        col_mapper = cls.get_column_mapper(df)
-        return df.rename(columns=col_mapper)
+        return cls.to_long(pd.read_excel(file))
 
-    @staticmethod
-    def split_age_band(age_band):
-        if "-" in age_band:
-            return [val.strip() for val in age_band.split("-")]
-        if "to" in age_band:
-            return [val.strip() for val in age_band.split("to")]
-        if age_band.endswith("+"):
-            return [age_band[:-1].strip(), "999"]
-        raise ValueError("Invalid age band format")
+    @classmethod
+    def _read_csv(cls, file):
+        return cls.to_long(pd.read_csv(file))
+
+    @classmethod
+    def is_matrix(cls, df: pd.DataFrame):
+        """
+        A rate table is a matrix if it has none of the relationship, tobacco
+        disposition and rate columns of a long table
+        """
+        labels = {cls.normalize_label(col) for col in df.columns}
+        return not any(
+            labels.intersection(long_labels)
+            for long_labels in cls.LONG_COLUMN_LABELS.values()
+        )
+
+    @classmethod
+    def to_long(cls, df: pd.DataFrame):
+        if cls.is_matrix(df):
+            return cls.melt_matrix(df)
+        return df.rename(columns=cls.get_column_mapper(df))
+
+    @classmethod
+    def matrix_labels(cls, labels: pd.Series):
+        """
+        The relationship and tobacco disposition codes of matrix column
+        labels, or None if a label doesn't end with a tobacco disposition
+        """
+        parts = labels.str.extract(cls.MATRIX_LABEL_PATTERN, flags=re.IGNORECASE)
+        if parts["relationship"].isna().any():
+            return None
+        for col, codes in [
+            ("relationship", cls.MATRIX_RELATIONSHIP_CODES),
+            ("tobacco_disposition", cls.MATRIX_TOBACCO_CODES),
+        ]:
+            keys = parts[col].str.lower().str.replace(r"[^a-z]", "", regex=True)
+            parts[col] = keys.map(codes).fillna(parts[col].str.strip())
+        return parts
+
+    @classmethod
+    def melt_matrix(cls, df: pd.DataFrame):
+        """
+        Unpivots a rate matrix, which has an age band column, or lower and
+        upper age columns, and a column of rates for each relationship and
+        tobacco disposition. The columns are labelled like `Employee Tobacco`
+        or `EE - N`, or have the relationships in a header row above the
+        tobacco dispositions. Blank cells are rates that aren't offered.
+        Labels are mapped to the codes census rows use, see
+        `MATRIX_TOBACCO_CODES` and `MATRIX_RELATIONSHIP_CODES`.
+        """
+        col_mapper = cls.get_column_mapper(df, matrix=True)
+        rate_cols = [col for col in df.columns if col not in col_mapper]
+        labels = pd.Series(rate_cols, index=rate_cols, dtype="string")
+        parts = cls.matrix_labels(labels)
+        if parts is None and len(df):
+            # blank or merged cells of the relationship row take the label
+            # to their left
+            relationships = labels.mask(labels.str.startswith("Unnamed:")).ffill()
+            tobacco = df[rate_cols].iloc[0].astype("string")
+            parts = cls.matrix_labels(relationships + " " + tobacco)
+            df = df.iloc[1:]
+        if not rate_cols or parts is None:
+            raise ValueError(
+                "Invalid column names, rate matrix columns must be labelled "
+                "with a relationship and tobacco disposition"
+            )
+
+        df = df.rename(columns=col_mapper).melt(
+            id_vars=list(col_mapper.values()),
+            value_vars=rate_cols,
+            var_name="label",
+            value_name="rate",
+        )
+        df = df.join(parts, on="label").drop(columns=["label"])
+        return df[df["rate"].notna()].reset_index(drop=True)
 
     @classmethod
     def handle_age_band(cls, df: pd.DataFrame, col_mapper):
+        """
+        Splits bands like `40-44`, `40 to 44` and `65+` into lower and upper
+        ages. A single age is a band of one year.
+        """
         if "age_band" not in col_mapper:
             return df
-        df["lower_age"] = df["age_band"].apply(lambda x: int(cls.split_age_band(x)[0]))
-        df["upper_age"] = df["age_band"].apply(lambda x: int(cls.split_age_band(x)[1]))
+        parts = (
+            df["age_band"]
+            .astype(str)
+            .str.extract(cls.AGE_BAND_PATTERN, flags=re.IGNORECASE)
+        )
+        invalid = parts["lower"].isna()
+        if invalid.any():
+            examples = df.loc[invalid, "age_band"].astype(str).unique()[:3]
+            raise ValueError(f"Invalid age band format: {', '.join(examples)}")
+        df["lower_age"] = parts["lower"].astype(int)
+        df["upper_age"] = (
+            parts["upper"]
+            .fillna(parts["lower"])
+            .astype(int)
+            .mask(parts["open"].notna(), cls.OPEN_UPPER_AGE)
+        )
         return df.drop(columns=["age_band"])
 
     def save(self, **kwargs):
-        # create the census master record w/o details
-        rate_master = {
-            "rate_master_name": self.filename,
-        }
-        rate_master = sch.SchemaRateMaster().load(rate_master)
-        db.session.add(rate_master)
-        # flush to get the master id
-        db.session.flush()
-
-        # create the census details
-        df_detail = self.read()
-        df_detail["rate_master_id"] = rate_master.rate_master_id
-        df_detail = self.handle_age_band(df_detail, self.get_column_mapper(df_detail))
-        dict_detail = self.modify_rate_details(
-            df_detail.to_dict(orient="records"), **kwargs
-        )
-
-        rate_detail_dict = sch.SchemaRateUpload(many=True).dump(dict_detail)
-        rate_details = sch.SchemaRateDetail(many=True).load(rate_detail_dict)
-        db.session.add_all(rate_details)
-        rate_master.census_details = rate_details
-        db.session.commit()
+        with self.stage("read"):
+            df_detail = self.read()
+        with self.stage("transform"):
+            df_detail = self.handle_age_band(
+                df_detail, self.get_column_mapper(df_detail)
+            )
+            df_detail = self.clean(df_detail)
+        with self.stage("validate"):
+            self.validate_rate_details(df_detail)
+            df_detail = df_detail.astype({"lower_age": int, "upper_age": int})
+            df_detail = self.modify_rate_details(df_detail, **kwargs)
+
+        with self.stage("save"):
+            # create the rate master record, then its details in one insert
+            rate_master = {
+                "rate_master_name": self.filename,
+            }
+            rate_master = sch.SchemaRateMaster().load(rate_master)
+            db.session.add(rate_master)
+            # flush to get the master id
+            db.session.flush()
+            rows = self.insert_rate_details(rate_master.rate_master_id, df_detail)
+            db.session.commit()
+        ROWS_PROCESSED.labels(type(self).__name__).inc(rows)
 
         return rate_master
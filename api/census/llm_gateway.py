@@ -0,0 +1,170 @@
+import os
+import random
+import asyncio
+import inspect
+import logging
+import threading
+from typing import Dict, List
+from metrics import LLM_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+# 408 timeout, 409 conflict, 429 rate limited, 5xx and 529 overloaded
+RETRY_STATUS_CODES = {408, 409, 429}
+
+
+def is_retryable(error: BaseException):
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRY_STATUS_CODES or status >= 500
+
+    import anthropic
+
+    return isinstance(error, anthropic.APIConnectionError)
+
+
+class LLMGateway:
+    """
+    Runs LLM requests on an event loop in a background thread, so that a web
+    worker's threads share one concurrency limit and one connection pool.
+
+    Every attempt has a `timeout`. Failed attempts that may succeed on a
+    retry (timeouts, connection errors, 429s and 5xx) are retried up to
+    `max_retries` times with full jitter backoff. If `hedge_after` is set, a
+    duplicate request is sent when an attempt has not answered in that many
+    seconds, and whichever answers first is used.
+
+    The client's `messages.create` may be a coroutine, as with
+    `anthropic.AsyncAnthropic`, or blocking, in which case it holds up the
+    loop while it runs.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        timeout: float = 60,
+        max_retries: int = 2,
+        backoff: float = 0.5,
+        max_backoff: float = 8,
+        hedge_after: float = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+        self._loop = None
+        self._pid = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            # a forked worker doesn't inherit the parent's loop thread
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._pid = os.getpid()
+                threading.Thread(
+                    target=self._loop.run_forever, name="llm-gateway", daemon=True
+                ).start()
+            return self._loop
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def create(self, client, **kwargs):
+        """
+        Sends one request and blocks until it is answered or has failed
+        """
+        return self.run(self.acreate(client, **kwargs))
+
+    def gather(self, client, requests: List[Dict]):
+        """
+        Sends the requests concurrently and returns their answers in order.
+        A request that failed has its exception in place of an answer.
+        """
+        return self.run(self.agather(client, requests))
+
+    async def agather(self, client, requests: List[Dict]):
+        return await asyncio.gather(
+            *[self.acreate(client, **request) for request in requests],
+            return_exceptions=True,
+        )
+
+    async def acreate(self, client, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                message = await self.hedged(client, kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    LLM_ATTEMPTS.labels("error").inc()
+                    raise
+                delay = random.uniform(
+                    0, min(self.max_backoff, self.backoff * 2**attempt)
+                )
+                logger.warning("Retrying LLM request in %.2fs after %r", delay, e)
+                LLM_ATTEMPTS.labels("retry").inc()
+                await asyncio.sleep(delay)
+            else:
+                LLM_ATTEMPTS.labels("success").inc()
+                return message
+
+    async def attempt(self, client, kwargs):
+        async with self._semaphore:
+            try:
+                message = client.messages.create(**kwargs)
+                if inspect.isawaitable(message):
+                    message = await asyncio.wait_for(message, self.timeout)
+                return message
+            except asyncio.TimeoutError:
+                LLM_ATTEMPTS.labels("timeout").inc()
+                raise
+
+    async def hedged(self, client, kwargs):
+        if not self.hedge_after:
+            return await self.attempt(client, kwargs)
+
+        first = asyncio.ensure_future(self.attempt(client, kwargs))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        LLM_ATTEMPTS.labels("hedge").inc()
+        pending = {first, asyncio.ensure_future(self.attempt(client, kwargs))}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+
+_GATEWAY = None
+_GATEWAY_LOCK = threading.Lock()
+
+
+def get_gateway(config) -> LLMGateway:
+    """
+    The worker's gateway, built from the `LLM_*` settings on first use
+    """
+    global _GATEWAY
+    with _GATEWAY_LOCK:
+        if _GATEWAY is None:
+            _GATEWAY = LLMGateway(
+                max_concurrency=config["LLM_MAX_CONCURRENCY"],
+                timeout=config["LLM_TIMEOUT"],
+                max_retries=config["LLM_MAX_RETRIES"],
+                hedge_after=config["LLM_HEDGE_AFTER"] or None,
+            )
+        return _GATEWAY
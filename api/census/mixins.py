@@ -1,37 +1,685 @@
+from __future__ import annotations
+
 import os
 import json
-import pandas as pd
 import datetime
-import anthropic
-from typing import Dict
+import threading
+from typing import TYPE_CHECKING, Dict, List
+from collections import defaultdict
+from flask import current_app
 from extensions import db
-from sqlalchemy import and_, literal, func, cast, text, case
+import sql_functions as sf
+from sqlalchemy import and_, not_, literal, func, cast, text, case, true
+from sqlalchemy import bindparam, delete, insert, select, update, union_all
 from sqlalchemy.orm import aliased
+from sqlalchemy.inspection import inspect
 from sqlalchemy.sql.functions import coalesce
 from . import models as md
 from . import schemas as sch
+from .search import SearchIndex
+from .prompts import TabPromptBuilder
+from .llm_gateway import get_gateway
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class MasterPurgeMixin:
+    """
+    Deletes a master record and its details with bulk statements instead of
+    loading every child into the session. `PURGE_CHILDREN` lists the detail
+    models, which must share the master's primary key column name.
+    """
+
+    PURGE_CHILDREN = []
+    PURGE_BATCH_SIZE = 10000
+
+    @classmethod
+    def purge(cls, id: int, batch_size: int = None):
+        pk = inspect(cls.model).primary_key[0]
+        try:
+            for child in cls.PURGE_CHILDREN:
+                table = child.__table__
+                child_pk = inspect(child).primary_key[0]
+                fk = table.c[pk.name]
+                if batch_size is None:
+                    db.session.execute(delete(table).where(fk == id))
+                    continue
+                # commit per batch so the write lock is released between batches
+                batch = (
+                    db.session.query(child_pk)
+                    .filter(fk == id)
+                    .limit(batch_size)
+                    .scalar_subquery()
+                )
+                while db.session.execute(
+                    delete(table).where(child_pk.in_(batch))
+                ).rowcount:
+                    db.session.commit()
+            db.session.execute(delete(cls.model.__table__).where(pk == id))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise e
+
+    @classmethod
+    def purge_in_background(cls, id: int):
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                cls.purge(id, batch_size=cls.PURGE_BATCH_SIZE)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    @classmethod
+    def destroy(cls, id, *args, **kwargs):
+        if cls.model.get(id) is None:
+            raise ValueError("Record does not exist")
+        if kwargs.get("background") == "Y":
+            cls.purge_in_background(id)
+        else:
+            cls.purge(id)
+
+
+class CensusVersionMixin:
+    """
+    Census versions keep only the details each change touched. The details
+    table holds the latest version. A change copies the details it updates
+    or deletes, as they were, into its deltas before changing them and notes
+    the ids of the details it inserts, so that an earlier version is the
+    latest with the deltas of the later versions undone.
+    """
+
+    VERSION_COLUMNS = [
+        "census_detail_id",
+        "census_master_id",
+        "tab",
+        "birthdate",
+        "relationship",
+        "tobacco_disposition",
+        "effective_date",
+    ]
+    # ids per statement, below the SQLite limit on bound parameters
+    ID_BATCH_SIZE = 10000
+
+    @classmethod
+    def id_batches(cls, ids):
+        ids = list(ids)
+        for start in range(0, len(ids), cls.ID_BATCH_SIZE):
+            yield ids[start : start + cls.ID_BATCH_SIZE]
+
+    @classmethod
+    def latest_census_version(cls, census_master_id: int):
+        VERSION = md.ModelCensusVersion
+        latest = (
+            db.session.query(func.max(VERSION.version))
+            .filter(VERSION.census_master_id == census_master_id)
+            .scalar()
+        )
+        return latest or 1
+
+    @classmethod
+    def new_census_version(cls, census_master_id: int):
+        """
+        Adds the next version of a census, after adding version 1 for a
+        census saved before versions were kept. Does not commit.
+        """
+        VERSION = md.ModelCensusVersion
+        latest = cls.latest_census_version(census_master_id)
+        if not VERSION.query.filter_by(census_master_id=census_master_id).count():
+            db.session.add(VERSION(census_master_id=census_master_id, version=1))
+        version = VERSION(census_master_id=census_master_id, version=latest + 1)
+        db.session.add(version)
+        db.session.flush()
+        return version
+
+    @classmethod
+    def copy_to_deltas(cls, version: md.ModelCensusVersion, ids, operation: str):
+        """
+        Copies the details with `ids`, as they are, into the deltas of
+        `version` before it updates or deletes them
+        """
+        detail = md.ModelCensusDetail.__table__
+        delta = md.ModelCensusDelta.__table__
+        for batch in cls.id_batches(ids):
+            db.session.execute(
+                insert(delta).from_select(
+                    ["census_version_id", "operation", *cls.VERSION_COLUMNS],
+                    select(
+                        literal(version.census_version_id),
+                        literal(operation),
+                        *[detail.c[col] for col in cls.VERSION_COLUMNS],
+                    ).where(
+                        detail.c.census_master_id == version.census_master_id,
+                        detail.c.census_detail_id.in_(batch),
+                    ),
+                )
+            )
+
+    @classmethod
+    def note_inserts(cls, version: md.ModelCensusVersion, ids):
+        if not ids:
+            return
+        db.session.execute(
+            insert(md.ModelCensusDelta.__table__),
+            [
+                {
+                    "census_version_id": version.census_version_id,
+                    "census_master_id": version.census_master_id,
+                    "census_detail_id": id,
+                    "operation": "insert",
+                }
+                for id in ids
+            ],
+        )
+
+    @classmethod
+    def version_select(cls, census_master_id: int, version: int):
+        """
+        The details of an earlier version: the latest details that no later
+        version changed, and the others as they were before the first later
+        version changed them, unless it inserted them
+        """
+        detail = md.ModelCensusDetail.__table__
+        delta = md.ModelCensusDelta.__table__
+        VERSION = md.ModelCensusVersion.__table__
+        later = (
+            select(
+                delta,
+                func.row_number()
+                .over(
+                    partition_by=delta.c.census_detail_id,
+                    # SQLite can reuse the id of a detail deleted in the
+                    # same version, whose delete delta is written first
+                    order_by=(VERSION.c.version, delta.c.census_delta_id),
+                )
+                .label("change"),
+            )
+            .join(VERSION, VERSION.c.census_version_id == delta.c.census_version_id)
+            .where(
+                delta.c.census_master_id == census_master_id,
+                VERSION.c.version > version,
+            )
+            .cte("later_deltas")
+        )
+        unchanged = select(*[detail.c[col] for col in cls.VERSION_COLUMNS]).where(
+            detail.c.census_master_id == census_master_id,
+            detail.c.census_detail_id.not_in(select(later.c.census_detail_id)),
+        )
+        restored = select(*[later.c[col] for col in cls.VERSION_COLUMNS]).where(
+            later.c.change == 1, later.c.operation != "insert"
+        )
+        return union_all(unchanged, restored)
+
+    @classmethod
+    def snapshot_select(cls, census_version_id: int):
+        snapshot = md.ModelCensusSnapshot.__table__
+        return select(*[snapshot.c[col] for col in cls.VERSION_COLUMNS]).where(
+            snapshot.c.census_version_id == census_version_id
+        )
+
+    @classmethod
+    def cache_snapshot(cls, census_version: md.ModelCensusVersion):
+        """
+        Writes an earlier version to `census_snapshot`, and drops the census's
+        oldest snapshots past `CENSUS_SNAPSHOT_LIMIT`. Versions before the latest
+        never change, so a snapshot stays valid. Returns False if the
+        version is already cached, e.g. by another request.
+        """
+        VERSION = md.ModelCensusVersion.__table__
+        snapshot = md.ModelCensusSnapshot.__table__
+        limit = current_app.config["CENSUS_SNAPSHOT_LIMIT"]
+        try:
+            claimed = db.session.execute(
+                update(VERSION)
+                .where(
+                    VERSION.c.census_version_id == census_version.census_version_id,
+                    VERSION.c.snapshot_dts.is_(None),
+                )
+                .values(snapshot_dts=func.current_timestamp())
+            ).rowcount
+            if not claimed:
+                db.session.rollback()
+                return False
+
+            rows = cls.version_select(
+                census_version.census_master_id, census_version.version
+            ).subquery()
+            db.session.execute(
+                insert(snapshot).from_select(
+                    ["census_version_id", *cls.VERSION_COLUMNS],
+                    select(
+                        literal(census_version.census_version_id),
+                        *[rows.c[col] for col in cls.VERSION_COLUMNS],
+                    ),
+                )
+            )
+            expired = db.session.scalars(
+                select(VERSION.c.census_version_id)
+                .where(
+                    VERSION.c.census_master_id == census_version.census_master_id,
+                    VERSION.c.snapshot_dts.is_not(None),
+                )
+                .order_by(
+                    VERSION.c.snapshot_dts.desc(), VERSION.c.census_version_id.desc()
+                )
+                .offset(limit)
+            ).all()
+            if expired:
+                db.session.execute(
+                    delete(snapshot).where(snapshot.c.census_version_id.in_(expired))
+                )
+                db.session.execute(
+                    update(VERSION)
+                    .where(VERSION.c.census_version_id.in_(expired))
+                    .values(snapshot_dts=None)
+                )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise e
+        return True
+
+    @classmethod
+    def census_rows(cls, census_master_id: int, version: int = None):
+        """
+        What to query the details of a census version from, the latest if
+        `version` isn't given. That is `ModelCensusDetail` for the latest
+        version, and otherwise an alias of it over the version's snapshot,
+        which is cached on first use, or over its rebuild from the deltas.
+        """
+        if version is None or version == cls.latest_census_version(census_master_id):
+            return md.ModelCensusDetail
+        census_version = md.ModelCensusVersion.query.filter_by(
+            census_master_id=census_master_id, version=version
+        ).one_or_none()
+        if census_version is None:
+            raise ValueError("Census version does not exist")
+
+        if (
+            census_version.snapshot_dts is None
+            and current_app.config["CENSUS_SNAPSHOT_LIMIT"]
+        ):
+            cls.cache_snapshot(census_version)
+            db.session.refresh(census_version)
+        if census_version.snapshot_dts is None:
+            rows = cls.version_select(census_master_id, version)
+        else:
+            rows = cls.snapshot_select(census_version.census_version_id)
+        return aliased(
+            md.ModelCensusDetail,
+            rows.subquery("census_version_detail"),
+            adapt_on_names=True,
+        )
+
+
+class CensusDetailBulkMixin:
+    DETAIL_COLUMNS = [
+        "tab",
+        "birthdate",
+        "relationship",
+        "tobacco_disposition",
+        "effective_date",
+    ]
+
+    @classmethod
+    def insert_census_details(
+        cls, census_master_id: int, rows, version: md.ModelCensusVersion = None
+    ):
+        """
+        Inserts the rows, noting them in the deltas of `version` if given
+        """
+        if not rows:
+            return 0
+        table = md.ModelCensusDetail.__table__
+        params = [
+            {
+                **{col: row[col] for col in cls.DETAIL_COLUMNS},
+                "census_master_id": census_master_id,
+            }
+            for row in rows
+        ]
+        if version is None:
+            db.session.execute(insert(table), params)
+        else:
+            ids = db.session.scalars(
+                insert(table).returning(table.c.census_detail_id), params
+            ).all()
+            CensusVersionMixin.note_inserts(version, ids)
+        return len(rows)
+
+    @classmethod
+    def row_keys(cls, df: pd.DataFrame):
+        """
+        Hash of each row, with the number of earlier rows with the same hash,
+        so that identical rows (e.g. twins) are told apart
+        """
+        import pandas as pd
+
+        hashes = pd.util.hash_pandas_object(
+            df[cls.DETAIL_COLUMNS].astype(str), index=False
+        )
+        return pd.MultiIndex.from_arrays([hashes, hashes.groupby(hashes).cumcount()])
+
+    @classmethod
+    def new_census_details(cls, census_master_id: int, rows):
+        """
+        The rows that aren't in the census yet. A row that is in the rows
+        twice but in the census once is new once. Dates are compared as
+        ISO strings.
+        """
+        import pandas as pd
+
+        table = md.ModelCensusDetail.__table__
+        existing = db.session.execute(
+            select(*[table.c[col] for col in cls.DETAIL_COLUMNS]).where(
+                table.c.census_master_id == census_master_id
+            )
+        ).all()
+        existing = pd.DataFrame(existing, columns=cls.DETAIL_COLUMNS)
+        incoming = pd.DataFrame(rows, columns=cls.DETAIL_COLUMNS)
+        is_new = ~cls.row_keys(incoming).isin(cls.row_keys(existing))
+        return [row for row, new in zip(rows, is_new) if new]
+
+    @classmethod
+    def replace_census_details(
+        cls, census_master_id: int, rows, version: md.ModelCensusVersion = None
+    ):
+        """
+        Replaces every detail of a census with the rows. Details that are
+        also in the rows are kept, so that only the others are deleted and
+        inserted in bulk. Does not commit.
+        """
+        import pandas as pd
+
+        table = md.ModelCensusDetail.__table__
+        existing = db.session.execute(
+            select(
+                table.c.census_detail_id, *[table.c[col] for col in cls.DETAIL_COLUMNS]
+            ).where(table.c.census_master_id == census_master_id)
+        ).all()
+        existing = pd.DataFrame(
+            existing, columns=["census_detail_id", *cls.DETAIL_COLUMNS]
+        )
+        incoming = pd.DataFrame(rows, columns=cls.DETAIL_COLUMNS)
+        existing_keys = cls.row_keys(existing)
+        incoming_keys = cls.row_keys(incoming)
+        deletes = existing["census_detail_id"][~existing_keys.isin(incoming_keys)]
+        inserts = [
+            row for row, new in zip(rows, ~incoming_keys.isin(existing_keys)) if new
+        ]
+        return {
+            "inserted": cls.insert_census_details(census_master_id, inserts, version),
+            "updated": 0,
+            "deleted": cls.delete_census_details(
+                census_master_id, deletes.tolist(), version
+            ),
+        }
+
+    @classmethod
+    def update_census_details(
+        cls, census_master_id: int, rows, version: md.ModelCensusVersion = None
+    ):
+        table = md.ModelCensusDetail.__table__
+        # executemany requires the same columns in each parameter set
+        groups = defaultdict(list)
+        for row in rows:
+            if "census_detail_id" not in row:
+                raise ValueError("Updates must include census_detail_id")
+            cols = tuple(col for col in cls.DETAIL_COLUMNS if col in row)
+            if cols:
+                groups[cols].append(row)
+
+        if version is not None:
+            ids = {
+                row["census_detail_id"] for group in groups.values() for row in group
+            }
+            CensusVersionMixin.copy_to_deltas(version, ids, "update")
+        updated = 0
+        for cols, group in groups.items():
+            stmt = (
+                update(table)
+                .where(
+                    table.c.census_detail_id == bindparam("b_census_detail_id"),
+                    table.c.census_master_id == census_master_id,
+                )
+                .values({col: bindparam(f"b_{col}") for col in cols})
+            )
+            result = db.session.execute(
+                stmt,
+                [
+                    {f"b_{k}": row[k] for k in ("census_detail_id", *cols)}
+                    for row in group
+                ],
+            )
+            updated += result.rowcount
+
+        if updated != sum(len(group) for group in groups.values()):
+            raise ValueError("Could not find all census details to update")
+        return updated
+
+    @classmethod
+    def delete_census_details(
+        cls, census_master_id: int, ids, version: md.ModelCensusVersion = None
+    ):
+        if not ids:
+            return 0
+        table = md.ModelCensusDetail.__table__
+        ids = set(ids)
+        if version is not None:
+            CensusVersionMixin.copy_to_deltas(version, ids, "delete")
+        deleted = 0
+        for batch in CensusVersionMixin.id_batches(ids):
+            result = db.session.execute(
+                delete(table).where(
+                    table.c.census_master_id == census_master_id,
+                    table.c.census_detail_id.in_(batch),
+                )
+            )
+            deleted += result.rowcount
+        if deleted != len(ids):
+            raise ValueError("Could not find all census details to delete")
+        return deleted
+
+    @classmethod
+    def apply_census_detail_changes(
+        cls, census_master_id: int, changes, version: md.ModelCensusVersion = None
+    ):
+        """
+        Applies inserts, updates and deletes keyed by census_detail_id using
+        bulk Core statements. Does not commit.
+        """
+        return {
+            "deleted": cls.delete_census_details(
+                census_master_id, changes["deletes"], version
+            ),
+            "updated": cls.update_census_details(
+                census_master_id, changes["updates"], version
+            ),
+            "inserted": cls.insert_census_details(
+                census_master_id, changes["inserts"], version
+            ),
+        }
+
+
+class MasterSearchMixin:
+    """
+    Ranked name search for the dropdowns. Names starting with the search text
+    come first, then names containing it, then names sharing its trigrams.
+    Without a search index, for fewer than 3 characters, or with
+    `mode=subsequence`, names match if they contain the characters in order.
+    """
+
+    search_index: SearchIndex = None
+    SEARCH_MODES = ["ranked", "subsequence"]
+    SIMILAR_TRIGRAMS = 3
+    # keys of the (id, name) rows the dropdowns return
+    SEARCH_RESULT_COLUMNS = ["id", "name"]
+
+    @staticmethod
+    def like_escape(value: str):
+        return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    @staticmethod
+    def phrase_query(value: str):
+        """
+        FTS5 phrase, which the trigram tokenizer matches as a substring
+        """
+        return '"' + value.replace('"', '""') + '"'
+
+    @classmethod
+    def trigram_query(cls, name: str):
+        """
+        FTS5 query matching the rarest trigrams of `name`, excluding names
+        that contain `name` itself. Common trigrams match most names, so
+        ranking them would cost far more than they add.
+        """
+        name = name.lower()
+        trigrams = dict.fromkeys(name[i : i + 3] for i in range(len(name) - 2))
+        trigrams = cls.search_index.rare_trigrams(
+            db.session.connection(), list(trigrams), cls.SIMILAR_TRIGRAMS
+        )
+        if not trigrams:
+            return None
+        any_trigram = " OR ".join(cls.phrase_query(t) for t in trigrams)
+        return f"({any_trigram}) NOT {cls.phrase_query(name)}"
+
+    @classmethod
+    def search_columns(cls):
+        model = cls.search_index.model
+        return (
+            inspect(model).primary_key[0],
+            getattr(model, cls.search_index.name_column),
+        )
+
+    @classmethod
+    def match_rank(cls, col, name: str):
+        escaped = cls.like_escape(name)
+        return case(
+            (col.ilike(escaped + "%", escape="\\"), 0),
+            (col.ilike("%" + escaped + "%", escape="\\"), 1),
+            else_=2,
+        )
+
+    @classmethod
+    def subsequence_search(cls, name: str):
+        id_col, name_col = cls.search_columns()
+        pattern = "%" + "%".join(cls.like_escape(c) for c in name) + "%"
+        return (
+            select(id_col, name_col)
+            .where(name_col.ilike(pattern, escape="\\"))
+            .order_by(cls.match_rank(name_col, name), func.length(name_col), id_col)
+        )
+
+    @classmethod
+    def prefix_condition(cls, col, name: str, dialect: str):
+        name = name.lower()
+        if dialect == "sqlite":
+            # a range on lower(name) can use the expression index
+            return and_(func.lower(col) >= name, func.lower(col) < name + "\U0010ffff")
+        return func.lower(col).like(cls.like_escape(name) + "%", escape="\\")
+
+    @classmethod
+    def prefix_search(cls, name: str, dialect: str):
+        id_col, name_col = cls.search_columns()
+        return (
+            select(id_col, name_col)
+            .where(cls.prefix_condition(name_col, name, dialect))
+            .order_by(func.lower(name_col), id_col)
+        )
+
+    @classmethod
+    def contains_search(cls, name: str, dialect: str):
+        id_col, name_col = cls.search_columns()
+        qry = select(id_col, name_col).where(
+            not_(cls.prefix_condition(name_col, name, dialect))
+        )
+        if dialect == "sqlite":
+            fts = cls.search_index.fts
+            return qry.join(fts, fts.c.rowid == id_col).where(
+                fts.c[cls.search_index.fts_name].match(cls.phrase_query(name))
+            )
+        contains = "%" + cls.like_escape(name) + "%"
+        return qry.where(name_col.ilike(contains, escape="\\"))
+
+    @classmethod
+    def similar_search(cls, name: str, dialect: str):
+        id_col, name_col = cls.search_columns()
+        qry = select(id_col, name_col)
+        if dialect == "sqlite":
+            fts = cls.search_index.fts
+            query = cls.trigram_query(name)
+            if query is None:
+                return None
+            return (
+                qry.join(fts, fts.c.rowid == id_col)
+                .where(fts.c[cls.search_index.fts_name].match(query))
+                .order_by(fts.c.rank, id_col)
+            )
+        # pg_trgm: `%>` is true when the name contains a word similar to the search text
+        contains = "%" + cls.like_escape(name) + "%"
+        return qry.where(
+            name_col.op("%>")(name),
+            not_(name_col.ilike(contains, escape="\\")),
+        ).order_by(func.word_similarity(name, name_col).desc(), id_col)
+
+    @classmethod
+    def search(cls, name: str, offset=0, limit=20, mode="ranked"):
+        if mode not in cls.SEARCH_MODES:
+            raise ValueError(
+                f"Invalid mode. Must be one of {', '.join(cls.SEARCH_MODES)}"
+            )
+        offset, limit = int(offset), int(limit)
+        connection = db.session.connection()
+        if (
+            mode == "subsequence"
+            or len(name) < 3
+            or not cls.search_index.is_available(connection)
+        ):
+            qry = cls.subsequence_search(name).offset(offset).limit(limit)
+            return db.session.execute(qry).all()
+
+        # each tier is only searched once the previous one runs out, so the
+        # common case never ranks more than a page of rows
+        dialect = connection.dialect.name
+        rows = []
+        for tier in (cls.prefix_search, cls.contains_search, cls.similar_search):
+            if len(rows) >= offset + limit:
+                break
+            qry = tier(name, dialect)
+            if qry is not None:
+                qry = qry.limit(offset + limit - len(rows))
+                rows += db.session.execute(qry).all()
+        return rows[offset:]
 
 
 class CensusStatsMixin:
     @staticmethod
     def year(dt):
-        return db.func.strftime("%Y", dt)
+        return sf.year(dt)
 
     @staticmethod
     def month(dt):
-        return db.func.strftime("%m", dt)
+        return sf.month(dt)
 
     @staticmethod
     def day(dt):
-        return db.func.strftime("%d", dt)
+        return sf.day(dt)
 
     @classmethod
     def yyyymmdd(cls, dt):
-        return cls.year(dt) * 10000 + cls.month(dt) * 100 + cls.day(dt)
+        return sf.yyyymmdd(dt)
 
     @classmethod
-    def base_census_query(cls, census_master_id):
-        CENSUS = md.ModelCensusDetail
+    def base_census_query(cls, census_master_id, census=None):
+        """
+        `census` is what to read the details from, see
+        `CensusVersionMixin.census_rows`
+        """
+        CENSUS = census or md.ModelCensusDetail
 
         qry = (
             db.session.query(
@@ -42,8 +690,11 @@ class CensusStatsMixin:
                 CENSUS.birthdate,
                 CENSUS.effective_date,
                 cast(
-                    (cls.yyyymmdd(func.now()) - cls.yyyymmdd(CENSUS.effective_date))
-                    / 10000,
+                    (
+                        cls.yyyymmdd(func.current_date())
+                        - cls.yyyymmdd(CENSUS.effective_date)
+                    )
+                    // 10000,
                     db.Integer,
                 ).label("tenure"),
             )
@@ -98,8 +749,8 @@ class CensusStatsMixin:
         return [row._asdict() for row in stats]
 
     @classmethod
-    def get_stats(cls, census_master_id: int):
-        qry = cls.base_census_query(census_master_id)
+    def get_stats(cls, census_master_id: int, census=None):
+        qry = cls.base_census_query(census_master_id, census)
         tobacco_stats = cls.calc_tobacco_stats(qry)
         relationship_stats = cls.calc_relationship_stats(qry)
         issue_age_stats = cls.calc_issue_age_stats(qry)
@@ -113,9 +764,30 @@ class CensusStatsMixin:
 
 
 class SaveAgeQueryMixin:
+    COHORT_COLUMNS = [
+        "relationship",
+        "tobacco_disposition",
+        "birthdate",
+        "effective_date",
+    ]
+
+    @staticmethod
+    def rate_join_condition(RATE, rate_master_id, relationship, tobacco, age):
+        return and_(
+            RATE.rate_master_id == rate_master_id,
+            relationship == RATE.relationship,
+            tobacco == RATE.tobacco_disposition,
+            age >= RATE.lower_age,
+            age <= RATE.upper_age,
+        )
+
     @classmethod
-    def base_save_age_query(cls, validated_data, offset, limit):
-        CENSUS = md.ModelCensusDetail
+    def base_save_age_query(cls, validated_data, offset, limit, census=None):
+        """
+        `census` is what to read the details from, see
+        `CensusVersionMixin.census_rows`
+        """
+        CENSUS = census or md.ModelCensusDetail
         SAVE_AGE_RATE = md.ModelRateDetail
         NEW_RATE = aliased(md.ModelRateDetail)
 
@@ -141,25 +813,23 @@ class SaveAgeQueryMixin:
             .select_from(CENSUS)
             .join(
                 SAVE_AGE_RATE,
-                and_(
-                    SAVE_AGE_RATE.rate_master_id == validated_data["rate_master_id"],
-                    CENSUS.relationship == SAVE_AGE_RATE.relationship,
-                    CENSUS.tobacco_disposition == SAVE_AGE_RATE.tobacco_disposition,
-                    CENSUS.issue_age >= SAVE_AGE_RATE.lower_age,
-                    CENSUS.issue_age <= SAVE_AGE_RATE.upper_age,
+                cls.rate_join_condition(
+                    SAVE_AGE_RATE,
+                    validated_data["rate_master_id"],
+                    CENSUS.relationship,
+                    CENSUS.tobacco_disposition,
+                    CENSUS.issue_age,
                 ),
                 isouter=True,
             )
             .join(
                 NEW_RATE,
-                and_(
-                    NEW_RATE.rate_master_id == validated_data["rate_master_id"],
-                    CENSUS.relationship == NEW_RATE.relationship,
-                    CENSUS.tobacco_disposition == NEW_RATE.tobacco_disposition,
-                    CENSUS.issue_age_as_of(validated_data["effective_date"])
-                    >= NEW_RATE.lower_age,
-                    CENSUS.issue_age_as_of(validated_data["effective_date"])
-                    <= NEW_RATE.upper_age,
+                cls.rate_join_condition(
+                    NEW_RATE,
+                    validated_data["rate_master_id"],
+                    CENSUS.relationship,
+                    CENSUS.tobacco_disposition,
+                    CENSUS.issue_age_as_of(validated_data["effective_date"]),
                 ),
                 isouter=True,
             )
@@ -170,6 +840,117 @@ class SaveAgeQueryMixin:
 
         return qry
 
+    @classmethod
+    def cohort_query(cls, census_master_id, census=None):
+        """
+        Collapses a census into its unique risk cells, weighted by member count
+        """
+        CENSUS = census or md.ModelCensusDetail
+        cohort_cols = [getattr(CENSUS, col) for col in cls.COHORT_COLUMNS]
+        return (
+            db.session.query(*cohort_cols, func.count().label("weight"))
+            .select_from(CENSUS)
+            .filter(CENSUS.census_master_id == census_master_id)
+            .group_by(*cohort_cols)
+        )
+
+    @classmethod
+    def cohort_save_age_query(cls, validated_data, census=None):
+        """
+        Prices each risk cell once. The output carries a `weight` column
+        so that `calc_save_age_stats` can aggregate without expanding the cells.
+        """
+        CENSUS = md.ModelCensusDetail
+        SAVE_AGE_RATE = md.ModelRateDetail
+        NEW_RATE = aliased(md.ModelRateDetail)
+
+        cells = cls.cohort_query(validated_data["census_master_id"], census).subquery()
+        issue_age = CENSUS.age_expression(cells.c.birthdate, cells.c.effective_date)
+        new_issue_age = CENSUS.age_expression(
+            cells.c.birthdate, validated_data["effective_date"]
+        )
+
+        qry = (
+            db.session.query(
+                *[cells.c[col] for col in cls.COHORT_COLUMNS],
+                cells.c.weight,
+                issue_age.label("issue_age"),
+                SAVE_AGE_RATE.rate.label("save_age_rate"),
+                NEW_RATE.rate.label("new_rate"),
+                (coalesce(NEW_RATE.rate, 0) - coalesce(SAVE_AGE_RATE.rate, 0)).label(
+                    "diff"
+                ),
+            )
+            .select_from(cells)
+            .join(
+                SAVE_AGE_RATE,
+                cls.rate_join_condition(
+                    SAVE_AGE_RATE,
+                    validated_data["rate_master_id"],
+                    cells.c.relationship,
+                    cells.c.tobacco_disposition,
+                    issue_age,
+                ),
+                isouter=True,
+            )
+            .join(
+                NEW_RATE,
+                cls.rate_join_condition(
+                    NEW_RATE,
+                    validated_data["rate_master_id"],
+                    cells.c.relationship,
+                    cells.c.tobacco_disposition,
+                    new_issue_age,
+                ),
+                isouter=True,
+            )
+        )
+
+        return qry
+
+    @classmethod
+    def expand_cohort_query(cls, validated_data, census=None):
+        """
+        Fans the priced risk cells back out to one row per census member.
+        Returns the same columns as `base_save_age_query`.
+        """
+        CENSUS = census or md.ModelCensusDetail
+
+        new_effective_date = datetime.datetime.strptime(
+            validated_data["effective_date"], "%Y-%m-%d"
+        ).date()
+        priced = cls.cohort_save_age_query(validated_data, census).subquery()
+
+        qry = (
+            db.session.query(
+                CENSUS.census_detail_id,
+                CENSUS.relationship,
+                CENSUS.tobacco_disposition,
+                priced.c.issue_age,
+                CENSUS.birthdate,
+                CENSUS.effective_date.label("save_age_effective_date"),
+                literal(new_effective_date).label("new_effective_date"),
+                priced.c.save_age_rate,
+                priced.c.new_rate,
+                priced.c.diff,
+            )
+            .select_from(CENSUS)
+            .join(
+                priced,
+                and_(
+                    *[
+                        getattr(CENSUS, col) == priced.c[col]
+                        for col in cls.COHORT_COLUMNS
+                    ]
+                ),
+            )
+            .filter(
+                CENSUS.census_master_id == validated_data["census_master_id"],
+            )
+        )
+
+        return qry
+
     @classmethod
     def calc_save_age_data(cls, qry, filters=[], sorts=None, offset=0, limit=100):
         _qry = qry.filter(*filters)
@@ -179,112 +960,567 @@ class SaveAgeQueryMixin:
 
     @classmethod
     def calc_save_age_stats(cls, qry):
+        """
+        Totals and rate change buckets for a save age query. If the query
+        has a `weight` column (see `cohort_save_age_query`), each row counts
+        `weight` times.
+        """
         subquery = qry.subquery()
+        weight = subquery.c.weight if "weight" in subquery.c else None
+        pct_change = subquery.c.diff / subquery.c.save_age_rate
+
+        def tally(condition):
+            if weight is None:
+                return func.count(case((condition, literal(1)), else_=None))
+            # SUM of a bigint is numeric on PostgreSQL
+            return cast(
+                coalesce(func.sum(case((condition, weight), else_=0)), 0), db.Integer
+            )
+
+        def total(col):
+            return func.sum(col if weight is None else col * weight)
+
+        count = func.count() if weight is None else tally(true())
         q = db.session.query(
-            func.count().label("count"),
-            func.sum(subquery.c.save_age_rate).label("save_age_rate"),
-            func.sum(subquery.c.new_rate).label("new_rate"),
-            func.sum(subquery.c.diff).label("diff"),
-            func.count(
-                case(
-                    (
-                        subquery.c.diff / subquery.c.save_age_rate <= 0,
-                        literal(1),
-                    ),
-                    else_=None,
-                )
-            ).label("pct_range_le_0"),
-            func.count(
-                case(
-                    (
-                        and_(
-                            subquery.c.diff / subquery.c.save_age_rate > 0,
-                            subquery.c.diff / subquery.c.save_age_rate <= 0.05,
-                        ),
-                        literal(1),
-                    ),
-                    else_=None,
-                )
-            ).label("pct_range_00_05"),
-            func.count(
-                case(
-                    (
-                        and_(
-                            subquery.c.diff / subquery.c.save_age_rate > 0.05,
-                            subquery.c.diff / subquery.c.save_age_rate <= 0.1,
-                        ),
-                        literal(1),
-                    ),
-                    else_=None,
-                )
-            ).label("pct_range_05_10"),
-            func.count(
-                case(
-                    (
-                        and_(
-                            subquery.c.diff / subquery.c.save_age_rate > 0.1,
-                            subquery.c.diff / subquery.c.save_age_rate <= 0.2,
-                        ),
-                        literal(1),
-                    ),
-                    else_=None,
-                )
-            ).label("pct_range_10_20"),
-            func.count(
-                case(
-                    (
-                        subquery.c.diff / subquery.c.save_age_rate > 0.2,
-                        literal(1),
-                    ),
-                    else_=None,
-                )
-            ).label("pct_range_gt_20"),
+            count.label("count"),
+            total(subquery.c.save_age_rate).label("save_age_rate"),
+            total(subquery.c.new_rate).label("new_rate"),
+            total(subquery.c.diff).label("diff"),
+            tally(pct_change <= 0).label("pct_range_le_0"),
+            tally(and_(pct_change > 0, pct_change <= 0.05)).label("pct_range_00_05"),
+            tally(and_(pct_change > 0.05, pct_change <= 0.1)).label("pct_range_05_10"),
+            tally(and_(pct_change > 0.1, pct_change <= 0.2)).label("pct_range_10_20"),
+            tally(pct_change > 0.2).label("pct_range_gt_20"),
         )
         stats = q.one()._asdict()
         return stats
 
 
+class SaveAgeGroupingMixin:
+    GROUP_VALUE_COLUMNS = ["save_age_rate", "new_rate", "diff"]
+
+    @classmethod
+    def group_columns(cls, subquery, band_width=5):
+        """
+        Maps each groupable dimension to its SQL expression over a save age
+        subquery and a function which casts a group key from the request
+        """
+        return {
+            "relationship": (subquery.c.relationship, str),
+            "tobacco_disposition": (subquery.c.tobacco_disposition, str),
+            "issue_age_band": (
+                (subquery.c.issue_age // band_width) * band_width,
+                int,
+            ),
+            "effective_month": (sf.year_month(subquery.c.save_age_effective_date), str),
+        }
+
+    @classmethod
+    def group_aggregates(cls, subquery):
+        aggs = [func.count().label("count")]
+        for col in cls.GROUP_VALUE_COLUMNS:
+            aggs.extend(
+                [
+                    func.sum(subquery.c[col]).label(f"{col}_sum"),
+                    func.count(subquery.c[col]).label(f"{col}_count"),
+                    func.avg(subquery.c[col]).label(f"{col}_avg"),
+                ]
+            )
+        return aggs
+
+    @classmethod
+    def calc_save_age_groups(
+        cls,
+        qry,
+        group_by: List[str],
+        group_keys: List[str] = None,
+        sorts=None,
+        offset=0,
+        limit=100,
+        band_width=5,
+    ):
+        """
+        Server side row model for the save age grid. Groups are expanded one
+        level at a time: if fewer keys than group columns are provided, the
+        groups at the next level are aggregated in a single pass. Otherwise,
+        the leaf rows of the fully expanded group are returned.
+        """
+        group_keys = group_keys or []
+        if len(group_keys) > len(group_by):
+            raise ValueError("More group keys than group columns")
+
+        subquery = qry.subquery()
+        group_cols = cls.group_columns(subquery, band_width=band_width)
+        try:
+            levels = [group_cols[col] for col in group_by]
+        except KeyError as e:
+            raise ValueError(f"Invalid group column {e}")
+
+        parent_filters = [
+            expr == to_key(key) for (expr, to_key), key in zip(levels, group_keys)
+        ]
+        # window count is evaluated before the limit, so it returns the total
+        # number of groups (or leaf rows) in the same pass
+        total = func.count().over().label("total_count")
+
+        if len(group_keys) < len(group_by):
+            colname = group_by[len(group_keys)]
+            group_expr = levels[len(group_keys)][0]
+            _qry = (
+                db.session.query(
+                    group_expr.label(colname),
+                    *cls.group_aggregates(subquery),
+                    total,
+                )
+                .filter(*parent_filters)
+                .group_by(group_expr)
+                .order_by(group_expr)
+            )
+        else:
+            _qry = db.session.query(subquery, total).filter(*parent_filters)
+            if sorts is not None:
+                _qry = _qry.order_by(text(sorts))
+
+        rows = [row._asdict() for row in _qry.limit(limit).offset(offset).all()]
+        count = rows[0]["total_count"] if rows else 0
+        for row in rows:
+            row.pop("total_count")
+        return rows, count
+
+
+class SaveAgeQuoteMixin:
+    QUOTE_COLUMNS = [
+        "birthdate",
+        "relationship",
+        "tobacco_disposition",
+        "effective_date",
+    ]
+    QUOTE_OUTPUT_COLUMNS = [
+        "row_number",
+        "relationship",
+        "tobacco_disposition",
+        "issue_age",
+        "birthdate",
+        "save_age_effective_date",
+        "new_effective_date",
+        "save_age_rate",
+        "new_rate",
+        "diff",
+    ]
+
+    @classmethod
+    def census_frame(cls, census):
+        """
+        Builds a census data frame from either a list of row dicts or a
+        columnar dict of lists
+        """
+        import numpy as np
+        import pandas as pd
+
+        try:
+            df = pd.DataFrame(census)
+        except ValueError:
+            raise ValueError("Census must be a list of rows or a dict of columns")
+        missing = [col for col in cls.QUOTE_COLUMNS if col not in df.columns]
+        if missing:
+            raise ValueError(f"Missing census columns: {', '.join(missing)}")
+
+        df = df[cls.QUOTE_COLUMNS].copy()
+        for col in ["birthdate", "effective_date"]:
+            try:
+                df[col] = pd.to_datetime(df[col], format="ISO8601")
+            except (ValueError, TypeError):
+                raise ValueError(f"Invalid dates in column {col}")
+        df.insert(0, "row_number", np.arange(1, len(df) + 1))
+        return df
+
+    @classmethod
+    def rate_frame(cls, rate_master_id: int):
+        import pandas as pd
+
+        RATE = md.ModelRateDetail
+        cols = ["relationship", "tobacco_disposition", "lower_age", "upper_age", "rate"]
+        rows = (
+            db.session.query(*[getattr(RATE, col) for col in cols])
+            .filter(RATE.rate_master_id == rate_master_id)
+            .all()
+        )
+        return pd.DataFrame.from_records(rows, columns=cols)
+
+    @staticmethod
+    def yyyymmdd(dt):
+        dt = getattr(dt, "dt", dt)
+        return dt.year * 10000 + dt.month * 100 + dt.day
+
+    @classmethod
+    def issue_age_vector(cls, birthdate, as_of):
+        """
+        Vectorized equivalent of `ModelCensusDetail.age_expression`
+        """
+        import numpy as np
+
+        age = (cls.yyyymmdd(as_of) - cls.yyyymmdd(birthdate)) / 10000
+        return np.trunc(age).astype("int64")
+
+    @classmethod
+    def lookup_rates(cls, df: pd.DataFrame, rates: pd.DataFrame, age_col: str):
+        """
+        Finds the rate of the band containing `age_col` for every row in `df`.
+        Rows without a matching band get NaN, like the outer join in SQL.
+        """
+        import numpy as np
+        import pandas as pd
+
+        if rates.empty:
+            return pd.Series(np.nan, index=df.index)
+
+        keys = ["relationship", "tobacco_disposition"]
+        left = df[keys + [age_col]].reset_index().sort_values(age_col)
+        right = rates.astype({"lower_age": "int64"}).sort_values("lower_age")
+        merged = pd.merge_asof(
+            left,
+            right,
+            left_on=age_col,
+            right_on="lower_age",
+            by=keys,
+            direction="backward",
+        )
+        rate = merged["rate"].where(merged[age_col] <= merged["upper_age"])
+        return pd.Series(rate.to_numpy(), index=merged["index"]).reindex(df.index)
+
+    @classmethod
+    def calc_quote(cls, census, rate_master_id: int, effective_date):
+        import pandas as pd
+
+        df = cls.census_frame(census)
+        rates = cls.rate_frame(rate_master_id)
+        new_effective_date = pd.Timestamp(effective_date)
+
+        df["issue_age"] = cls.issue_age_vector(df["birthdate"], df["effective_date"])
+        df["new_issue_age"] = cls.issue_age_vector(df["birthdate"], new_effective_date)
+        df["save_age_rate"] = cls.lookup_rates(df, rates, "issue_age")
+        df["new_rate"] = cls.lookup_rates(df, rates, "new_issue_age")
+        df["diff"] = df["new_rate"].fillna(0) - df["save_age_rate"].fillna(0)
+        df["new_effective_date"] = new_effective_date
+        return df.rename(columns={"effective_date": "save_age_effective_date"})[
+            cls.QUOTE_OUTPUT_COLUMNS
+        ]
+
+    @classmethod
+    def calc_quote_stats(cls, df: pd.DataFrame):
+        """
+        In-memory equivalent of `SaveAgeQueryMixin.calc_save_age_stats`
+        """
+        import numpy as np
+        import pandas as pd
+
+        pct_change = df["diff"] / df["save_age_rate"].replace(0, np.nan)
+
+        def total(col):
+            val = df[col].sum(min_count=1)
+            return None if pd.isna(val) else float(val)
+
+        return {
+            "count": len(df),
+            "save_age_rate": total("save_age_rate"),
+            "new_rate": total("new_rate"),
+            "diff": total("diff"),
+            "pct_range_le_0": int((pct_change <= 0).sum()),
+            "pct_range_00_05": int(((pct_change > 0) & (pct_change <= 0.05)).sum()),
+            "pct_range_05_10": int(((pct_change > 0.05) & (pct_change <= 0.1)).sum()),
+            "pct_range_10_20": int(((pct_change > 0.1) & (pct_change <= 0.2)).sum()),
+            "pct_range_gt_20": int((pct_change > 0.2).sum()),
+        }
+
+    @classmethod
+    def quote_records(cls, df: pd.DataFrame, offset=0, limit=100, shape="rows"):
+        page = df.iloc[offset : offset + limit].copy()
+        for col in ["birthdate", "save_age_effective_date", "new_effective_date"]:
+            page[col] = page[col].dt.strftime("%Y-%m-%d")
+        page = page.astype(object).where(page.notna(), None)
+        return page.to_dict(orient="list" if shape == "columnar" else "records")
+
+
+class CensusValidationMixin:
+    """
+    Checks every row of an uploaded census at once, so that all the problems
+    in a file are reported together instead of the upload failing on the
+    first bad row
+    """
+
+    VALIDATION_MESSAGES = {
+        "missing_birthdate": "Birthdate is missing",
+        "invalid_birthdate": "Birthdate is not a date",
+        "missing_effective_date": "Effective date is missing",
+        "invalid_effective_date": "Effective date is not a date",
+        "birthdate_after_effective_date": "Birthdate is after the effective date",
+        "missing_relationship": "Relationship is missing",
+        "unknown_relationship": "Relationship code is not known",
+        "missing_tobacco_disposition": "Tobacco disposition is missing",
+        "unknown_tobacco_disposition": "Tobacco disposition code is not known",
+        "age_outside_rate_bands": "Issue age is outside the bands of the rate table",
+    }
+
+    @staticmethod
+    def strip_text(col: pd.Series):
+        """
+        Strips the text cells of a column and leaves the rest, as turning
+        dates into text to strip them is slow
+        """
+        import numpy as np
+        import pandas as pd
+
+        try:
+            stripped = col.str.strip()
+        except AttributeError:
+            # no text cells, e.g. dates read from a workbook
+            return col
+        values = np.where(stripped.notna(), stripped, col)
+        return pd.Series(values, index=col.index, dtype=object)
+
+    @classmethod
+    def validate_census(
+        cls,
+        df: pd.DataFrame,
+        rate_master_id: int = None,
+        relationships: List[str] = None,
+        tobacco_dispositions: List[str] = None,
+    ):
+        """
+        Parses the dates and codes of a stacked census and returns it with a
+        frame holding a column of failures for each check. Codes are checked
+        against those of the rate table if there is one, or else against
+        `relationships` and `tobacco_dispositions` if given. Rows without any
+        census values are dropped.
+        """
+        import pandas as pd
+
+        columns = ["birthdate", "relationship", "tobacco_disposition", "effective_date"]
+        missing = [col for col in columns if col not in df.columns]
+        if missing:
+            raise ValueError(f"Missing census columns: {', '.join(missing)}")
+
+        values = df[columns].apply(cls.strip_text)
+        blank = values.isna() | (values == "")
+        df = df.loc[~blank.all(axis=1)].copy()
+        blank = blank.loc[df.index]
+
+        checks = {}
+        for col in ["birthdate", "effective_date"]:
+            df[col] = pd.to_datetime(df[col].where(~blank[col]), errors="coerce")
+            checks[f"missing_{col}"] = blank[col]
+            checks[f"invalid_{col}"] = ~blank[col] & df[col].isna()
+        checks["birthdate_after_effective_date"] = (
+            df["birthdate"] > df["effective_date"]
+        )
+
+        codes = {
+            "relationship": relationships,
+            "tobacco_disposition": tobacco_dispositions,
+        }
+        if rate_master_id is not None:
+            rates = SaveAgeQuoteMixin.rate_frame(rate_master_id)
+            codes = {col: rates[col].unique() for col in codes}
+        for col, known in codes.items():
+            text = values.loc[df.index, col]
+            df[col] = text.astype(str).where(text.notna())
+            checks[f"missing_{col}"] = blank[col]
+            checks[f"unknown_{col}"] = pd.Series(False, index=df.index)
+            if known is not None and len(known):
+                checks[f"unknown_{col}"] = ~blank[col] & ~df[col].isin(known)
+
+        # only rows that passed the other checks can be priced
+        outside = pd.Series(False, index=df.index)
+        rows = df.loc[~pd.DataFrame(checks).any(axis=1)]
+        if rate_master_id is not None and not rows.empty:
+            rows = rows.assign(
+                issue_age=SaveAgeQuoteMixin.issue_age_vector(
+                    rows["birthdate"], rows["effective_date"]
+                )
+            )
+            rate = SaveAgeQuoteMixin.lookup_rates(rows, rates, "issue_age")
+            outside.loc[rows.index] = rate.isna()
+        checks["age_outside_rate_bands"] = outside
+
+        return df, pd.DataFrame(checks, index=df.index)
+
+    @classmethod
+    def validation_report(
+        cls, df: pd.DataFrame, checks: pd.DataFrame, sample_rows: int = 20
+    ):
+        """
+        Counts of the rows that failed each check, with the first
+        `sample_rows` row numbers of each tab
+        """
+        rejected = checks.any(axis=1)
+        errors = {}
+        for check in checks.columns[checks.any()]:
+            failed = df.loc[checks[check], ["tab", "row_number"]]
+            errors[check] = {
+                "message": cls.VALIDATION_MESSAGES[check],
+                "count": len(failed),
+                "rows": {
+                    tab: rows.head(sample_rows).tolist()
+                    for tab, rows in failed.groupby("tab", sort=False)["row_number"]
+                },
+            }
+        return {
+            "rows": len(df),
+            "accepted": int((~rejected).sum()),
+            "rejected": int(rejected.sum()),
+            "errors": errors,
+        }
+
+
 class RateDetailMixin:
+    DETAIL_COLUMNS = [
+        "lower_age",
+        "upper_age",
+        "relationship",
+        "tobacco_disposition",
+        "rate",
+    ]
+
     @classmethod
-    def unbounded_min(cls, data, umin="N", default_umin_value=-9999):
+    def unbounded_min(cls, df: pd.DataFrame, umin="N", default_umin_value=-9999):
         if umin != "Y":
-            return data
-        data = sorted(data, key=lambda x: x["lower_age"])
-        lowest_age = data[0]["lower_age"]
-        return [
-            row
-            if row["lower_age"] != lowest_age
-            else {**row, "lower_age": default_umin_value}
-            for row in data
-        ]
+            return df
+        lowest = df["lower_age"] == df["lower_age"].min()
+        df.loc[lowest, "lower_age"] = default_umin_value
+        return df
 
     @classmethod
-    def unbounded_max(cls, data, umax="N", default_umax_value=9999):
+    def unbounded_max(cls, df: pd.DataFrame, umax="N", default_umax_value=9999):
         if umax != "Y":
-            return data
-        data = sorted(data, key=lambda x: x["upper_age"])
-        highest_age = data[-1]["upper_age"]
-        return [
-            row
-            if row["upper_age"] != highest_age
-            else {**row, "upper_age": default_umax_value}
-            for row in data
-        ]
+            return df
+        highest = df["upper_age"] == df["upper_age"].max()
+        df.loc[highest, "upper_age"] = default_umax_value
+        return df
+
+    @classmethod
+    def modify_rate_details(cls, df: pd.DataFrame, *args, **kwargs):
+        df = cls.unbounded_min(df, kwargs.get("umin", "N"))
+        df = cls.unbounded_max(df, kwargs.get("umax", "N"))
+        return df
+
+    @classmethod
+    def clean(cls, df: pd.DataFrame):
+        """
+        The detail columns with numeric ages and rates and stripped codes.
+        Missing columns are left empty, for `validate_rate_details` to report.
+        """
+        import pandas as pd
+
+        df = df.reindex(columns=cls.DETAIL_COLUMNS)
+        for col in ("lower_age", "upper_age", "rate"):
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+        for col in ("relationship", "tobacco_disposition"):
+            df[col] = df[col].astype("string").str.strip().replace("", pd.NA)
+        return df
 
     @classmethod
-    def modify_rate_details(cls, data, *args, **kwargs):
-        data = cls.unbounded_min(data, kwargs.get("umin", "N"))
-        data = cls.unbounded_max(data, kwargs.get("umax", "N"))
-        return data
+    def validate_rate_details(cls, df: pd.DataFrame):
+        """
+        Checks that no rate is missing a value, and that the age bands of each
+        relationship and tobacco disposition neither overlap nor skip ages
+        """
+        missing = [col for col in cls.DETAIL_COLUMNS if df[col].isna().any()]
+        if missing:
+            raise ValueError(f"Missing values in columns: {', '.join(missing)}")
+
+        inverted = df["lower_age"] > df["upper_age"]
+        if inverted.any():
+            row = df[inverted].iloc[0]
+            raise ValueError(
+                f"Invalid age band {row['lower_age']:.0f}-{row['upper_age']:.0f}"
+            )
+
+        keys = ["relationship", "tobacco_disposition"]
+        df = df.sort_values(keys + ["lower_age"])
+        # the highest age covered by the earlier bands of the same group
+        covered = (
+            df.groupby(keys, sort=False)["upper_age"]
+            .cummax()
+            .groupby([df[key] for key in keys], sort=False)
+            .shift()
+        )
+        overlap = df["lower_age"] <= covered
+        gap = df["lower_age"] > covered + 1
+        for bad, message in [
+            (overlap, "Age bands overlap at age {lower:.0f}"),
+            (gap, "Age bands skip ages {start:.0f}-{end:.0f}"),
+        ]:
+            if bad.any():
+                row = df[bad].iloc[0]
+                detail = message.format(
+                    lower=row["lower_age"],
+                    start=covered[bad].iloc[0] + 1,
+                    end=row["lower_age"] - 1,
+                )
+                raise ValueError(
+                    f"{detail} for {row['relationship']}, {row['tobacco_disposition']}"
+                )
+
+    @classmethod
+    def insert_rate_details(cls, rate_master_id: int, df: pd.DataFrame):
+        rows = (
+            df[cls.DETAIL_COLUMNS]
+            .assign(rate_master_id=rate_master_id)
+            .to_dict(orient="records")
+        )
+        if rows:
+            db.session.execute(insert(md.ModelRateDetail.__table__), rows)
+        return len(rows)
+
+    @classmethod
+    def replace_rate_details(cls, rate_master_id: int, rows: List[dict], **kwargs):
+        """
+        Replaces the details of a rate table with `rows`, checked like an
+        uploaded rate table. Doesn't commit.
+        """
+        import pandas as pd
+
+        df = cls.clean(pd.DataFrame(rows))
+        cls.validate_rate_details(df)
+        df = df.astype({"lower_age": int, "upper_age": int})
+        df = cls.modify_rate_details(df, **kwargs)
+
+        RATE = md.ModelRateDetail
+        db.session.execute(delete(RATE).where(RATE.rate_master_id == rate_master_id))
+        return cls.insert_rate_details(rate_master_id, df)
+
+
+class LazyLLMClient:
+    """
+    Builds the Anthropic client the first time it is read, so that importing
+    the mixins doesn't import anthropic
+    """
+
+    def __init__(self):
+        self.client = None
+        self._lock = threading.Lock()
+
+    def __get__(self, obj, owner=None):
+        if self.client is None:
+            with self._lock:
+                if self.client is None:
+                    import anthropic
+
+                    # retries and timeouts are handled by the LLMGateway
+                    self.client = anthropic.AsyncAnthropic(
+                        api_key=os.getenv("ANTHROPIC_API_KEY"),
+                        max_retries=0,
+                    )
+        return self.client
 
 
 class CensusProcessorLLMMixin:
-    LLM_CLIENT = anthropic.Anthropic(
-        api_key=os.getenv("ANTHROPIC_API_KEY"),
-    )
+    LLM_CLIENT = LazyLLMClient()
 
     SYSTEM_PROMPT__TABS_CONTAINING_CENSUSES = """
     The prompt contains multiple Excel tabs, each of which has its data concatentated together in a comma-separated string.
+    Each tab starts with its name. The first line of its data holds the column numbers, and each row starts with its row number.
+    Empty rows and columns are left out and only a sample of the rows is shown, so use these numbers rather than counting.
     Your job is to identify which tabs, if any, contain census data. 
     A census file will be tabular data with columns that include the following columns: 
     - relationship
@@ -351,13 +1587,27 @@ class CensusProcessorLLMMixin:
     Be concise. Do not include any extraneous information.
 """
 
+    # output tokens allowed per tab, as each census tab gets its own config
+    MAX_TOKENS_PER_TAB = 200
+
     @classmethod
-    def tab_to_text(cls, dfs: Dict[str, pd.DataFrame], nrow=20, *args, **kwargs):
-        return {
-            tab: df.iloc[:nrow].to_csv(index=False, header=False)
-            for tab, df in dfs.items()
-            if df is not None
-        }
+    def tabs_prompt(cls, dfs: Dict[str, pd.DataFrame], preprocess=None):
+        """
+        Returns the prompt text of each tab in `dfs` and a summary of the
+        prompt, see `TabPromptBuilder`
+        """
+        config = current_app.config
+        builder = TabPromptBuilder(
+            token_budget=config["LLM_PROMPT_TOKEN_BUDGET"],
+            sample_rows=config["LLM_PROMPT_SAMPLE_ROWS"],
+            max_cell_chars=config["LLM_PROMPT_MAX_CELL_CHARS"],
+            per_tab=config["LLM_PER_TAB_CALLS"],
+        )
+        return builder.build(dfs, preprocess)
+
+    @classmethod
+    def max_tokens(cls, ntabs: int):
+        return min(4096, max(1024, cls.MAX_TOKENS_PER_TAB * ntabs))
 
     @classmethod
     def preprocessor_to_text(cls, data: Dict[str, Dict[str, int]]):
@@ -369,29 +1619,72 @@ class CensusProcessorLLMMixin:
             ]
         )
 
+    @classmethod
+    def llm_request(cls, system: str, prompt: str, max_tokens: int = 1024):
+        return {
+            "model": os.getenv("ANTHROPIC_MODEL_ID"),
+            "system": system,
+            "max_tokens": max_tokens,
+            "messages": [{"role": "user", "content": prompt}],
+        }
+
+    @classmethod
+    def llm_gather(cls, requests: List[Dict]):
+        """
+        Sends the requests concurrently through the worker's `LLMGateway`
+        """
+        return get_gateway(current_app.config).gather(cls.LLM_CLIENT, requests)
+
+    @classmethod
+    def llm_json(cls, message):
+        if isinstance(message, Exception):
+            raise message
+        return [json.loads(msg.text) for msg in message.content][0]
+
     @classmethod
     def llm_identify_tabs_containing_censuses(
-        cls, dfs: Dict[str, pd.DataFrame], preprocess=None, **kwargs
+        cls, dfs: Dict[str, pd.DataFrame], preprocess=None, prompt=None, **kwargs
     ):
-        tab_strings = cls.tab_to_text(dfs, **kwargs)
-        prompt = "\n\n".join(
-            [f"{tab}\n{tab_string}" for tab, tab_string in tab_strings.items()]
-        )
-        system_prompt = cls.SYSTEM_PROMPT__TABS_CONTAINING_CENSUSES
-        if preprocess is not None:
-            system_prompt = (
-                system_prompt + "\n\n" + cls.preprocessor_to_text(preprocess)
+        """
+        With `LLM_PER_TAB_CALLS`, each tab is sent as its own request and the
+        requests run concurrently. Otherwise the tabs are sent together. Either
+        way `LLM_PROMPT_TOKEN_BUDGET` covers the whole workbook.
+        """
+        if prompt is None:
+            prompt, _ = cls.tabs_prompt(dfs, preprocess)
+
+        def system_prompt(tabs):
+            if preprocess is None:
+                return cls.SYSTEM_PROMPT__TABS_CONTAINING_CENSUSES
+            hints = {tab: preprocess[tab] for tab in tabs if tab in preprocess}
+            return (
+                cls.SYSTEM_PROMPT__TABS_CONTAINING_CENSUSES
+                + "\n\n"
+                + cls.preprocessor_to_text(hints)
             )
 
-        message = cls.LLM_CLIENT.messages.create(
-            model=os.getenv("ANTHROPIC_MODEL_ID"),
-            system=system_prompt,
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}],
-        )
+        if current_app.config["LLM_PER_TAB_CALLS"]:
+            groups = [[tab] for tab in prompt]
+        else:
+            groups = [list(prompt)] if prompt else []
+        requests = [
+            cls.llm_request(
+                system_prompt(tabs),
+                "\n\n".join(prompt[tab] for tab in tabs),
+                cls.max_tokens(len(tabs)),
+            )
+            for tabs in groups
+        ]
 
+        mapper = []
         try:
-            mapper = [json.loads(msg.text) for msg in message.content][0]
+            for tabs, message in zip(groups, cls.llm_gather(requests)):
+                # a tab's request can only describe that tab
+                mapper += [
+                    config
+                    for config in cls.llm_json(message)
+                    if len(tabs) > 1 or config.get("tab_name") in tabs
+                ]
             schema = sch.SchemaCensusConfigLLM(many=True)
             mapper = schema.load(mapper)
         except Exception:
@@ -401,17 +1694,13 @@ class CensusProcessorLLMMixin:
 
     @classmethod
     def llm_identify_column_mapping(cls, df: pd.DataFrame, **kwargs):
-        prompt = cls.tab_to_text({"default": df}, **kwargs)["default"]
-
-        message = cls.LLM_CLIENT.messages.create(
-            model=os.getenv("ANTHROPIC_MODEL_ID"),
-            system=cls.SYSTEM_PROMPT__COLUMN_MAPPER,
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}],
+        prompt, _ = cls.tabs_prompt({"default": df})
+        request = cls.llm_request(
+            cls.SYSTEM_PROMPT__COLUMN_MAPPER, "\n\n".join(prompt.values())
         )
 
         try:
-            mapper = [json.loads(msg.text) for msg in message.content][0]
+            mapper = cls.llm_json(cls.llm_gather([request])[0])
         except Exception:
             raise ValueError("Unable to process column mapping provided by the LLM")
         else:
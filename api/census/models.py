@@ -2,6 +2,7 @@ from extensions import db
 from sqlalchemy import cast
 from sqlalchemy.ext.hybrid import hybrid_property, hybrid_method
 from shared import BaseModel
+import sql_functions as sf
 
 
 class ModelCensusMaster(BaseModel):
@@ -12,7 +13,10 @@ class ModelCensusMaster(BaseModel):
     census_path = db.Column(db.String(1000))
 
     census_details = db.relationship(
-        "ModelCensusDetail", backref="census_master", cascade="all,delete"
+        "ModelCensusDetail",
+        backref="census_master",
+        cascade="all,delete",
+        passive_deletes=True,
     )
 
 
@@ -35,15 +39,15 @@ class ModelCensusDetail(BaseModel):
 
     @staticmethod
     def year(dt):
-        return db.func.strftime("%Y", dt)
+        return sf.year(dt)
 
     @staticmethod
     def month(dt):
-        return db.func.strftime("%m", dt)
+        return sf.month(dt)
 
     @staticmethod
     def day(dt):
-        return db.func.strftime("%d", dt)
+        return sf.day(dt)
 
     @hybrid_property
     def issue_age(self):
@@ -62,22 +66,7 @@ class ModelCensusDetail(BaseModel):
 
     @issue_age.expression
     def issue_age(cls):
-        return cast(
-            (
-                (
-                    cls.year(cls.effective_date) * 10000
-                    + cls.month(cls.effective_date) * 100
-                    + cls.day(cls.effective_date)
-                )
-                - (
-                    cls.year(cls.birthdate) * 10000
-                    + cls.month(cls.birthdate) * 100
-                    + cls.day(cls.birthdate)
-                )
-            )
-            / 10000,
-            db.Integer,
-        )
+        return cls.age_expression(cls.birthdate, cls.effective_date)
 
     @hybrid_method
     def issue_age_as_of(self, effective_date):
@@ -96,24 +85,146 @@ class ModelCensusDetail(BaseModel):
 
     @issue_age_as_of.expression
     def issue_age_as_of(cls, effective_date):
+        return cls.age_expression(cls.birthdate, effective_date)
+
+    @classmethod
+    def age_expression(cls, birthdate, as_of):
+        """
+        SQL expression for the age attained at `as_of` by someone born on `birthdate`
+        """
         return cast(
-            (
-                (
-                    cls.year(effective_date) * 10000
-                    + cls.month(effective_date) * 100
-                    + cls.day(effective_date)
-                )
-                - (
-                    cls.year(cls.birthdate) * 10000
-                    + cls.month(cls.birthdate) * 100
-                    + cls.day(cls.birthdate)
-                )
-            )
-            / 10000,
+            (sf.yyyymmdd(as_of) - sf.yyyymmdd(birthdate)) // 10000,
             db.Integer,
         )
 
 
+class ModelCensusTab(BaseModel):
+    """
+    Where the census data of each uploaded tab starts and how its columns
+    map, so that rows can be appended from a later version of the file
+    without asking the LLM again. Tabs without census data have no config.
+    """
+
+    __tablename__ = "census_tab"
+
+    census_tab_id = db.Column(db.Integer, primary_key=True)
+    census_master_id = db.Column(
+        db.ForeignKey(
+            "census_master.census_master_id",
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        )
+    )
+    tab_name = db.Column(db.String(200), nullable=False)
+    start_row_number = db.Column(db.Integer)
+    start_column_number = db.Column(db.Integer)
+    column_mapper = db.Column(db.JSON(none_as_null=True))
+
+
+class ModelCensusQuarantine(BaseModel):
+    """
+    Uploaded rows that failed validation and were left out of the census,
+    with their values as read and the checks they failed
+    """
+
+    __tablename__ = "census_quarantine"
+
+    census_quarantine_id = db.Column(db.Integer, primary_key=True)
+    census_master_id = db.Column(
+        db.ForeignKey(
+            "census_master.census_master_id",
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        )
+    )
+    tab = db.Column(db.String(200), nullable=False)
+    row_number = db.Column(db.Integer, nullable=False)
+    birthdate = db.Column(db.String(50))
+    relationship = db.Column(db.String(50))
+    tobacco_disposition = db.Column(db.String(50))
+    effective_date = db.Column(db.String(50))
+    errors = db.Column(db.String(500), nullable=False)
+
+
+class ModelCensusVersion(BaseModel):
+    """
+    A change to the details of a census. Version 1 is the census as it was
+    first saved. The details table always holds the latest version, and the
+    rows a version changed are kept, as they were before, in its deltas.
+    `snapshot_dts` is set while the version is cached in `census_snapshot`.
+    """
+
+    __tablename__ = "census_version"
+
+    census_version_id = db.Column(db.Integer, primary_key=True)
+    census_master_id = db.Column(
+        db.ForeignKey(
+            "census_master.census_master_id",
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        )
+    )
+    version = db.Column(db.Integer, nullable=False)
+    inserted = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.Integer, nullable=False, default=0)
+    deleted = db.Column(db.Integer, nullable=False, default=0)
+    snapshot_dts = db.Column(db.DateTime)
+
+
+class ModelCensusDelta(BaseModel):
+    """
+    A census detail a version inserted, updated or deleted. The values are
+    those of the detail before the change, and empty for an insert.
+    """
+
+    __tablename__ = "census_delta"
+
+    census_delta_id = db.Column(db.Integer, primary_key=True)
+    census_version_id = db.Column(
+        db.ForeignKey(
+            "census_version.census_version_id",
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        ),
+        nullable=False,
+    )
+    census_master_id = db.Column(db.Integer, nullable=False, index=True)
+    census_detail_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)
+    tab = db.Column(db.String(200))
+    birthdate = db.Column(db.Date)
+    relationship = db.Column(db.String(50))
+    tobacco_disposition = db.Column(db.String(50))
+    effective_date = db.Column(db.Date)
+
+
+class ModelCensusSnapshot(BaseModel):
+    """
+    The details of an earlier census version, cached so that it doesn't
+    have to be rebuilt from the deltas each time it is read
+    """
+
+    __tablename__ = "census_snapshot"
+
+    census_snapshot_id = db.Column(db.Integer, primary_key=True)
+    census_version_id = db.Column(
+        db.ForeignKey(
+            "census_version.census_version_id",
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        ),
+        nullable=False,
+        index=True,
+    )
+    census_master_id = db.Column(db.Integer, nullable=False)
+    census_detail_id = db.Column(db.Integer, nullable=False)
+    tab = db.Column(db.String(200), nullable=False)
+    birthdate = db.Column(db.Date, nullable=False)
+    relationship = db.Column(db.String(50), nullable=False)
+    tobacco_disposition = db.Column(db.String(50), nullable=False)
+    effective_date = db.Column(db.Date, nullable=False)
+
+
 class ModelRateMaster(BaseModel):
     __tablename__ = "rate_master"
 
@@ -121,7 +232,10 @@ class ModelRateMaster(BaseModel):
     rate_master_name = db.Column(db.String(200))
 
     rate_details = db.relationship(
-        "ModelRateDetail", backref="rate_master", cascade="all,delete"
+        "ModelRateDetail",
+        backref="rate_master",
+        cascade="all,delete",
+        passive_deletes=True,
     )
 
 
@@ -141,3 +255,56 @@ class ModelRateDetail(BaseModel):
     relationship = db.Column(db.String(50), nullable=False)
     tobacco_disposition = db.Column(db.String(50), nullable=False)
     rate = db.Column(db.Float, nullable=False)
+
+
+class ModelPortfolioRun(BaseModel):
+    __tablename__ = "portfolio_run"
+
+    portfolio_run_id = db.Column(db.Integer, primary_key=True)
+    rate_master_id = db.Column(
+        db.ForeignKey(
+            "rate_master.rate_master_id",
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        )
+    )
+    effective_date = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="PENDING")
+    total = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    started_dts = db.Column(db.DateTime)
+    finished_dts = db.Column(db.DateTime)
+
+    portfolio_results = db.relationship(
+        "ModelPortfolioResult",
+        backref="portfolio_run",
+        cascade="all,delete",
+        passive_deletes=True,
+    )
+
+
+class ModelPortfolioResult(BaseModel):
+    __tablename__ = "portfolio_result"
+
+    portfolio_result_id = db.Column(db.Integer, primary_key=True)
+    portfolio_run_id = db.Column(
+        db.ForeignKey(
+            "portfolio_run.portfolio_run_id",
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        )
+    )
+    census_master_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    error = db.Column(db.String(1000))
+    elapsed_seconds = db.Column(db.Float)
+    count = db.Column(db.Integer)
+    save_age_rate = db.Column(db.Float)
+    new_rate = db.Column(db.Float)
+    diff = db.Column(db.Float)
+    pct_range_le_0 = db.Column(db.Integer)
+    pct_range_00_05 = db.Column(db.Integer)
+    pct_range_05_10 = db.Column(db.Integer)
+    pct_range_10_20 = db.Column(db.Integer)
+    pct_range_gt_20 = db.Column(db.Integer)
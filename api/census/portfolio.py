@@ -0,0 +1,149 @@
+import time
+import datetime
+import threading
+import multiprocessing
+from typing import List
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from flask import Flask
+from extensions import db
+from . import models as md
+from .mixins import SaveAgeQueryMixin, SaveAgeQuoteMixin
+
+_WORKER_APP = None
+
+
+def _init_worker():
+    """
+    Builds one app per pool process so that each worker has its own engine,
+    without the routes, schema setup and warm-up of the web app
+    """
+    global _WORKER_APP
+    from app import create_worker_app
+
+    _WORKER_APP = create_worker_app()
+
+
+def run_census(census_master_id: int, rate_master_id: int, effective_date: str):
+    """
+    Calculates the save age stats for a single census inside a pool worker.
+    Errors are returned instead of raised, so one bad census cannot abort the run.
+    """
+    start = time.perf_counter()
+    try:
+        with _WORKER_APP.app_context():
+            if md.ModelCensusMaster.get(census_master_id) is None:
+                raise ValueError("Census does not exist")
+            qry = SaveAgeQueryMixin.cohort_save_age_query(
+                {
+                    "census_master_id": census_master_id,
+                    "rate_master_id": rate_master_id,
+                    "effective_date": effective_date,
+                }
+            )
+            result = {**SaveAgeQueryMixin.calc_save_age_stats(qry), "status": "SUCCESS"}
+    except Exception as e:
+        result = {"status": "FAILED", "error": str(e)[:1000]}
+    return {
+        **result,
+        "census_master_id": census_master_id,
+        "elapsed_seconds": time.perf_counter() - start,
+    }
+
+
+def add_rows_to_results(census_master_id: int, rows) -> int:
+    """
+    Adds the save age stats of rows appended to a census to its successful
+    portfolio results, rather than running the census again. The stats are
+    all totals, so the new rows are priced on their own. Does not commit.
+    """
+    RESULT = md.ModelPortfolioResult
+    RUN = md.ModelPortfolioRun
+    results = (
+        db.session.query(RESULT, RUN.rate_master_id, RUN.effective_date)
+        .join(RUN, RUN.portfolio_run_id == RESULT.portfolio_run_id)
+        .filter(RESULT.census_master_id == census_master_id, RESULT.status == "SUCCESS")
+        .all()
+    )
+
+    stats = {}
+    for result, rate_master_id, effective_date in results:
+        key = (rate_master_id, effective_date)
+        if key not in stats:
+            quote = SaveAgeQuoteMixin.calc_quote(rows, rate_master_id, effective_date)
+            stats[key] = SaveAgeQuoteMixin.calc_quote_stats(quote)
+        for col, value in stats[key].items():
+            current = getattr(result, col)
+            if value is not None:
+                setattr(result, col, value if current is None else current + value)
+    return len(results)
+
+
+class PortfolioRunner:
+    def __init__(
+        self,
+        app: Flask,
+        portfolio_run_id: int,
+        census_master_ids: List[int],
+        max_workers: int = None,
+    ):
+        self.app = app
+        self.portfolio_run_id = portfolio_run_id
+        self.census_master_ids = census_master_ids
+        self.max_workers = max_workers
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def record(self, run: md.ModelPortfolioRun, result: dict):
+        db.session.add(
+            md.ModelPortfolioResult(
+                portfolio_run_id=run.portfolio_run_id,
+                **result,
+            )
+        )
+        if result["status"] == "SUCCESS":
+            run.completed += 1
+        else:
+            run.failed += 1
+        db.session.commit()
+
+    def run(self):
+        with self.app.app_context():
+            run = md.ModelPortfolioRun.get(self.portfolio_run_id)
+            run.status = "RUNNING"
+            run.started_dts = datetime.datetime.now()
+            run.save()
+
+            rate_master_id = run.rate_master_id
+            effective_date = run.effective_date.isoformat()
+            # spawn rather than fork: the parent is a threaded web worker
+            ctx = multiprocessing.get_context("spawn")
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=ctx,
+                    initializer=_init_worker,
+                ) as pool:
+                    futures = {
+                        pool.submit(run_census, id, rate_master_id, effective_date): id
+                        for id in self.census_master_ids
+                    }
+                    for future in as_completed(futures):
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            result = {
+                                "census_master_id": futures[future],
+                                "status": "FAILED",
+                                "error": str(e)[:1000],
+                            }
+                        self.record(run, result)
+                run.status = "COMPLETE"
+            except Exception:
+                db.session.rollback()
+                run.status = "FAILED"
+
+            run.finished_dts = datetime.datetime.now()
+            run.save()
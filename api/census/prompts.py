@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import io
+import csv
+import math
+import datetime
+from typing import TYPE_CHECKING, Dict, List
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# a rough but stable estimate for English and CSV text
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class TabPromptBuilder:
+    """
+    Renders the top of each tab as CSV for the LLM, within a token budget.
+
+    Each tab is its name followed by a CSV whose first line holds the 1-based
+    column numbers and whose rows start with their 1-based row number, so the
+    LLM can answer in workbook coordinates even though empty rows and columns
+    are left out. Of each tab, the rows just above the header, the header and
+    a sample of the data rows are shown, with long values cut short. Tabs that
+    are empty or have no header row are dropped. When the prompt is over
+    budget, fewer data rows are shown, and finally tabs are dropped, smallest
+    first. With `per_tab`, each tab is sent on its own and gets an even share
+    of the budget, which still covers all of the requests together.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 6000,
+        sample_rows: int = 10,
+        context_rows: int = 2,
+        max_cell_chars: int = 40,
+        per_tab: bool = False,
+    ):
+        self.token_budget = token_budget
+        self.per_tab = per_tab
+        self.sample_rows = sample_rows
+        self.context_rows = context_rows
+        self.max_cell_chars = max_cell_chars
+
+    def cell(self, value):
+        if value is None or value != value:
+            return ""
+        if isinstance(value, datetime.datetime):
+            value = value.date() if value.time() == datetime.time() else value
+            return value.isoformat()
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        value = str(value).strip().replace("\n", " ")
+        if len(value) > self.max_cell_chars:
+            return value[: self.max_cell_chars - 3] + "..."
+        return value
+
+    def sample_positions(self, positions: List[int], n: int):
+        """
+        The first half of `n` rows, then rows evenly spread over the rest
+        """
+        if len(positions) <= n:
+            return positions
+        head = math.ceil(n / 2)
+        if head == n:
+            return positions[:head]
+        rest = positions[head:]
+        step = len(rest) / (n - head)
+        return positions[:head] + [rest[int(i * step)] for i in range(n - head)]
+
+    def profile(self, df: pd.DataFrame, header_row):
+        """
+        Positions of the context rows above the header, the header, and the
+        non-empty rows below it
+        """
+        positions = df.notna().any(axis=1).to_numpy().nonzero()[0]
+        header = df.index.get_loc(header_row)
+        above = positions[positions < header].tolist()
+        below = positions[positions > header].tolist()
+        return above[-self.context_rows :] if self.context_rows else [], header, below
+
+    def render_tab(self, tab: str, df: pd.DataFrame, profile, rows: int):
+        above, header, below = profile
+        positions = above + [header] + self.sample_positions(below, rows)
+        block = df.iloc[positions]
+        columns = [i for i, shown in enumerate(block.notna().any().to_numpy()) if shown]
+        block = block.iloc[:, columns]
+
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(["row", *[i + 1 for i in columns]])
+        for position, values in zip(positions, block.itertuples(index=False)):
+            writer.writerow([position + 1, *[self.cell(value) for value in values]])
+        return f"{tab}\n{buf.getvalue().rstrip()}"
+
+    def fit(self, dfs: Dict[str, pd.DataFrame], profiles: dict, budget: int):
+        """
+        Renders the tabs with as many sample rows as fit in `budget` together
+        """
+        rows = self.sample_rows
+        while True:
+            blocks = {
+                tab: self.render_tab(tab, dfs[tab], profile, rows)
+                for tab, profile in profiles.items()
+            }
+            tokens = estimate_tokens("\n\n".join(blocks.values()))
+            if tokens <= budget or rows == 0:
+                return blocks, rows
+            rows = rows // 2
+
+    def build(self, dfs: Dict[str, pd.DataFrame], preprocess: Dict[str, dict] = None):
+        """
+        Returns the prompt text of each tab shown, and a summary of the prompt
+        for the upload metadata. `preprocess` gives the header row of each tab, as found by
+        `CensusUploadHandler.preprocess`; without it, the first non-empty row
+        is taken as the header.
+        """
+        dropped, profiles = {}, {}
+        for tab, df in dfs.items():
+            if df is None or df.empty or not df.notna().any().any():
+                dropped[tab] = "empty"
+                continue
+            if preprocess is None:
+                header_row = df.index[df.notna().any(axis=1).to_numpy()][0]
+            else:
+                header_row = (preprocess.get(tab) or {}).get("start_row")
+            if header_row is None:
+                dropped[tab] = "no_header"
+            else:
+                profiles[tab] = self.profile(df, header_row)
+
+        if self.per_tab:
+            blocks, rows = {}, self.sample_rows
+            share = self.token_budget // max(len(profiles), 1)
+            for tab, profile in profiles.items():
+                block, tab_rows = self.fit(dfs, {tab: profile}, share)
+                blocks.update(block)
+                rows = min(rows, tab_rows)
+        else:
+            blocks, rows = self.fit(dfs, profiles, self.token_budget)
+
+        # still over budget with headers only, so keep the largest tabs
+        tokens = estimate_tokens("\n\n".join(blocks.values()))
+        if tokens > self.token_budget:
+            by_size = sorted(
+                blocks, key=lambda tab: len(profiles[tab][2]), reverse=True
+            )
+            kept, total = [], 0
+            for tab in by_size:
+                size = estimate_tokens(blocks[tab]) + 1
+                if kept and total + size > self.token_budget:
+                    dropped[tab] = "budget"
+                    continue
+                kept.append(tab)
+                total += size
+            blocks = {tab: block for tab, block in blocks.items() if tab in kept}
+
+        text = "\n\n".join(blocks.values())
+        summary = {
+            "chars": len(text),
+            "estimated_tokens": estimate_tokens(text),
+            "token_budget": self.token_budget,
+            "per_tab": self.per_tab,
+            "sample_rows": rows,
+            "tabs": list(blocks),
+            "dropped_tabs": dropped,
+        }
+        return blocks, summary
@@ -1,23 +1,58 @@
-import os
+import datetime
+from concurrent.futures import ThreadPoolExecutor
 from extensions import db, limiter
 from typing import List
 from flask import request, current_app
 from flask_restx import Resource
-from sqlalchemy import not_
+from sqlalchemy import not_, select
+from sqlalchemy.inspection import inspect
 from marshmallow import ValidationError
 from shared import BaseResource, BaseListResource
-from .file_handler import CensusUploadHandler, RateUploadHandler
+from serializers import SHAPES, json_response, rows_to_payload
+from .portfolio import PortfolioRunner
+from .archives import archive_members, file_extension
+from .uploads import ChunkedUpload
 
 from . import models as md
 from . import schemas as sch
 from . import mixins as mix
+from . import search
 
 
-class CRUDCensusMaster(BaseResource):
+def int_arg(name: str, default: int, min_value: int = 0):
+    """
+    An integer query parameter, raising a ValueError if it isn't a whole
+    number of at least `min_value`
+    """
+    value = request.args.get(name, type=int)
+    if value is None:
+        if name in request.args:
+            raise ValueError(f"{name} must be an integer")
+        return default
+    if value < min_value:
+        raise ValueError(f"{name} must be at least {min_value}")
+    return value
+
+
+class CRUDCensusMaster(
+    mix.CensusVersionMixin,
+    mix.CensusDetailBulkMixin,
+    mix.MasterPurgeMixin,
+    BaseResource,
+):
     model = md.ModelCensusMaster
     schema = sch.SchemaCensusMaster()
 
     RETRIEVE_EXCLUDE_FIELDS = ["census_details"]
+    # snapshots and deltas before the versions they belong to
+    PURGE_CHILDREN = [
+        md.ModelCensusDetail,
+        md.ModelCensusTab,
+        md.ModelCensusQuarantine,
+        md.ModelCensusSnapshot,
+        md.ModelCensusDelta,
+        md.ModelCensusVersion,
+    ]
 
     @classmethod
     def retrieve(cls, id, *args, **kwargs):
@@ -31,54 +66,91 @@ class CRUDCensusMaster(BaseResource):
 
     @classmethod
     def update(cls, id, data, *args, **kwargs):
+        """
+        `census_details` replaces the full detail set, while
+        `census_detail_changes` applies inserts, updates and deletes.
+        Both are applied in bulk and committed with the master record, as a
+        new version of the census if any detail changed.
+        """
+        census = cls.model.get(id)
+        if census is None:
+            raise ValueError("Census does not exist")
+        if "census_details" in data and "census_detail_changes" in data:
+            raise ValueError("Provide either census_details or census_detail_changes")
+
         try:
-            census = cls.model.get(id)
+            changes = {"inserted": 0, "updated": 0, "deleted": 0}
+            version = None
+            if "census_details" in data or "census_detail_changes" in data:
+                version = cls.new_census_version(id)
             if "census_details" in data:
-                for dtl in census.census_details:
-                    db.session.delete(
-                        dtl
-                    )  # relies on the save() method below to commit or rollback
-
-                new_census_detail_data = data.pop("census_details", [])
-                new_census_detail_objs = sch.SchemaCensusDetail(many=True).load(
-                    new_census_detail_data
+                rows = sch.SchemaCensusDetailBulk(many=True).load(
+                    data.pop("census_details")
+                )
+                changes = cls.replace_census_details(id, rows, version)
+            if "census_detail_changes" in data:
+                delta = sch.SchemaCensusDetailChanges().load(
+                    data.pop("census_detail_changes")
                 )
-                census.census_details = new_census_detail_objs
+                changes = cls.apply_census_detail_changes(id, delta, version)
+            if version is not None:
+                if any(changes.values()):
+                    for key, value in changes.items():
+                        setattr(version, key, value)
+                else:
+                    db.session.delete(version)
 
             for key, value in data.items():
                 setattr(census, key, value)
 
             census.save()
-            return cls.schema.dump(census)
         except Exception as e:
+            db.session.rollback()
             raise e
 
+        output = sch.SchemaCensusMaster(exclude=("census_details",)).dump(census)
+        return {**output, "changes": changes, "version": cls.latest_census_version(id)}
 
-class CRUDCensusMasterDropdownList(BaseListResource):
+    @classmethod
+    def delete(cls, id, *args, **kwargs):
+        return super().delete(id, *args, **request.args)
+
+
+class CRUDCensusMasterDropdownList(mix.MasterSearchMixin, BaseListResource):
     model = md.ModelCensusMaster
-    schema = sch.SchemaCensusMasterDropdown(many=True)
+    search_index = search.CENSUS_MASTER_SEARCH
 
     @classmethod
     def list(cls, name, *args, **kwargs):
         offset = kwargs.get("offset", 0)
         limit = kwargs.get("limit", 20)
-        fuzzy_search = "%" + "%".join(list(name)) + "%"
-        obj = (
-            cls.model.query.filter(cls.model.census_name.ilike(fuzzy_search))
-            .limit(limit)
-            .offset(offset)
-            .all()
-        )
-        return cls.schema.dump(obj)
+        mode = kwargs.get("mode", "ranked")
+        rows = cls.search(name, offset, limit, mode)
+        return json_response(rows_to_payload(rows, cls.SEARCH_RESULT_COLUMNS))
 
 
-class CensusStats(mix.CensusStatsMixin, Resource):
+class CensusStats(mix.CensusVersionMixin, mix.CensusStatsMixin, Resource):
     @classmethod
     def get(cls, id, *args, **kwargs):
-        stats = cls.get_stats(id)
+        try:
+            census = cls.census_rows(id, request.args.get("version", type=int))
+        except ValueError as e:
+            return {"status": "error", "msg": str(e)}, 400
+        stats = cls.get_stats(id, census)
         return stats, 200
 
 
+class CensusVersionList(Resource):
+    @classmethod
+    def get(cls, id, *args, **kwargs):
+        versions = (
+            md.ModelCensusVersion.query.filter_by(census_master_id=id)
+            .order_by(md.ModelCensusVersion.version)
+            .all()
+        )
+        return sch.SchemaCensusVersion(many=True).dump(versions), 200
+
+
 class CRUDCensusDetailList(BaseListResource):
     model = md.ModelCensusDetail
     schema = sch.SchemaCensusDetail(many=True)
@@ -91,27 +163,53 @@ class CRUDCensusDetailList(BaseListResource):
                 filters[k] = v
         return filters
 
+    @classmethod
+    def source(cls, id, version=None):
+        """
+        The table to list the rows from, or the rows of an earlier version
+        of the census
+        """
+        version = int(version) if version is not None else None
+        return inspect(mix.CensusVersionMixin.census_rows(id, version)).selectable
+
     @classmethod
     def list(cls, id, *args, **kwargs):
         offset = kwargs.get("offset", 0)
         limit = kwargs.get("limit", 100)
+        shape = kwargs.get("shape", "rows")
+        table = cls.source(id, kwargs.get("version"))
+        filters = cls.get_filters(request.args)
         # sortby = getattr(cls.model, kwargs.get("sort", "census_detail_id"))
-        obj = (
-            cls.model.query.filter(cls.model.census_master_id == id)
-            .filter_by(**cls.get_filters(request.args))
+        stmt = (
+            select(*table.columns)
+            .where(table.c.census_master_id == id)
+            .where(*[table.c[k] == v for k, v in filters.items() if k in table.c])
             # .order_by(sortby.desc() if desc == "Y" else sortby)
             .limit(limit)
             .offset(offset)
-            .all()
         )
-        return cls.schema.dump(obj)
+        result = db.session.execute(stmt)
+        return json_response(rows_to_payload(result.all(), result.keys(), shape))
+
+
+class CRUDCensusQuarantineList(CRUDCensusDetailList):
+    """
+    The rows of a census's uploads that failed validation
+    """
+
+    model = md.ModelCensusQuarantine
+
+    @classmethod
+    def source(cls, id, version=None):
+        return cls.model.__table__
 
 
-class CRUDRateMaster(mix.RateDetailMixin, BaseResource):
+class CRUDRateMaster(mix.RateDetailMixin, mix.MasterPurgeMixin, BaseResource):
     model = md.ModelRateMaster
     schema = sch.SchemaRateMaster()
 
     RETRIEVE_EXCLUDE_FIELDS = ["rate_details"]
+    PURGE_CHILDREN = [md.ModelRateDetail]
 
     @classmethod
     def retrieve(cls, id, *args, **kwargs):
@@ -125,56 +223,50 @@ class CRUDRateMaster(mix.RateDetailMixin, BaseResource):
 
     @classmethod
     def update(cls, id, data, *args, **kwargs):
+        """
+        `rate_details` replaces the full detail set, checked and inserted in
+        bulk like an uploaded rate table
+        """
+        rate_master = cls.model.get(id)
+        if rate_master is None:
+            raise ValueError("Rate table does not exist")
+
         try:
-            rate_master = cls.model.get(id)
             if "rate_details" in data:
-                for dtl in rate_master.rate_details:
-                    db.session.delete(
-                        dtl
-                    )  # relies on the save() method below to commit or rollback
-
-                new_rate_detail_data = data.pop("rate_details", [])
-                new_rate_detail_data = cls.modify_rate_details(
-                    new_rate_detail_data, **kwargs
-                )
-
-                new_rate_detail_objs = sch.SchemaRateDetail(many=True).load(
-                    new_rate_detail_data
-                )
-                rate_master.rate_details = new_rate_detail_objs
+                cls.replace_rate_details(id, data.pop("rate_details") or [], **kwargs)
 
             for key, value in data.items():
                 setattr(rate_master, key, value)
 
             rate_master.save()
-            return cls.schema.dump(rate_master)
         except Exception as e:
+            db.session.rollback()
             raise e
+        return cls.schema.dump(rate_master)
 
     @classmethod
     def patch(cls, id, *args, **kwargs):
         return super().patch(id, *args, **request.args)
 
+    @classmethod
+    def delete(cls, id, *args, **kwargs):
+        return super().delete(id, *args, **request.args)
+
 
-class CRUDRateMasterDropdownList(BaseListResource):
+class CRUDRateMasterDropdownList(mix.MasterSearchMixin, BaseListResource):
     model = md.ModelRateMaster
-    schema = sch.SchemaRateMasterDropdown(many=True)
+    search_index = search.RATE_MASTER_SEARCH
 
     @classmethod
     def list(cls, name, *args, **kwargs):
         offset = kwargs.get("offset", 0)
         limit = kwargs.get("limit", 20)
-        fuzzy_search = "%" + "%".join(list(name)) + "%"
-        obj = (
-            cls.model.query.filter(cls.model.rate_master_name.ilike(fuzzy_search))
-            .limit(limit)
-            .offset(offset)
-            .all()
-        )
-        return cls.schema.dump(obj)
+        mode = kwargs.get("mode", "ranked")
+        rows = cls.search(name, offset, limit, mode)
+        return json_response(rows_to_payload(rows, cls.SEARCH_RESULT_COLUMNS))
 
 
-class SaveAgeCalc(mix.SaveAgeQueryMixin, Resource):
+class SaveAgeCalc(mix.CensusVersionMixin, mix.SaveAgeQueryMixin, Resource):
     @classmethod
     def apply_operator(cls, col, op, val):
         if op == "greaterThan":
@@ -197,12 +289,13 @@ class SaveAgeCalc(mix.SaveAgeQueryMixin, Resource):
             raise ValueError("Invalid operator")
 
     @classmethod
-    def filter_parser(cls, filter_string: str):
+    def filter_parser(cls, filter_string: str, census=None):
         """
         Parses a filter string into a list of SQLAlchemy filter objects
         Required format is `column::operator::value`
         Multiple filters can be separated by `;;`
         """
+        census = census or md.ModelCensusDetail
         output_filters = []
         filters = filter_string.split(";;")
 
@@ -210,7 +303,7 @@ class SaveAgeCalc(mix.SaveAgeQueryMixin, Resource):
             ft = cond.split("::")
             if len(ft) != 3:
                 raise ValueError("Invalid filter format")
-            col = getattr(md.ModelCensusDetail, ft[0])
+            col = getattr(census, ft[0])
             if col is None:
                 raise ValueError("Invalid column name")
             output_filters.append(cls.apply_operator(col, ft[1], ft[2]))
@@ -237,42 +330,204 @@ class SaveAgeCalc(mix.SaveAgeQueryMixin, Resource):
     @classmethod
     def post(cls, *args, **kwargs):
         data = request.get_json()
-        offset = request.args.get("offset", 0)
-        limit = request.args.get("limit", 100)
+        try:
+            offset = int_arg("offset", 0)
+            limit = int_arg("limit", 100, min_value=1)
+        except ValueError as e:
+            return {"status": "error", "msg": str(e)}, 400
         filter_string = request.args.get("filters")
-        qry = cls.base_save_age_query(data, offset, limit)
+        cohort = request.args.get("mode") == "cohort"
+        try:
+            sch.SchemaSaveAgeInputs().load(data)
+        except ValidationError as e:
+            return {"status": "error", "msg": e.messages}, 400
+
+        try:
+            census = cls.census_rows(
+                data["census_master_id"], data.get("census_version")
+            )
+        except ValueError as e:
+            return {"status": "error", "msg": str(e)}, 400
+        if cohort:
+            qry = cls.expand_cohort_query(data, census)
+            stats_qry = cls.cohort_save_age_query(data, census)
+        else:
+            qry = cls.base_save_age_query(data, offset, limit, census)
+            stats_qry = qry
         qry_columns = [col.get("name") for col in qry.column_descriptions]
 
         try:
-            filters = cls.filter_parser(filter_string) if filter_string else []
+            filters = cls.filter_parser(filter_string, census) if filter_string else []
             sort = cls.sort_parser(qry_columns, request.args.get("sort"))
         except ValueError as e:
             return {"status": "error", "msg": str(e)}, 400
 
+        data = cls.calc_save_age_data(
+            qry, filters=filters, sorts=sort, offset=offset, limit=limit
+        )
+        stats = cls.calc_save_age_stats(stats_qry)
+        try:
+            data = rows_to_payload(data, qry_columns, request.args.get("shape", "rows"))
+        except ValueError as e:
+            return {"status": "error", "msg": str(e)}, 400
+        return json_response({"data": data, "stats": stats})
+
+
+class SaveAgeGroups(mix.SaveAgeGroupingMixin, SaveAgeCalc):
+    @classmethod
+    def post(cls, *args, **kwargs):
+        data = request.get_json()
+        try:
+            offset = int_arg("offset", 0)
+            limit = int_arg("limit", 100, min_value=1)
+            band_width = int_arg("band_width", 5, min_value=1)
+        except ValueError as e:
+            return {"status": "error", "msg": str(e)}, 400
+        filter_string = request.args.get("filters")
+        group_string = request.args.get("group_by")
+        key_string = request.args.get("group_keys")
+
         try:
             sch.SchemaSaveAgeInputs().load(data)
         except ValidationError as e:
             return {"status": "error", "msg": e.messages}, 400
 
-        data = cls.calc_save_age_data(
-            qry, filters=filters, sorts=sort, offset=offset, limit=limit
+        try:
+            census = cls.census_rows(
+                data["census_master_id"], data.get("census_version")
+            )
+        except ValueError as e:
+            return {"status": "error", "msg": str(e)}, 400
+        qry = cls.base_save_age_query(data, offset, limit, census)
+        qry_columns = [col.get("name") for col in qry.column_descriptions]
+
+        try:
+            if not group_string:
+                raise ValueError("At least one group column is required")
+            group_by = group_string.split(",")
+            group_keys = key_string.split(";;") if key_string else []
+            filters = cls.filter_parser(filter_string, census) if filter_string else []
+            sort = cls.sort_parser(qry_columns, request.args.get("sort"))
+            rows, count = cls.calc_save_age_groups(
+                qry.filter(*filters),
+                group_by,
+                group_keys,
+                sorts=sort,
+                offset=offset,
+                limit=limit,
+                band_width=band_width,
+            )
+        except ValueError as e:
+            return {"status": "error", "msg": str(e)}, 400
+
+        return json_response({"data": rows, "count": count})
+
+
+class SaveAgeQuote(mix.SaveAgeQuoteMixin, Resource):
+    @classmethod
+    def post(cls, *args, **kwargs):
+        try:
+            offset = int_arg("offset", 0)
+            limit = int_arg("limit", 100, min_value=1)
+        except ValueError as e:
+            return {"status": "error", "msg": str(e)}, 400
+
+        try:
+            data = sch.SchemaSaveAgeQuoteInputs().load(request.get_json())
+        except ValidationError as e:
+            return {"status": "error", "msg": e.messages}, 400
+
+        try:
+            df = cls.calc_quote(
+                data["census"], data["rate_master_id"], data["effective_date"]
+            )
+        except ValueError as e:
+            return {"status": "error", "msg": str(e)}, 400
+
+        shape = request.args.get("shape", "rows")
+        if shape not in SHAPES:
+            return {"status": "error", "msg": "Invalid shape"}, 400
+        return json_response(
+            {
+                "data": cls.quote_records(df, offset=offset, limit=limit, shape=shape),
+                "stats": cls.calc_quote_stats(df),
+            }
         )
-        stats = cls.calc_save_age_stats(qry)
+
+
+class PortfolioRun(BaseResource):
+    model = md.ModelPortfolioRun
+    schema = sch.SchemaPortfolioRun()
+    allowed_methods = ["GET", "POST"]
+
+    @classmethod
+    def resolve_census_ids(cls, census_master_ids):
+        CENSUS = md.ModelCensusMaster
+        if census_master_ids == "all":
+            return [
+                row.census_master_id
+                for row in db.session.query(CENSUS.census_master_id).all()
+            ]
+        if not isinstance(census_master_ids, list) or not all(
+            isinstance(id, int) for id in census_master_ids
+        ):
+            raise ValueError("census_master_ids must be a list of ids or 'all'")
+        return list(dict.fromkeys(census_master_ids))
+
+    @staticmethod
+    def progress(run: md.ModelPortfolioRun):
+        processed = run.completed + run.failed
+        elapsed = None
+        if run.started_dts is not None:
+            end = run.finished_dts or datetime.datetime.now()
+            elapsed = (end - run.started_dts).total_seconds()
         return {
-            "data": sch.SchemaSaveAgeOutput(many=True).dump(data),
-            "stats": stats,
-        }, 200
+            "processed": processed,
+            "pct_complete": processed / run.total if run.total else 1.0,
+            "elapsed_seconds": elapsed,
+            "censuses_per_second": processed / elapsed if elapsed else None,
+        }
+
+    @classmethod
+    def retrieve(cls, id, *args, **kwargs):
+        run = cls.model.get(id)
+        if run is None:
+            raise ValueError("Portfolio run does not exist")
+        return {**cls.schema.dump(run), "progress": cls.progress(run)}
+
+    @classmethod
+    def create(cls, data, *args, **kwargs):
+        inputs = sch.SchemaPortfolioRunInputs().load(data)
+        census_master_ids = cls.resolve_census_ids(inputs["census_master_ids"])
+        run = cls.model(
+            rate_master_id=inputs["rate_master_id"],
+            effective_date=inputs["effective_date"],
+            total=len(census_master_ids),
+            status="PENDING",
+        )
+        run.save()
+
+        PortfolioRunner(
+            current_app._get_current_object(),
+            run.portfolio_run_id,
+            census_master_ids,
+            max_workers=current_app.config["PORTFOLIO_MAX_WORKERS"],
+        ).start()
+        return sch.SchemaPortfolioRun(exclude=("portfolio_results",)).dump(run)
 
 
 class CensusUpload(Resource):
     @classmethod
     def post(cls, *args, **kwargs):
+        # pandas is only imported when a file is uploaded
+        from .file_handler import CensusUploadHandler
+
         uploaded_file = request.files["file"]
         custom_filename = request.form.get("name", uploaded_file.filename)
         filename = uploaded_file.filename
         if filename == "":
             return {"status": "error", "msg": "No file selected"}, 400
-        file_ext = os.path.splitext(filename)[1]
+        file_ext = file_extension(filename)
         if file_ext not in current_app.config["FILE_UPLOAD_EXTENSIONS"]:
             return {"status": "error", "msg": "Invalid file format"}, 400
 
@@ -292,14 +547,23 @@ class RateUpload(Resource):
         filename = uploaded_file.filename
         if filename == "":
             return {"status": "error", "msg": "No file selected"}, 400
-        file_ext = os.path.splitext(filename)[1]
+        return cls.save_upload(uploaded_file, custom_filename)
+
+    @staticmethod
+    def save_upload(uploaded_file, name: str):
+        from .file_handler import RateUploadHandler
+
+        file_ext = file_extension(uploaded_file.filename)
         if file_ext not in current_app.config["FILE_UPLOAD_EXTENSIONS"]:
             return {"status": "error", "msg": "Invalid file format"}, 400
 
-        file_handler = RateUploadHandler(uploaded_file, filename=custom_filename)
-        rate_master = file_handler.save(**request.args)
+        file_handler = RateUploadHandler(uploaded_file, filename=name)
+        try:
+            rate_master = file_handler.save(**request.args)
+        except ValueError as e:
+            return {"status": "error", "msg": str(e)}, 400
         output_data = sch.SchemaRateMaster(exclude=("rate_details",)).dump(rate_master)
-        return output_data, 200
+        return {**output_data, "metadata": dict(file_handler.metadata)}, 200
 
 
 class CensusParser(Resource):
@@ -344,24 +608,252 @@ class CensusParser(Resource):
     @limiter.limit("1/second")
     def post(self):
         uploaded_file = request.files["file"]
-        custom_filename = request.form.get("name", uploaded_file.filename)
         filename = uploaded_file.filename
         if filename == "":
             return {"status": "error", "msg": "No file selected"}, 400
-        file_ext = os.path.splitext(filename)[1]
+        return self.parse_upload(
+            uploaded_file,
+            request.form.get("name"),
+            request.form.get("census_master_id", type=int),
+            rate_master_id=request.form.get("rate_master_id", type=int),
+            partial=request.form.get("partial", "N") == "Y",
+        )
+
+    @classmethod
+    def parse_upload(
+        cls, uploaded_file, name: str = None, census_master_id=None, **options
+    ):
+        """
+        Parses an uploaded file, or each file in an uploaded archive, as a
+        census named `name` or after the file. With `census_master_id`, the
+        rows of the file that the census doesn't have yet are added to it.
+        `options` are the validation options of `CensusUploadHandler`.
+        """
+        from .file_handler import CensusUploadHandler
+
+        rate_master_id = options.get("rate_master_id")
+        if (
+            rate_master_id is not None
+            and md.ModelRateMaster.get(rate_master_id) is None
+        ):
+            return {"status": "error", "msg": "Rate table does not exist"}, 404
+
+        file_ext = file_extension(uploaded_file.filename)
+        if file_ext in current_app.config["ARCHIVE_UPLOAD_EXTENSIONS"]:
+            if census_master_id is not None:
+                msg = "Only a workbook or CSV can be appended to a census"
+                return {"status": "error", "msg": msg}, 400
+            return cls.parse_archive(uploaded_file, name, **options)
         if file_ext not in current_app.config["FILE_UPLOAD_EXTENSIONS"]:
             return {"status": "error", "msg": "Invalid file format"}, 400
 
-        file_handler = CensusUploadHandler(uploaded_file, filename=custom_filename)
+        census_master = None
+        if census_master_id is not None:
+            census_master = md.ModelCensusMaster.get(census_master_id)
+            if census_master is None:
+                return {"status": "error", "msg": "Census does not exist"}, 404
+            name = census_master.census_name
+
+        file_handler = CensusUploadHandler(
+            uploaded_file, filename=name or uploaded_file.filename, **options
+        )
         try:
+            return cls.parse(file_handler, census_master), 200
+        except Exception as e:
+            return cls.parse_error(e), 400
+
+    @staticmethod
+    def parse_error(e: Exception):
+        from .file_handler import CensusValidationError
+
+        error = {"status": "error", "msg": str(e)}
+        if isinstance(e, CensusValidationError):
+            error["validation"] = e.report
+        return error
+
+    @staticmethod
+    def parse(file_handler, census_master=None):
+        if census_master is None:
             file_handler.process()
             census_master = file_handler.save()
-            output_data = sch.SchemaCensusMaster().dump(census_master)
-            raw_data = file_handler.raw_data()
-        except Exception as e:
-            return {"status": "error", "msg": str(e)}, 400
+        else:
+            census_master_id = census_master.census_master_id
+            file_handler.process(file_handler.census_tabs(census_master_id))
+            census_master = file_handler.append(census_master)
+        output_data = sch.SchemaCensusMaster(exclude=("census_details",)).dump(
+            census_master
+        )
         return {
             "data": output_data,
+            "summary": file_handler.summary(),
             "metadata": dict(file_handler.metadata),
-            "raw_data": raw_data,
-        }, 200
+            "raw_data": file_handler.raw_data(),
+        }
+
+    @classmethod
+    def parse_archive(cls, uploaded_file, name: str = None, **options):
+        """
+        Parses each workbook or CSV in a zip archive as its own census, in
+        parallel. The response lists the result of each file, and is an error
+        only if none of them could be parsed.
+        """
+        from .file_handler import CensusUploadHandler
+
+        config = current_app.config
+        if isinstance(uploaded_file, ChunkedUpload):
+            stream = uploaded_file.open()
+        else:
+            stream = uploaded_file.stream
+        try:
+            members = archive_members(
+                stream,
+                config["FILE_UPLOAD_EXTENSIONS"],
+                max_files=config["ARCHIVE_MAX_FILES"],
+                max_bytes=config["ARCHIVE_MAX_BYTES"],
+            )
+        except ValueError as e:
+            return {"status": "error", "msg": str(e)}, 400
+
+        app = current_app._get_current_object()
+
+        def parse_member(member):
+            census_name = f"{name} - {member.name}" if name else member.name
+            with app.app_context():
+                try:
+                    file_handler = CensusUploadHandler(
+                        member, filename=census_name, **options
+                    )
+                    return {"file": member.filename, **cls.parse(file_handler)}
+                except Exception as e:
+                    return {"file": member.filename, **cls.parse_error(e)}
+
+        workers = min(config["ARCHIVE_MAX_WORKERS"], len(members))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            files = list(pool.map(parse_member, members))
+        parsed = sum("data" in file for file in files)
+        return {
+            "files": files,
+            "summary": {"file_count": len(files), "parsed": parsed},
+        }, (200 if parsed else 400)
+
+
+class ChunkedUploadStart(Resource):
+    """
+    Starts a chunked upload of a file of `size` bytes. The chunks are then
+    sent with `PUT /uploads/<upload_id>?offset=<offset>`, and the upload
+    finished with `POST /uploads/<upload_id>/complete`.
+    """
+
+    @classmethod
+    def post(cls, *args, **kwargs):
+        config = current_app.config
+        try:
+            data = sch.SchemaChunkedUploadStart().load(request.get_json())
+        except ValidationError as e:
+            return {"status": "error", "msg": e.messages}, 400
+
+        file_ext = file_extension(data["filename"])
+        extensions = (
+            config["FILE_UPLOAD_EXTENSIONS"] + config["ARCHIVE_UPLOAD_EXTENSIONS"]
+        )
+        if file_ext not in extensions:
+            return {"status": "error", "msg": "Invalid file format"}, 400
+        if data["size"] > config["UPLOAD_MAX_BYTES"]:
+            return {"status": "error", "msg": "The file is too large"}, 413
+
+        ChunkedUpload.purge_expired(config["UPLOAD_DIR"], config["UPLOAD_TTL"])
+        upload = ChunkedUpload.create(
+            config["UPLOAD_DIR"], data["filename"], data["size"], data.get("checksum")
+        )
+        return {**upload.status(), "chunk_size": config["UPLOAD_CHUNK_BYTES"]}, 201
+
+
+class ChunkedUploadChunk(Resource):
+    @staticmethod
+    def get_upload(upload_id: str):
+        return ChunkedUpload.get(current_app.config["UPLOAD_DIR"], upload_id)
+
+    @classmethod
+    def get(cls, upload_id, *args, **kwargs):
+        """How much of the file has been received, to resume an upload from"""
+        upload = cls.get_upload(upload_id)
+        if upload is None:
+            return {"status": "error", "msg": "Upload does not exist"}, 404
+        return upload.status(), 200
+
+    @classmethod
+    def put(cls, upload_id, *args, **kwargs):
+        """
+        Appends the request body at `offset`, with its SHA-256 in the
+        `X-Chunk-Checksum` header. A chunk at the wrong offset is refused
+        with the offset to resume from.
+        """
+        upload = cls.get_upload(upload_id)
+        if upload is None:
+            return {"status": "error", "msg": "Upload does not exist"}, 404
+        offset = request.args.get("offset", type=int)
+        checksum = request.headers.get("X-Chunk-Checksum")
+        length = request.content_length
+        if offset is None or not checksum:
+            return {
+                "status": "error",
+                "msg": "An offset and an X-Chunk-Checksum header are required",
+            }, 400
+        if length is None:
+            return {"status": "error", "msg": "Content-Length is required"}, 411
+        if length > current_app.config["UPLOAD_CHUNK_BYTES"]:
+            return {"status": "error", "msg": "The chunk is too large"}, 413
+
+        try:
+            upload.append(offset, request.stream, length, checksum)
+        except ValueError as e:
+            return {"status": "error", "msg": str(e), "offset": upload.offset}, 409
+        return upload.status(), 200
+
+    @classmethod
+    def delete(cls, upload_id, *args, **kwargs):
+        upload = cls.get_upload(upload_id)
+        if upload is None:
+            return {"status": "error", "msg": "Upload does not exist"}, 404
+        upload.delete()
+        return {"status": "success"}, 200
+
+
+class ChunkedUploadComplete(Resource):
+    """
+    Checks that the whole file was received, then processes it like a
+    single upload to `/census/upload` or `/rates/upload`. The upload is
+    kept if processing fails, so that it can be tried again.
+    """
+
+    @limiter.limit("30/hour")
+    @limiter.limit("10/minute")
+    @limiter.limit("1/second")
+    def post(self, upload_id):
+        try:
+            data = sch.SchemaChunkedUploadComplete().load(request.get_json() or {})
+        except ValidationError as e:
+            return {"status": "error", "msg": e.messages}, 400
+        upload = ChunkedUploadChunk.get_upload(upload_id)
+        if upload is None:
+            return {"status": "error", "msg": "Upload does not exist"}, 404
+        try:
+            upload.verify()
+        except ValueError as e:
+            return {"status": "error", "msg": str(e), **upload.status()}, 400
+
+        if data["type"] == "rates":
+            response, status = RateUpload.save_upload(
+                upload, data.get("name") or upload.filename
+            )
+        else:
+            response, status = CensusParser.parse_upload(
+                upload,
+                data.get("name"),
+                data.get("census_master_id"),
+                rate_master_id=data.get("rate_master_id"),
+                partial=data["partial"],
+            )
+        if status < 400:
+            upload.delete()
+        return response, status
@@ -11,11 +11,20 @@ CENSUS_ROUTES = {
     "/census/<int:id>": res.CRUDCensusMaster,
     "/census/<int:id>/details": res.CRUDCensusDetailList,
     "/census/<int:id>/stats": res.CensusStats,
+    "/census/<int:id>/versions": res.CensusVersionList,
+    "/census/<int:id>/quarantine": res.CRUDCensusQuarantineList,
     "/census/upload": res.CensusParser,
     "/rates": res.CRUDRateMaster,
     "/rates/upload": res.RateUpload,
     "/rates/<int:id>": res.CRUDRateMaster,
+    "/uploads": res.ChunkedUploadStart,
+    "/uploads/<string:upload_id>": res.ChunkedUploadChunk,
+    "/uploads/<string:upload_id>/complete": res.ChunkedUploadComplete,
     "/save-age": res.SaveAgeCalc,
+    "/save-age/groups": res.SaveAgeGroups,
+    "/save-age/quote": res.SaveAgeQuote,
+    "/save-age/portfolio": res.PortfolioRun,
+    "/save-age/portfolio/<int:id>": res.PortfolioRun,
     "/dd/census": res.CRUDCensusMasterDropdownList,
     "/dd/rates": res.CRUDRateMasterDropdownList,
 }
@@ -1,4 +1,5 @@
 from extensions import ma
+from marshmallow import EXCLUDE, validate
 from shared import BaseSchema
 
 from . import models as md
@@ -12,6 +13,26 @@ class SchemaCensusDetail(BaseSchema):
         include_fk = True
 
 
+class SchemaCensusDetailBulk(ma.Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    census_detail_id = ma.Integer()
+    tab = ma.String(required=True)
+    birthdate = ma.Date(required=True)
+    relationship = ma.String(required=True)
+    tobacco_disposition = ma.String(required=True)
+    effective_date = ma.Date(required=True)
+
+
+class SchemaCensusDetailChanges(ma.Schema):
+    inserts = ma.List(ma.Nested(SchemaCensusDetailBulk), load_default=list)
+    updates = ma.List(
+        ma.Nested(SchemaCensusDetailBulk(partial=True)), load_default=list
+    )
+    deletes = ma.List(ma.Integer(), load_default=list)
+
+
 class SchemaCensusMaster(BaseSchema):
     class Meta:
         model = md.ModelCensusMaster
@@ -22,17 +43,11 @@ class SchemaCensusMaster(BaseSchema):
     census_details = ma.Nested(SchemaCensusDetail, many=True)
 
 
-class SchemaCensusMasterDropdown(BaseSchema):
-    census_master_id = ma.Integer(data_key="id")
-    census_name = ma.String(data_key="name")
-
-
-class SchemaCensusUpload(ma.Schema):
-    tab = ma.String()
-    birthdate = ma.Date()
-    relationship = ma.String()
-    tobacco_disposition = ma.String()
-    effective_date = ma.Date()
+class SchemaCensusVersion(BaseSchema):
+    class Meta:
+        model = md.ModelCensusVersion
+        load_instance = True
+        include_fk = True
 
 
 class SchemaRateUpload(ma.Schema):
@@ -62,28 +77,18 @@ class SchemaRateMaster(BaseSchema):
     rate_details = ma.Nested(SchemaRateDetail, many=True)
 
 
-class SchemaRateMasterDropdown(BaseSchema):
-    rate_master_id = ma.Integer(data_key="id")
-    rate_master_name = ma.String(data_key="name")
-
-
 class SchemaSaveAgeInputs(ma.Schema):
     effective_date = ma.Date(required=True)
     rate_master_id = ma.Integer(required=True)
     census_master_id = ma.Integer(required=True)
+    # an earlier version of the census, instead of the latest
+    census_version = ma.Integer(validate=validate.Range(min=1))
 
 
-class SchemaSaveAgeOutput(ma.Schema):
-    census_detail_id = ma.Integer()
-    relationship = ma.String()
-    tobacco_disposition = ma.String()
-    issue_age = ma.Integer()
-    birthdate = ma.Date("%Y-%m-%d")
-    save_age_effective_date = ma.Date("%Y-%m-%d")
-    new_effective_date = ma.Date("%Y-%m-%d")
-    save_age_rate = ma.Float()
-    new_rate = ma.Float()
-    diff = ma.Float()
+class SchemaSaveAgeQuoteInputs(ma.Schema):
+    effective_date = ma.Date(required=True)
+    rate_master_id = ma.Integer(required=True)
+    census = ma.Raw(required=True)
 
 
 class SchemaCensusConfigLLM(ma.Schema):
@@ -91,3 +96,46 @@ class SchemaCensusConfigLLM(ma.Schema):
     start_row_number = ma.Integer()
     start_column_number = ma.Integer()
     column_mapper = ma.Dict()
+
+
+class SchemaPortfolioRunInputs(ma.Schema):
+    census_master_ids = ma.Raw(required=True)
+    rate_master_id = ma.Integer(required=True)
+    effective_date = ma.Date(required=True)
+
+
+class SchemaPortfolioResult(BaseSchema):
+    class Meta:
+        model = md.ModelPortfolioResult
+        load_instance = True
+        include_fk = True
+
+
+class SchemaPortfolioRun(BaseSchema):
+    class Meta:
+        model = md.ModelPortfolioRun
+        load_instance = True
+        include_relationships = True
+        include_fk = True
+
+    portfolio_results = ma.Nested(SchemaPortfolioResult, many=True)
+
+
+class SchemaChunkedUploadStart(ma.Schema):
+    filename = ma.String(required=True, validate=validate.Length(min=1))
+    size = ma.Integer(required=True, validate=validate.Range(min=1))
+    # SHA-256 of the whole file
+    checksum = ma.String(validate=validate.Regexp(r"^[0-9a-fA-F]{64}$"))
+
+
+class SchemaChunkedUploadComplete(ma.Schema):
+    type = ma.String(
+        load_default="census", validate=validate.OneOf(["census", "rates"])
+    )
+    name = ma.String()
+    # append the rows to this census instead of creating one
+    census_master_id = ma.Integer()
+    # validate the rows against this rate table
+    rate_master_id = ma.Integer()
+    # load the valid rows and quarantine the rest
+    partial = ma.Boolean(load_default=False)
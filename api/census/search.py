@@ -0,0 +1,167 @@
+import logging
+from sqlalchemy import column, func, literal, select, table, text, union_all
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+from . import models as md
+
+logger = logging.getLogger(__name__)
+
+# search indexes that were installed, keyed by (engine url, table name)
+INSTALLED = set()
+
+
+class SearchIndex:
+    """
+    Prefix and trigram indexes over a single name column. On SQLite the
+    trigrams are an external content FTS5 table kept in sync with triggers;
+    on PostgreSQL they are a pg_trgm GIN index on the column itself.
+    """
+
+    def __init__(self, model, name_column: str):
+        self.model = model
+        self.name_column = name_column
+
+    @property
+    def table_name(self):
+        return self.model.__tablename__
+
+    @property
+    def id_column(self):
+        return self.model.__mapper__.primary_key[0].name
+
+    @property
+    def fts_name(self):
+        return f"{self.table_name}_fts"
+
+    @property
+    def fts(self):
+        return table(
+            self.fts_name, column("rowid"), column("rank"), column(self.fts_name)
+        )
+
+    @property
+    def vocab_name(self):
+        return f"{self.table_name}_fts_vocab"
+
+    def rare_trigrams(self, connection: Connection, trigrams, count: int):
+        """
+        The `count` trigrams found in the fewest names, skipping trigrams
+        that are not in any name
+        """
+        if not trigrams:
+            return []
+        # one equality lookup per trigram, since fts5vocab scans for IN
+        qry = union_all(
+            *(
+                select(
+                    literal(t).label("term"),
+                    func.coalesce(
+                        select(column("doc"))
+                        .select_from(table(self.vocab_name))
+                        .where(column("term") == t)
+                        .scalar_subquery(),
+                        0,
+                    ).label("doc"),
+                )
+                for t in trigrams
+            )
+        )
+        docs = connection.execute(qry).all()
+        return [term for term, doc in sorted(docs, key=lambda r: r[1]) if doc][:count]
+
+    def sqlite_ddl(self):
+        t, fts, id, name = (
+            self.table_name,
+            self.fts_name,
+            self.id_column,
+            self.name_column,
+        )
+        delete_old = f"INSERT INTO {fts}({fts}, rowid, {name}) VALUES ('delete', old.{id}, old.{name});"
+        insert_new = f"INSERT INTO {fts}(rowid, {name}) VALUES (new.{id}, new.{name});"
+        return [
+            f"CREATE INDEX IF NOT EXISTS ix_{t}_{name}_lower ON {t} (lower({name}))",
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({name}, content='{t}', content_rowid='{id}', tokenize='trigram')",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {t} BEGIN {insert_new} END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {t} BEGIN {delete_old} END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {name}, {id} ON {t} BEGIN {delete_old} {insert_new} END",
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.vocab_name} USING fts5vocab({fts}, 'row')",
+            # index rows that existed before the triggers
+            f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+        ]
+
+    def postgresql_ddl(self):
+        t, name = self.table_name, self.name_column
+        return [
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            f"CREATE INDEX IF NOT EXISTS ix_{t}_{name}_lower ON {t} (lower({name}) text_pattern_ops)",
+            f"CREATE INDEX IF NOT EXISTS ix_{t}_{name}_trgm ON {t} USING gin ({name} gin_trgm_ops)",
+        ]
+
+    def is_installed(self, connection: Connection):
+        if connection.dialect.name == "sqlite":
+            # the triggers are dropped along with the table, the FTS5 table is not
+            exists = connection.execute(
+                text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"
+                ),
+                {"name": f"{self.fts_name}_ai"},
+            ).first()
+        elif connection.dialect.name == "postgresql":
+            exists = connection.execute(
+                text("SELECT 1 FROM pg_indexes WHERE indexname = :name"),
+                {"name": f"ix_{self.table_name}_{self.name_column}_trgm"},
+            ).first()
+        else:
+            return False
+        return exists is not None
+
+    def install(self, connection: Connection):
+        """
+        Creates the index if it does not exist. Returns False if the database
+        does not support it, in which case searches fall back to subsequence matching.
+        """
+        key = (str(connection.engine.url), self.table_name)
+        if self.is_installed(connection):
+            INSTALLED.add(key)
+            return True
+
+        ddl = {"sqlite": self.sqlite_ddl, "postgresql": self.postgresql_ddl}.get(
+            connection.dialect.name
+        )
+        if ddl is None:
+            return False
+        try:
+            with connection.begin_nested():
+                for stmt in ddl():
+                    connection.execute(text(stmt))
+        except DBAPIError as e:
+            logger.warning("Search index on %s unavailable: %s", self.table_name, e)
+            return False
+        INSTALLED.add(key)
+        return True
+
+    def is_available(self, connection: Connection):
+        # the index may have been installed by another process, e.g. `flask init-db`
+        key = (str(connection.engine.url), self.table_name)
+        if key not in INSTALLED and self.is_installed(connection):
+            INSTALLED.add(key)
+        return key in INSTALLED
+
+
+SEARCH_INDEXES = []
+
+
+def register_search_index(model, name_column: str):
+    index = SearchIndex(model, name_column)
+    SEARCH_INDEXES.append(index)
+    return index
+
+
+def install_search_indexes(engine):
+    with engine.begin() as connection:
+        for index in SEARCH_INDEXES:
+            index.install(connection)
+
+
+CENSUS_MASTER_SEARCH = register_search_index(md.ModelCensusMaster, "census_name")
+RATE_MASTER_SEARCH = register_search_index(md.ModelRateMaster, "rate_master_name")
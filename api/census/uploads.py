@@ -0,0 +1,202 @@
+"""
+Chunked uploads. A file is sent in chunks to an upload directory on disk, so
+that an interrupted upload can carry on from the last chunk received, and
+is then read from the assembled file through a memory map.
+
+Each upload is a directory under the upload root holding `meta.json` and the
+`data` received so far. Workers only share the directory, so any worker can
+take the next chunk.
+"""
+
+import io
+import os
+import json
+import mmap
+import time
+import uuid
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+COPY_BUFFER_BYTES = 1024 * 1024
+
+
+def sha256_file(file, start: int = 0):
+    digest = hashlib.sha256()
+    file.seek(start)
+    while block := file.read(COPY_BUFFER_BYTES):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+class MappedFile(io.RawIOBase):
+    """A read-only file object over a memory map of the file at `path`"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.map.read(size)
+
+    def readinto(self, buffer):
+        data = self.map.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.map.seek(offset, whence)
+        return self.map.tell()
+
+    def tell(self):
+        return self.map.tell()
+
+    def close(self):
+        if not self.closed:
+            self.map.close()
+        super().close()
+
+
+class ChunkedUpload:
+    """
+    An upload of `size` bytes, which the file handlers take in place of an
+    uploaded file once it is complete. `checksum` is the SHA-256 of the whole
+    file, if the client gave one.
+    """
+
+    def __init__(self, root: str, upload_id: str):
+        self.upload_id = upload_id
+        self.directory = os.path.join(root, upload_id)
+        self.data_path = os.path.join(self.directory, "data")
+        with open(os.path.join(self.directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.filename = meta["filename"]
+        self.size = meta["size"]
+        self.checksum = meta.get("checksum")
+        self.created = meta["created"]
+
+    @classmethod
+    def create(cls, root: str, filename: str, size: int, checksum: str = None):
+        upload_id = uuid.uuid4().hex
+        directory = os.path.join(root, upload_id)
+        os.makedirs(directory)
+        open(os.path.join(directory, "data"), "wb").close()
+        meta = {
+            "filename": filename,
+            "size": size,
+            "checksum": checksum.lower() if checksum else None,
+            "created": time.time(),
+        }
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        return cls(root, upload_id)
+
+    @classmethod
+    def get(cls, root: str, upload_id: str):
+        # ids are uuid hex, which also keeps the path inside the root
+        try:
+            uuid.UUID(hex=upload_id)
+            return cls(root, upload_id)
+        except (ValueError, FileNotFoundError):
+            return None
+
+    @classmethod
+    def purge_expired(cls, root: str, ttl: float):
+        """Deletes the uploads last written to more than `ttl` seconds ago"""
+        if not os.path.isdir(root):
+            return
+        cutoff = time.time() - ttl
+        for entry in os.scandir(root):
+            if not entry.is_dir():
+                continue
+            try:
+                written = os.path.getmtime(os.path.join(entry.path, "data"))
+            except FileNotFoundError:
+                written = entry.stat().st_mtime
+            if written < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    @property
+    def offset(self):
+        """The number of bytes received so far"""
+        return os.path.getsize(self.data_path)
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+    @contextmanager
+    def locked(self):
+        with open(self.data_path, "r+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def append(self, offset: int, stream, length: int, checksum: str):
+        """
+        Writes a chunk of `length` bytes read from `stream` at `offset`, which
+        must be the end of the data received so far, and returns the new
+        offset. The chunk is written as it is read and truncated again if its
+        SHA-256 doesn't match `checksum`. A chunk that was already received
+        whole is skipped, so that a client can resend a chunk it didn't get
+        an answer for.
+        """
+        with self.locked() as f:
+            end = os.fstat(f.fileno()).st_size
+            if offset + length <= end:
+                return end
+            if offset != end:
+                raise ValueError(f"Expected the chunk at offset {end}")
+            if offset + length > self.size:
+                raise ValueError("The chunk goes past the end of the file")
+
+            digest = hashlib.sha256()
+            f.seek(offset)
+            remaining = length
+            while remaining:
+                block = stream.read(min(COPY_BUFFER_BYTES, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                f.write(block)
+                remaining -= len(block)
+            if remaining or digest.hexdigest() != checksum.lower():
+                f.truncate(offset)
+                raise ValueError("The chunk is incomplete or its checksum is wrong")
+            f.flush()
+            os.fsync(f.fileno())
+            return offset + length
+
+    def verify(self):
+        if not self.complete:
+            raise ValueError(f"Received {self.offset} of {self.size} bytes")
+        if self.size == 0:
+            raise ValueError("The file is empty")
+        if self.checksum:
+            with open(self.data_path, "rb") as f:
+                if sha256_file(f) != self.checksum:
+                    raise ValueError("The file checksum is wrong")
+
+    def open(self):
+        return MappedFile(self.data_path)
+
+    def delete(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def status(self):
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "size": self.size,
+            "offset": self.offset,
+            "complete": self.complete,
+        }
@@ -1,4 +1,29 @@
 import os
+import tempfile
+
+
+def engine_options(database_uri: str):
+    """
+    Connection pool settings. SQLite uses the SQLAlchemy defaults, while
+    PostgreSQL gets a sized, pre-pinged pool with server-side prepared statements.
+    """
+    options = {"query_cache_size": int(os.getenv("DB_QUERY_CACHE_SIZE", 1200))}
+    if database_uri and database_uri.startswith("postgresql"):
+        options.update(
+            {
+                "pool_size": int(os.getenv("DB_POOL_SIZE", 10)),
+                "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 20)),
+                "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", 30)),
+                "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+                "pool_pre_ping": True,
+            }
+        )
+    if database_uri and database_uri.startswith("postgresql+psycopg:"):
+        # psycopg 3 prepares a statement after it has run this many times
+        options["connect_args"] = {
+            "prepare_threshold": int(os.getenv("DB_PREPARE_THRESHOLD", 5))
+        }
+    return options
 
 
 class BaseConfig:
@@ -6,16 +31,70 @@ class BaseConfig:
     PERMANENT_SESSION_LIFETIME = 3600
     SECRET_KEY = os.getenv("SESSION_SECRET_KEY")
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URI")
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(os.getenv("DATABASE_URI"))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    FILE_UPLOAD_EXTENSIONS = [".xlsx", ".xls", ".xlsm", ".csv"]
+    SCHEMA_SETUP_ON_START = os.getenv("SCHEMA_SETUP_ON_START", "Y") == "Y"
+    FILE_UPLOAD_EXTENSIONS = [".xlsx", ".xls", ".xlsm", ".csv", ".csv.gz"]
+    ARCHIVE_UPLOAD_EXTENSIONS = [".zip"]
+    ARCHIVE_MAX_FILES = int(os.getenv("ARCHIVE_MAX_FILES", 20))
+    ARCHIVE_MAX_BYTES = int(os.getenv("ARCHIVE_MAX_BYTES", 512 * 1024 * 1024))
+    ARCHIVE_MAX_WORKERS = int(os.getenv("ARCHIVE_MAX_WORKERS", 4))
+    UPLOAD_DIR = os.getenv(
+        "UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "census-uploads")
+    )
+    UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 2 * 1024**3))
+    UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", 8 * 1024**2))
+    UPLOAD_TTL = int(os.getenv("UPLOAD_TTL", 24 * 3600))
+    # codes census rows are checked against when no rate table is chosen,
+    # comma separated; empty to allow any
+    CENSUS_RELATIONSHIP_CODES = [
+        code for code in os.getenv("CENSUS_RELATIONSHIP_CODES", "").split(",") if code
+    ]
+    CENSUS_TOBACCO_CODES = [
+        code for code in os.getenv("CENSUS_TOBACCO_CODES", "").split(",") if code
+    ]
+    CENSUS_VALIDATION_SAMPLE_ROWS = int(os.getenv("CENSUS_VALIDATION_SAMPLE_ROWS", 20))
+    # earlier census versions kept in census_snapshot, 0 to always rebuild
+    # them from the deltas
+    CENSUS_SNAPSHOT_LIMIT = int(os.getenv("CENSUS_SNAPSHOT_LIMIT", 20))
+    SQLITE_PRAGMAS = {
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000)),
+        "foreign_keys": "ON",
+        "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", -64000)),
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 268435456)),
+        "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+    }
+    SQLITE_SERIALIZED_WRITES = os.getenv("SQLITE_SERIALIZED_WRITES", "Y") == "Y"
+    PORTFOLIO_MAX_WORKERS = int(os.getenv("PORTFOLIO_MAX_WORKERS", os.cpu_count() or 1))
+    SQL_PROFILING = os.getenv("SQL_PROFILING", "N") == "Y"
+    SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", 100))
+    SQL_EXPLAIN_SLOW_QUERIES = os.getenv("SQL_EXPLAIN_SLOW_QUERIES", "Y") == "Y"
+    SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", 10))
+    SQL_PROFILE_HEADER = os.getenv("SQL_PROFILE_HEADER", "Y") == "Y"
+    REQUEST_PROFILING = False
+    PROFILES_DIR = os.getenv("PROFILES_DIR", "profiles")
+    LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", 6000))
+    LLM_PROMPT_SAMPLE_ROWS = int(os.getenv("LLM_PROMPT_SAMPLE_ROWS", 10))
+    LLM_PROMPT_MAX_CELL_CHARS = int(os.getenv("LLM_PROMPT_MAX_CELL_CHARS", 40))
+    LLM_PER_TAB_CALLS = os.getenv("LLM_PER_TAB_CALLS", "Y") == "Y"
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+    LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", 0))
+    RATELIMIT_ENABLED = os.getenv("RATELIMIT_ENABLED", "Y") == "Y"
 
 
 class DevConfig(BaseConfig):
     SESSION_COOKIE_SECURE = False
+    # opt in only: the profiles endpoints are unauthenticated
+    REQUEST_PROFILING = os.getenv("REQUEST_PROFILING", "N") == "Y"
 
 
 class TestConfig(BaseConfig):
     SESSION_COOKIE_SECURE = False
+    REQUEST_PROFILING = os.getenv("REQUEST_PROFILING", "N") == "Y"
 
 
 class ProdConfig(BaseConfig):
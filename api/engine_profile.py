@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import threading
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - windows
+    fcntl = None
+
+# per engine writer locks, see `apply_engine_profile`
+WRITERS = {}
+
+
+class SerializedWriter:
+    """
+    Serializes write transactions against a SQLite file across threads and
+    processes (e.g. gunicorn workers). Writers queue on a lock file instead of
+    spinning on SQLITE_BUSY, while readers are never blocked under WAL.
+
+    A session takes the lock at its first flush or DML statement and holds it
+    until its root transaction ends. Nothing slow, like the LLM stage of an
+    upload, may run between a session's first write and its commit, or every
+    other writer waits for it.
+    """
+
+    def __init__(self, lock_path: str = None):
+        self.lock_path = lock_path
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self.lock_path is not None and fcntl is not None:
+            self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def _set_pragmas(pragmas: dict):
+    def set_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+        cursor.close()
+
+    return set_pragmas
+
+
+def apply_engine_profile(engine: Engine, pragmas: dict, serialize_writes=True):
+    """
+    Applies the configured pragmas to every new SQLite connection and, if
+    enabled, registers a serialized writer for the engine
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    event.listen(engine, "connect", _set_pragmas(pragmas))
+
+    if serialize_writes:
+        database = engine.url.database
+        in_memory = not database or database == ":memory:"
+        WRITERS[engine] = SerializedWriter(None if in_memory else f"{database}.lock")
+
+
+def _writer_for(session: Session):
+    if not WRITERS or session.info.get("writer") is not None:
+        return None
+    try:
+        return WRITERS.get(session.get_bind())
+    except Exception:
+        return None
+
+
+def _acquire_writer(session: Session):
+    writer = _writer_for(session)
+    if writer is not None:
+        writer.acquire()
+        session.info["writer"] = writer
+
+
+@event.listens_for(Session, "before_flush")
+def _before_flush(session, flush_context, instances):
+    _acquire_writer(session)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _do_orm_execute(orm_execute_state):
+    if (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        _acquire_writer(orm_execute_state.session)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(session, transaction):
+    if transaction.parent is not None:
+        return
+    writer = session.info.pop("writer", None)
+    if writer is not None:
+        writer.release()
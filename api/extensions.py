@@ -5,6 +5,8 @@ from flask_marshmallow import Marshmallow
 from flask_restx import Api
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from engine_profile import apply_engine_profile
+from sql_profiler import init_sql_profiler
 
 
 db = SQLAlchemy()  # , engine_options={"fast_executemany": True})
@@ -18,9 +20,22 @@ limiter = Limiter(
 api = Api(doc="/api/doc/")
 
 
-def init_extensions(app: Flask):
+def init_database(app: Flask):
     db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_engine_profile(
+                engine,
+                app.config["SQLITE_PRAGMAS"],
+                serialize_writes=app.config["SQLITE_SERIALIZED_WRITES"],
+            )
+        init_sql_profiler(app, db.engines.values())
     ma.init_app(app)
+    return app, db
+
+
+def init_extensions(app: Flask):
+    init_database(app)
     limiter.init_app(app)
     app.config["SESSION_SQLALCHEMY"] = db
 
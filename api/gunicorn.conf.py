@@ -0,0 +1,35 @@
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", 1))
+threads = int(os.getenv("GUNICORN_THREADS", 1))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+# build the app once in the master, then fork the workers from it
+preload_app = os.getenv("GUNICORN_PRELOAD", "Y") == "Y"
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from app import warm_up
+
+        warm_up()
+
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    from extensions import db
+
+    # pooled connections opened by the master must not be shared with workers
+    with worker.app.wsgi().app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return
+    from prometheus_client import multiprocess
+
+    # drop the live gauge files of the dead worker
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,84 @@
+import os
+import time
+from contextlib import contextmanager
+from flask import Flask, Response, g, request
+from extensions import limiter
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+REQUEST_LATENCY = Histogram(
+    "census_parser_request_duration_seconds",
+    "Request latency by endpoint",
+    ["endpoint", "method", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+STAGE_LATENCY = Histogram(
+    "census_parser_upload_stage_duration_seconds",
+    "Time spent in each stage of a file upload",
+    ["handler", "stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+ROWS_PROCESSED = Counter(
+    "census_parser_rows_processed",
+    "Rows saved from uploaded files",
+    ["handler"],
+)
+LLM_ATTEMPTS = Counter(
+    "census_parser_llm_attempts",
+    "LLM requests by outcome, counting retries and hedged duplicates",
+    ["outcome"],
+)
+
+
+@contextmanager
+def stage_timer(handler: str, stage: str, timings: dict = None):
+    """
+    Times a block as an upload stage. If `timings` is given, the elapsed
+    seconds are also stored in it under the stage name.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(handler, stage).observe(elapsed)
+        if timings is not None:
+            timings[stage] = elapsed
+
+
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+def _observe_request(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_LATENCY.labels(endpoint, request.method, response.status_code).observe(
+            time.perf_counter() - start
+        )
+    return response
+
+
+def metrics():
+    # with multiple gunicorn workers, each worker writes its samples here
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app: Flask, path: str = "/api/metrics"):
+    app.before_request(_start_timer)
+    app.after_request(_observe_request)
+    app.add_url_rule(path, "metrics", limiter.exempt(metrics))
+    return app
@@ -0,0 +1,174 @@
+import io
+import os
+import re
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from flask import Flask, abort, jsonify, send_file
+from werkzeug.wrappers import Request
+
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_ID = re.compile(r"^[\w.-]+$")
+
+
+class RequestProfilerMiddleware:
+    """
+    Runs a request under cProfile and tracemalloc when it has an `X-Profile: Y`
+    header or a `profile=Y` query parameter. The pstats dump and a JSON summary
+    of the slowest functions and top allocation sites are written to
+    `profile_dir`, and the profile id is returned in `X-Profile-Id`.
+
+    tracemalloc is process wide, so one request is profiled at a time; others
+    run unprofiled while a profile is in progress.
+    """
+
+    def __init__(self, app, profile_dir: str, top: int = 25):
+        self.app = app
+        self.profile_dir = profile_dir
+        self.top = top
+        self._lock = threading.Lock()
+        os.makedirs(profile_dir, exist_ok=True)
+
+    @staticmethod
+    def is_requested(environ):
+        if environ.get("HTTP_X_PROFILE") == "Y":
+            return True
+        if "profile=" not in environ.get("QUERY_STRING", ""):
+            return False
+        return Request(environ).args.get("profile") == "Y"
+
+    def __call__(self, environ, start_response):
+        if not self.is_requested(environ) or not self._lock.acquire(blocking=False):
+            return self.app(environ, start_response)
+        try:
+            return self.profile(environ, start_response)
+        finally:
+            self._lock.release()
+
+    def profile(self, environ, start_response):
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        response = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            response["status"] = status
+            headers = [*headers, (PROFILE_ID_HEADER, profile_id)]
+            return start_response(status, headers, exc_info)
+
+        profiler = cProfile.Profile()
+        # leave tracemalloc running if it was started with -X tracemalloc
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+            # consume the body inside the profile so serialization is included
+            app_iter = self.app(environ, capture_start_response)
+            try:
+                body = b"".join(app_iter)
+            finally:
+                if hasattr(app_iter, "close"):
+                    app_iter.close()
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            profiler.disable()
+            if not was_tracing:
+                tracemalloc.stop()
+
+        self.save(
+            profile_id,
+            environ,
+            response.get("status"),
+            elapsed,
+            profiler,
+            snapshot,
+            peak,
+        )
+        return [body]
+
+    def save(self, profile_id, environ, status, elapsed, profiler, snapshot, peak):
+        profiler.dump_stats(os.path.join(self.profile_dir, f"{profile_id}.prof"))
+
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(
+            self.top
+        )
+        snapshot = snapshot.filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        allocations = [
+            {
+                "location": str(stat.traceback),
+                "size_kb": round(stat.size / 1024, 1),
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[: self.top]
+        ]
+        summary = {
+            "id": profile_id,
+            "method": environ.get("REQUEST_METHOD"),
+            "path": environ.get("PATH_INFO"),
+            "query_string": environ.get("QUERY_STRING"),
+            "status": status,
+            "elapsed_seconds": elapsed,
+            "peak_memory_kb": round(peak / 1024, 1),
+            "top_functions": stream.getvalue(),
+            "top_allocations": allocations,
+        }
+        with open(os.path.join(self.profile_dir, f"{profile_id}.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+def list_profiles(profile_dir: str):
+    profiles = []
+    for filename in sorted(os.listdir(profile_dir), reverse=True):
+        if not filename.endswith(".json"):
+            continue
+        with open(os.path.join(profile_dir, filename)) as f:
+            summary = json.load(f)
+        profiles.append(
+            {
+                k: summary[k]
+                for k in ("id", "method", "path", "status", "elapsed_seconds")
+            }
+        )
+    return profiles
+
+
+def init_request_profiler(app: Flask, prefix: str = "/api/profiles"):
+    """
+    Installs the profiling middleware and the endpoints serving its output,
+    if `REQUEST_PROFILING` is enabled. Otherwise nothing is installed.
+    """
+    if not app.config.get("REQUEST_PROFILING"):
+        return app
+    profile_dir = os.path.abspath(app.config["PROFILES_DIR"])
+    app.wsgi_app = RequestProfilerMiddleware(app.wsgi_app, profile_dir)
+
+    def profile_path(id: str, ext: str):
+        path = os.path.join(profile_dir, f"{id}.{ext}")
+        if not PROFILE_ID.match(id) or not os.path.exists(path):
+            abort(404)
+        return path
+
+    def get_profiles():
+        return jsonify(list_profiles(profile_dir))
+
+    def get_profile(id):
+        with open(profile_path(id, "json")) as f:
+            return jsonify(json.load(f))
+
+    def get_profile_stats(id):
+        return send_file(profile_path(id, "prof"), as_attachment=True)
+
+    app.add_url_rule(prefix, "profiles", get_profiles)
+    app.add_url_rule(f"{prefix}/<id>", "profile", get_profile)
+    app.add_url_rule(f"{prefix}/<id>/pstats", "profile_stats", get_profile_stats)
+    return app
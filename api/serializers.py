@@ -0,0 +1,39 @@
+import decimal
+import orjson
+from flask import Response
+from typing import Iterable, Sequence
+
+SHAPES = ["rows", "columnar"]
+
+
+def _default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def rows_to_payload(rows: Iterable[Sequence], columns: Sequence[str], shape="rows"):
+    """
+    Converts query result tuples into either a list of records or, if
+    `shape` is `columnar`, a dict with one array per column
+    """
+    columns = list(columns)
+    if shape == "rows":
+        return [dict(zip(columns, row)) for row in rows]
+    if shape == "columnar":
+        values = list(zip(*rows)) or [() for _ in columns]
+        return {col: list(vals) for col, vals in zip(columns, values)}
+    raise ValueError(f"Invalid shape. Must be one of {', '.join(SHAPES)}")
+
+
+def json_response(payload, status=200):
+    """
+    Encodes the payload with orjson, bypassing marshmallow and the flask-restx
+    json representation. Dates and datetimes are encoded as ISO 8601 strings.
+    """
+    body = orjson.dumps(
+        payload,
+        default=_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+    )
+    return Response(body, status=status, mimetype="application/json")
@@ -5,7 +5,7 @@ from extensions import db, ma
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.inspection import inspect
 from marshmallow import post_dump
-from flask import request
+from flask import request, Response
 from flask_restx import Resource
 
 
@@ -19,20 +19,12 @@ class BaseSchema(ma.SQLAlchemyAutoSchema):
 
     @post_dump(pass_many=True)
     def formatDecimal(self, data, many, **kwargs):
-        if many:
-            return [
-                {
-                    k: v if not isinstance(v, decimal.Decimal) else float(v)
-                    for k, v in item.items()
-                }
-                for item in data
-            ]
-        else:
-            new_data = {
-                k: v if not isinstance(v, decimal.Decimal) else float(v)
-                for k, v in data.items()
-            }
-            return new_data
+        items = data if many else [data]
+        for item in items:
+            for k, v in item.items():
+                if isinstance(v, decimal.Decimal):
+                    item[k] = float(v)
+        return data
 
 
 class BaseModel(db.Model):
@@ -214,6 +206,8 @@ class BaseListResource(Resource):
             return {"status": "error", "msg": "Method not allowed"}, 405
         try:
             data = cls.list(*args, **request.args, **kwargs)
+            if isinstance(data, Response):
+                return data
             return data, 200
         except NotImplementedError as e:
             return {"status": "error", "msg": str(e)}, 405
@@ -0,0 +1,129 @@
+import datetime
+from sqlalchemy import Date, DateTime, Integer, String, literal
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.sql.visitors import InternalTraversal
+
+
+def _as_date_expression(dt):
+    """
+    Python dates (or ISO date strings) become typed bind parameters so that
+    dialects with strict typing, like PostgreSQL, can apply date functions to them
+    """
+    if isinstance(dt, str):
+        dt = datetime.date.fromisoformat(dt)
+    if isinstance(dt, datetime.datetime):
+        return literal(dt, DateTime)
+    if isinstance(dt, datetime.date):
+        return literal(dt, Date)
+    return dt
+
+
+class DatePart(FunctionElement):
+    """
+    Integer year, month or day of a date
+    """
+
+    type = Integer()
+    inherit_cache = True
+    # the field changes the SQL, so it must be part of the statement cache key
+    _traverse_internals = FunctionElement._traverse_internals + [
+        ("field", InternalTraversal.dp_string)
+    ]
+    SQLITE_FORMATS = {"year": "%Y", "month": "%m", "day": "%d"}
+
+    def __init__(self, field, dt):
+        if field not in self.SQLITE_FORMATS:
+            raise ValueError(f"Invalid date part {field}")
+        self.field = field
+        super().__init__(_as_date_expression(dt))
+
+
+class YYYYMMDD(FunctionElement):
+    """
+    Date as an integer of the form YYYYMMDD. The difference of two of these,
+    integer divided by 10000, is the number of whole years between the dates.
+    """
+
+    type = Integer()
+    inherit_cache = True
+
+    def __init__(self, dt):
+        super().__init__(_as_date_expression(dt))
+
+
+class YearMonth(FunctionElement):
+    """
+    Date formatted as a YYYY-MM string
+    """
+
+    type = String()
+    inherit_cache = True
+
+    def __init__(self, dt):
+        super().__init__(_as_date_expression(dt))
+
+
+@compiles(DatePart)
+def _date_part(element, compiler, **kw):
+    arg = compiler.process(element.clauses, **kw)
+    return f"CAST(EXTRACT({element.field.upper()} FROM {arg}) AS INTEGER)"
+
+
+@compiles(DatePart, "sqlite")
+def _date_part_sqlite(element, compiler, **kw):
+    fmt = element.SQLITE_FORMATS[element.field]
+    arg = compiler.process(element.clauses, **kw)
+    return f"CAST(strftime('{fmt}', {arg}) AS INTEGER)"
+
+
+@compiles(YYYYMMDD)
+def _yyyymmdd(element, compiler, **kw):
+    arg = compiler.process(element.clauses, **kw)
+    return (
+        f"(CAST(EXTRACT(YEAR FROM {arg}) AS INTEGER) * 10000"
+        f" + CAST(EXTRACT(MONTH FROM {arg}) AS INTEGER) * 100"
+        f" + CAST(EXTRACT(DAY FROM {arg}) AS INTEGER))"
+    )
+
+
+@compiles(YYYYMMDD, "postgresql")
+def _yyyymmdd_postgresql(element, compiler, **kw):
+    arg = compiler.process(element.clauses, **kw)
+    return f"CAST(to_char({arg}, 'YYYYMMDD') AS INTEGER)"
+
+
+@compiles(YYYYMMDD, "sqlite")
+def _yyyymmdd_sqlite(element, compiler, **kw):
+    arg = compiler.process(element.clauses, **kw)
+    return f"CAST(strftime('%Y%m%d', {arg}) AS INTEGER)"
+
+
+@compiles(YearMonth)
+def _year_month(element, compiler, **kw):
+    return f"to_char({compiler.process(element.clauses, **kw)}, 'YYYY-MM')"
+
+
+@compiles(YearMonth, "sqlite")
+def _year_month_sqlite(element, compiler, **kw):
+    return f"strftime('%Y-%m', {compiler.process(element.clauses, **kw)})"
+
+
+def year(dt):
+    return DatePart("year", dt)
+
+
+def month(dt):
+    return DatePart("month", dt)
+
+
+def day(dt):
+    return DatePart("day", dt)
+
+
+def yyyymmdd(dt):
+    return YYYYMMDD(dt)
+
+
+def year_month(dt):
+    return YearMonth(dt)
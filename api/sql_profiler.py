@@ -0,0 +1,165 @@
+import time
+import logging
+from collections import Counter
+from flask import Flask, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_PREFIXES = {"sqlite": "EXPLAIN QUERY PLAN ", "postgresql": "EXPLAIN "}
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+class QueryStats:
+    """
+    Queries executed while handling a single request
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.slow = 0
+        self.statements = Counter()
+
+    def record(self, statement: str, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.statements[statement] += 1
+
+    @property
+    def most_repeated(self):
+        if not self.statements:
+            return None, 0
+        return self.statements.most_common(1)[0]
+
+    def summary(self):
+        return (
+            f"count={self.count}; time_ms={self.total_ms:.1f}; "
+            f"slow={self.slow}; max_repeat={self.most_repeated[1]}"
+        )
+
+
+class QueryProfiler:
+    """
+    Times every statement through SQLAlchemy's cursor events. Statements over
+    `slow_ms` are logged with their parameters and, if `explain` is set, the
+    plan. Inside a request, queries are tallied on `g.sql_stats`.
+    """
+
+    HEADER = "X-SQL-Queries"
+
+    def __init__(self, slow_ms=100, explain=True, repeat_threshold=10, header=True):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.repeat_threshold = repeat_threshold
+        self.header = header
+
+    def attach(self, engine: Engine):
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def init_app(self, app: Flask):
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    @staticmethod
+    def request_stats():
+        if has_request_context():
+            return g.get("sql_stats")
+        return None
+
+    def before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        # kept on the execution context, which is discarded if the statement
+        # raises; context is None only for the dialect's own setup queries
+        if context is not None:
+            context.sql_profiler_start = time.perf_counter()
+
+    def after_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        start = getattr(context, "sql_profiler_start", None)
+        if start is None:
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        stats = self.request_stats()
+        if stats is not None:
+            stats.record(statement, elapsed_ms)
+        if elapsed_ms < self.slow_ms:
+            return
+
+        if stats is not None:
+            stats.slow += 1
+        plan = None
+        if self.explain and not executemany:
+            plan = self.explain_plan(conn.dialect.name, cursor, statement, parameters)
+        logger.warning(
+            "Slow query (%.1f ms): %s\nParameters: %r\nPlan:\n%s",
+            elapsed_ms,
+            statement,
+            parameters,
+            plan,
+        )
+
+    @staticmethod
+    def explain_plan(dialect: str, cursor, statement: str, parameters):
+        prefix = EXPLAIN_PREFIXES.get(dialect)
+        if prefix is None or not statement.lstrip().upper().startswith(EXPLAINABLE):
+            return None
+        # a failed statement aborts the whole transaction on PostgreSQL
+        savepoint = dialect == "postgresql"
+        explain_cursor = cursor.connection.cursor()
+        try:
+            if savepoint:
+                explain_cursor.execute("SAVEPOINT sql_profiler_explain")
+            explain_cursor.execute(prefix + statement, parameters)
+            rows = explain_cursor.fetchall()
+            if savepoint:
+                explain_cursor.execute("RELEASE SAVEPOINT sql_profiler_explain")
+        except Exception as e:
+            if savepoint:
+                explain_cursor.execute("ROLLBACK TO SAVEPOINT sql_profiler_explain")
+            return f"EXPLAIN failed: {e}"
+        finally:
+            explain_cursor.close()
+        return "\n".join(" | ".join(str(val) for val in row) for row in rows)
+
+    def start_request(self):
+        g.sql_stats = QueryStats()
+
+    def finish_request(self, response):
+        stats = g.pop("sql_stats", None)
+        if stats is None:
+            return response
+        statement, repeats = stats.most_repeated
+        if repeats >= self.repeat_threshold:
+            logger.warning(
+                "%s %s ran the same query %d times, possible N+1: %s",
+                request.method,
+                request.path,
+                repeats,
+                statement,
+            )
+        if self.header:
+            response.headers[self.HEADER] = stats.summary()
+        return response
+
+
+def init_sql_profiler(app: Flask, engines):
+    """
+    Attaches a `QueryProfiler` to the engines if `SQL_PROFILING` is enabled
+    """
+    if not app.config.get("SQL_PROFILING"):
+        return None
+    profiler = QueryProfiler(
+        slow_ms=app.config["SQL_SLOW_QUERY_MS"],
+        explain=app.config["SQL_EXPLAIN_SLOW_QUERIES"],
+        repeat_threshold=app.config["SQL_REPEAT_THRESHOLD"],
+        header=app.config["SQL_PROFILE_HEADER"],
+    )
+    for engine in engines:
+        profiler.attach(engine)
+    profiler.init_app(app)
+    return profiler
@@ -0,0 +1,95 @@
+import pytest
+
+DETAIL = {
+    "tab": "Members",
+    "relationship": "EE",
+    "tobacco_disposition": "N",
+    "effective_date": "2020-01-01",
+}
+
+
+def detail(year):
+    return {**DETAIL, "birthdate": f"{year}-01-01"}
+
+
+def create_census(client, years):
+    from extensions import db
+    from census import models as md
+
+    census = md.ModelCensusMaster(census_name="Versions")
+    db.session.add(census)
+    db.session.flush()
+    db.session.add(
+        md.ModelCensusVersion(census_master_id=census.census_master_id, version=1)
+    )
+    db.session.commit()
+    id = census.census_master_id
+    response = client.patch(
+        f"/api/census/{id}",
+        json={"census_detail_changes": {"inserts": [detail(y) for y in years]}},
+    )
+    assert response.status_code == 201
+    return id
+
+
+def details(client, id, version=None):
+    query = f"?version={version}" if version else ""
+    response = client.get(f"/api/census/{id}/details{query}")
+    assert response.status_code == 200
+    return sorted(
+        (row["census_detail_id"], row["birthdate"]) for row in response.get_json()
+    )
+
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        yield app
+
+
+def test_deleted_detail_id_reused_in_same_version(ctx, client, dialect):
+    id = create_census(client, [1970, 1980, 1990])
+    before = details(client, id)
+    last = before[-1][0]
+
+    # deleting the newest detail lets SQLite reuse its id for the insert,
+    # PostgreSQL sequences never do
+    response = client.patch(
+        f"/api/census/{id}",
+        json={"census_detail_changes": {"deletes": [last], "inserts": [detail(2000)]}},
+    )
+    assert response.status_code == 201
+    after = details(client, id)
+    assert after[-1][1] == "2000-01-01"
+    if dialect == "sqlite":
+        assert after[-1][0] == last
+
+    assert details(client, id, version=2) == before
+    # read again from the cached snapshot
+    assert details(client, id, version=2) == before
+
+
+def test_snapshot_limit_is_per_census(ctx, client):
+    from census import models as md
+
+    limit = ctx.config["CENSUS_SNAPSHOT_LIMIT"]
+    ctx.config["CENSUS_SNAPSHOT_LIMIT"] = 1
+    try:
+        ids = []
+        for year in (1960, 1965):
+            id = create_census(client, [year])
+            client.patch(
+                f"/api/census/{id}",
+                json={"census_detail_changes": {"inserts": [detail(year + 1)]}},
+            )
+            ids.append(id)
+        for id in ids:
+            details(client, id, version=2)
+
+        cached = md.ModelCensusVersion.query.filter(
+            md.ModelCensusVersion.census_master_id.in_(ids),
+            md.ModelCensusVersion.snapshot_dts.is_not(None),
+        ).all()
+        assert sorted(v.census_master_id for v in cached) == ids
+    finally:
+        ctx.config["CENSUS_SNAPSHOT_LIMIT"] = limit
@@ -0,0 +1,100 @@
+import time
+import datetime
+import threading
+
+import pytest
+
+from engine_profile import WRITERS
+
+BULK_ROWS = 50000
+# a read blocked by the writer would wait out SQLITE_BUSY_TIMEOUT (5s)
+READ_BOUND_SECONDS = 2
+
+
+def census_rows(census_master_id, count):
+    return [
+        {
+            "census_master_id": census_master_id,
+            "tab": "Members",
+            "birthdate": datetime.date(1980, 1, 1) + datetime.timedelta(days=i % 9000),
+            "relationship": "EE",
+            "tobacco_disposition": "N",
+            "effective_date": datetime.date(2020, 1, 1),
+        }
+        for i in range(count)
+    ]
+
+
+def census_count(response):
+    return sum(row["count"] for row in response.get_json()["relationship_stats"])
+
+
+def test_reads_progress_during_bulk_insert(app, client, dialect):
+    if dialect != "sqlite":
+        pytest.skip("the writer lock is SQLite only")
+    from extensions import db
+    from census import models as md
+
+    with app.app_context():
+        census = md.ModelCensusMaster(census_name="Concurrency")
+        db.session.add(census)
+        db.session.flush()
+        census_master_id = census.census_master_id
+        db.session.execute(
+            db.insert(md.ModelCensusDetail), census_rows(census_master_id, 10)
+        )
+        db.session.commit()
+        writer = WRITERS[db.engine]
+
+    inserted = threading.Event()
+    reads_done = threading.Event()
+    errors = []
+
+    def bulk_insert():
+        try:
+            with app.app_context():
+                db.session.execute(
+                    db.insert(md.ModelCensusDetail),
+                    census_rows(census_master_id, BULK_ROWS),
+                )
+                inserted.set()
+                # keep the write transaction, and the writer lock, open
+                # until the reads are done
+                reads_done.wait(30)
+                db.session.commit()
+        except Exception as e:
+            errors.append(e)
+            inserted.set()
+
+    second_writer = threading.Event()
+
+    def write():
+        with writer:
+            second_writer.set()
+
+    thread = threading.Thread(target=bulk_insert)
+    thread.start()
+    try:
+        assert inserted.wait(60)
+        assert not errors
+        # another writer queues behind the bulk insert
+        threading.Thread(target=write, daemon=True).start()
+        assert not second_writer.wait(0.2)
+
+        for _ in range(3):
+            start = time.perf_counter()
+            response = client.get(f"/api/census/{census_master_id}/stats")
+            elapsed = time.perf_counter() - start
+            assert response.status_code == 200
+            assert elapsed < READ_BOUND_SECONDS
+            # the read sees the census as it was before the insert
+            assert census_count(response) == 10
+    finally:
+        reads_done.set()
+        thread.join(60)
+
+    assert not errors
+    # and gets the lock once the insert commits
+    assert second_writer.wait(5)
+    response = client.get(f"/api/census/{census_master_id}/stats")
+    assert census_count(response) == 10 + BULK_ROWS
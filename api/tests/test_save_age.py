@@ -0,0 +1,136 @@
+import datetime
+
+import pytest
+
+EFFECTIVE_DATE = "2025-01-01"
+# (birthdate, relationship, tobacco_disposition, effective_date); the
+# duplicate rows make one cohort of three
+CENSUS = [
+    ("1980-06-15", "EE", "N", "2020-06-15"),
+    ("1980-06-15", "EE", "N", "2020-06-15"),
+    ("1980-06-15", "EE", "N", "2020-06-15"),
+    ("1991-02-28", "SP", "T", "2021-03-01"),
+    ("2000-02-29", "CH", "N", "2020-02-28"),
+    ("1955-12-31", "EE", "T", "2019-01-01"),
+]
+
+
+def issue_age(birthdate, as_of):
+    born = datetime.date.fromisoformat(birthdate)
+    as_of = datetime.date.fromisoformat(as_of)
+    return as_of.year - born.year - ((as_of.month, as_of.day) < (born.month, born.day))
+
+
+def rate(age, tobacco):
+    # five year bands, so that moving up a band changes the rate
+    return 10 + age // 5 + (5 if tobacco == "T" else 0)
+
+
+@pytest.fixture(scope="module")
+def census(app):
+    from extensions import db
+    from census import models as md
+
+    with app.app_context():
+        rates = md.ModelRateMaster(rate_master_name="Save age rates")
+        census = md.ModelCensusMaster(census_name="Save age")
+        db.session.add_all([rates, census])
+        db.session.flush()
+        db.session.execute(
+            db.insert(md.ModelRateDetail),
+            [
+                {
+                    "rate_master_id": rates.rate_master_id,
+                    "lower_age": lower,
+                    "upper_age": lower + 4,
+                    "relationship": relationship,
+                    "tobacco_disposition": tobacco,
+                    "rate": rate(lower, tobacco),
+                }
+                for lower in range(0, 100, 5)
+                for relationship in ("EE", "SP", "CH")
+                for tobacco in ("N", "T")
+            ],
+        )
+        db.session.execute(
+            db.insert(md.ModelCensusDetail),
+            [
+                {
+                    "census_master_id": census.census_master_id,
+                    "tab": "Members",
+                    "birthdate": datetime.date.fromisoformat(birthdate),
+                    "relationship": relationship,
+                    "tobacco_disposition": tobacco,
+                    "effective_date": datetime.date.fromisoformat(effective_date),
+                }
+                for birthdate, relationship, tobacco, effective_date in CENSUS
+            ],
+        )
+        db.session.commit()
+        return {
+            "census_master_id": census.census_master_id,
+            "rate_master_id": rates.rate_master_id,
+            "effective_date": EFFECTIVE_DATE,
+        }
+
+
+def expected_rows():
+    rows = []
+    for birthdate, relationship, tobacco, effective_date in CENSUS:
+        save_age = rate(issue_age(birthdate, effective_date), tobacco)
+        new = rate(issue_age(birthdate, EFFECTIVE_DATE), tobacco)
+        rows.append((relationship, issue_age(birthdate, effective_date), save_age, new))
+    return rows
+
+
+def test_save_age_rows(client, census):
+    response = client.post("/api/save-age", json=census)
+    assert response.status_code == 200
+    rows = sorted(
+        (row["relationship"], row["issue_age"], row["save_age_rate"], row["new_rate"])
+        for row in response.get_json()["data"]
+    )
+    assert rows == sorted(expected_rows())
+
+
+def test_cohort_stats_match_row_stats(client, census):
+    rows = client.post("/api/save-age", json=census).get_json()["stats"]
+    cohort = client.post("/api/save-age?mode=cohort", json=census).get_json()
+    assert cohort["stats"]["count"] == len(CENSUS)
+    for key, value in rows.items():
+        assert cohort["stats"][key] == pytest.approx(value)
+    assert len(cohort["data"]) == len(CENSUS)
+
+
+def test_issue_age_band_groups(client, census):
+    response = client.post(
+        "/api/save-age/groups?group_by=issue_age_band&band_width=10", json=census
+    )
+    assert response.status_code == 200
+    counts = {
+        row["issue_age_band"]: row["count"] for row in response.get_json()["data"]
+    }
+    expected = {}
+    for _, age, _, _ in expected_rows():
+        expected[age // 10 * 10] = expected.get(age // 10 * 10, 0) + 1
+    assert counts == expected
+
+
+def test_census_stats(client, census):
+    response = client.get(f"/api/census/{census['census_master_id']}/stats")
+    assert response.status_code == 200
+    stats = response.get_json()
+    ages = {row["issue_age"]: row["count"] for row in stats["issue_age_stats"]}
+    expected = {}
+    for birthdate, _, _, effective_date in CENSUS:
+        age = issue_age(birthdate, effective_date)
+        expected[age] = expected.get(age, 0) + 1
+    assert ages == expected
+
+    today = datetime.date.today().isoformat()
+    tenures = {row["tenure"]: row["count"] for row in stats["tenure_stats"]}
+    expected = {}
+    for *_, effective_date in CENSUS:
+        tenure = issue_age(effective_date, today)
+        expected[tenure] = expected.get(tenure, 0) + 1
+    assert tenures == expected
@@ -0,0 +1,128 @@
+import datetime
+
+import pytest
+from sqlalchemy import (
+    Column,
+    Date,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    literal,
+    select,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+
+import sql_functions as sf
+from census import models as md
+from census.mixins import SaveAgeGroupingMixin
+
+DIALECTS = {"sqlite": sqlite.dialect(), "postgresql": postgresql.dialect()}
+CENSUS = md.ModelCensusDetail
+EFFECTIVE_DATE = datetime.date(2025, 1, 1)
+
+# the columns of a save age subquery that can be grouped by
+save_age = Table(
+    "save_age",
+    MetaData(),
+    Column("relationship", String),
+    Column("tobacco_disposition", String),
+    Column("issue_age", Integer),
+    Column("save_age_effective_date", Date),
+)
+
+
+def compile_sql(expression, dialect):
+    return str(
+        expression.compile(
+            dialect=DIALECTS[dialect], compile_kwargs={"literal_binds": True}
+        )
+    )
+
+
+def band(subquery=save_age, band_width=5):
+    columns = SaveAgeGroupingMixin.group_columns(subquery, band_width=band_width)
+    return columns["issue_age_band"][0]
+
+
+EXPRESSIONS = {
+    "year": lambda: sf.year(CENSUS.birthdate),
+    "month": lambda: sf.month(CENSUS.birthdate),
+    "day": lambda: sf.day(EFFECTIVE_DATE),
+    "yyyymmdd": lambda: sf.yyyymmdd(CENSUS.birthdate),
+    "year_month": lambda: sf.year_month(CENSUS.effective_date),
+    "issue_age": lambda: CENSUS.issue_age,
+    "issue_age_as_of": lambda: CENSUS.issue_age_as_of(EFFECTIVE_DATE),
+    "issue_age_band": band,
+}
+
+
+@pytest.mark.parametrize("dialect", DIALECTS)
+@pytest.mark.parametrize("name", EXPRESSIONS)
+def test_expressions_compile(name, dialect):
+    sql = compile_sql(EXPRESSIONS[name](), dialect)
+    # integer arithmetic only, a NUMERIC quotient rounds when cast back
+    assert "NUMERIC" not in sql
+    assert ("strftime" in sql) == (dialect == "sqlite" and name != "issue_age_band")
+
+
+@pytest.mark.parametrize(
+    "name, sql",
+    [
+        ("year", "CAST(EXTRACT(YEAR FROM census_detail.birthdate) AS INTEGER)"),
+        ("year_month", "to_char(census_detail.effective_date, 'YYYY-MM')"),
+        ("issue_age_band", "(save_age.issue_age / 5) * 5"),
+    ],
+)
+def test_postgresql_sql(name, sql):
+    assert compile_sql(EXPRESSIONS[name](), "postgresql") == sql
+
+
+@pytest.fixture(scope="module")
+def connection(app):
+    """A connection to the test database, SQLite or PostgreSQL"""
+    from extensions import db
+
+    with app.app_context():
+        with db.engine.connect() as connection:
+            yield connection
+
+
+def evaluate(connection, expression):
+    return connection.execute(select(expression)).scalar()
+
+
+@pytest.mark.parametrize(
+    "birthdate, as_of, age",
+    [
+        (datetime.date(1980, 6, 15), datetime.date(2025, 6, 14), 44),
+        (datetime.date(1980, 6, 15), datetime.date(2025, 6, 15), 45),
+        (datetime.date(2000, 2, 29), datetime.date(2025, 2, 28), 24),
+        (datetime.date(2000, 2, 29), datetime.date(2025, 3, 1), 25),
+        (datetime.date(2024, 12, 31), datetime.date(2025, 1, 1), 0),
+    ],
+)
+def test_age_expression(connection, birthdate, as_of, age):
+    assert evaluate(connection, CENSUS.age_expression(birthdate, as_of)) == age
+
+
+def test_date_parts(connection):
+    dt = datetime.date(2025, 3, 7)
+    assert evaluate(connection, sf.year(dt)) == 2025
+    assert evaluate(connection, sf.month(dt)) == 3
+    assert evaluate(connection, sf.day(dt)) == 7
+    assert evaluate(connection, sf.yyyymmdd(dt)) == 20250307
+    assert evaluate(connection, sf.year_month(dt)) == "2025-03"
+
+
+@pytest.mark.parametrize(
+    "age, band_width, lower", [(24, 5, 20), (25, 5, 25), (29, 10, 20), (0, 5, 0)]
+)
+def test_issue_age_band(connection, age, band_width, lower):
+    subquery = select(
+        literal("EE").label("relationship"),
+        literal("N").label("tobacco_disposition"),
+        literal(age, Integer).label("issue_age"),
+        literal(EFFECTIVE_DATE, Date).label("save_age_effective_date"),
+    ).subquery()
+    assert evaluate(connection, band(subquery, band_width)) == lower